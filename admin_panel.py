@@ -35,7 +35,7 @@ class AdminPanel:
         """מחזיר סטטיסטיקות כלליות של המערכת"""
         try:
             # קבלת כל הזוגות והוצאות
-            couples = self.db.get_all_active_couples()
+            couples = await self.db.get_all_active_couples_async()
             total_couples = len(couples)
             
             # סטטיסטיקות הוצאות
@@ -51,7 +51,7 @@ class AdminPanel:
                 if not group_id:
                     continue
                 
-                expenses = self.db.get_expenses_by_group(group_id)
+                expenses = await self.db.get_expenses_by_group_async(group_id)
                 
                 for expense in expenses:
                     if expense.get('status') != 'active':
@@ -107,7 +107,7 @@ class AdminPanel:
     async def get_couples_data(self) -> List[Dict]:
         """מחזיר נתוני כל הזוגות עם סטטיסטיקות"""
         try:
-            couples = self.db.get_all_active_couples()
+            couples = await self.db.get_all_active_couples_async()
             couples_data = []
             
             for couple in couples:
@@ -133,7 +133,7 @@ class AdminPanel:
                     continue
                 
                 # הוצאות הקבוצה
-                expenses = self.db.get_expenses_by_group(group_id)
+                expenses = await self.db.get_expenses_by_group_async(group_id)
                 
                 total_amount = 0
                 active_expenses = 0
@@ -184,8 +184,8 @@ class AdminPanel:
     async def get_group_expenses(self, group_id: str) -> Dict:
         """מחזיר הוצאות של קבוצה ספציפית"""
         try:
-            expenses = self.db.get_expenses_by_group(group_id, include_deleted=True)
-            couple = self.db.get_couple_by_group_id(group_id)
+            expenses = await self.db.get_expenses_by_group_async(group_id, include_deleted=True)
+            couple = await self.db.get_couple_by_group_id_async(group_id)
             
             return {
                 'group_id': group_id,
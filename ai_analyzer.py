@@ -1,59 +1,154 @@
 import re
 import json
+import random
 import base64
+import asyncio
 import logging
 from datetime import datetime
 from typing import Dict, Optional, List, Tuple
-from openai import OpenAI
+import openai
+from openai import OpenAI, AsyncOpenAI
 from config import *
+from vendor_classifier import vendor_classifier
+from category_cache import VendorCategoryCache
+from vendor_index import normalize_vendor_name
+from update_intent import classify_update_intent, UPDATE, NOT_UPDATE
 
 logger = logging.getLogger(__name__)
 
 class AIAnalyzer:
     """מנתח תמונות קבלות עם OpenAI ומזהה עדכונים"""
     
-    def __init__(self):
+    # שגיאות זמניות שכדאי לנסות שוב
+    RETRYABLE_ERRORS = (
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.RateLimitError,
+        openai.InternalServerError
+    )
+    
+    def __init__(self, category_cache: Optional[VendorCategoryCache] = None):
         self.client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
         if not self.client:
             logger.warning("OpenAI client not initialized - API key missing")
+        
+        # לקוח אסינכרוני לשימוש מתוך ה-webhook - ה-retry מנוהל כאן ולא בספרייה
+        self.async_client = AsyncOpenAI(api_key=OPENAI_API_KEY, max_retries=0) if OPENAI_API_KEY else None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        
+        # סיווג ספקים מקומי (regex מקומפל) - משותף לכל המופעים
+        self.vendor_classifier = vendor_classifier
+        
+        # סיווגי LLM שמורים - ספק לא נשלח שוב ל-OpenAI (גם מקבוצה אחרת)
+        self.category_cache = category_cache
+        self._categorizing: Dict[str, asyncio.Future] = {}
+    
+    # === קריאות ל-OpenAI ===
+    
+    def _complete(self, messages: List[Dict], temperature: float, max_tokens: int,
+                  model: str = None, timeout: float = None) -> str:
+        """קריאה סינכרונית ל-chat completions ומחזיר את תוכן התשובה"""
+        response = self.client.chat.completions.create(
+            model=model or AI_SETTINGS["model"],
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=timeout or AI_SETTINGS["text_timeout_seconds"]
+        )
+        return response.choices[0].message.content.strip()
+    
+    async def _complete_async(self, messages: List[Dict], temperature: float, max_tokens: int,
+                              model: str = None, timeout: float = None) -> str:
+        """קריאה אסינכרונית עם הגבלת מקביליות, timeout ו-retry עם jitter"""
+        if self._semaphore is None:
+            # נוצר בתוך ה-event loop הפעיל
+            self._semaphore = asyncio.Semaphore(AI_SETTINGS["max_concurrent_requests"])
+        
+        max_retries = AI_SETTINGS["max_retries"]
+        
+        for attempt in range(max_retries + 1):
+            try:
+                async with self._semaphore:
+                    response = await self.async_client.chat.completions.create(
+                        model=model or AI_SETTINGS["model"],
+                        messages=messages,
+                        temperature=temperature,
+                        max_tokens=max_tokens,
+                        timeout=timeout or AI_SETTINGS["text_timeout_seconds"]
+                    )
+                return response.choices[0].message.content.strip()
+                
+            except self.RETRYABLE_ERRORS as e:
+                if attempt == max_retries:
+                    raise
+                
+                # exponential backoff עם full jitter - מונע גל ניסיונות מסונכרן
+                delay = random.uniform(0, AI_SETTINGS["retry_base_delay_seconds"] * (2 ** attempt))
+                logger.warning(f"OpenAI call failed ({type(e).__name__}), retry {attempt + 1}/{max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+    
+    # === ניתוח קבלות ===
+    
+    def _receipt_messages(self, image_bytes: bytes, mime_type: str = "image/jpeg") -> List[Dict]:
+        """בונה את הודעות הבקשה לניתוח תמונת קבלה"""
+        # המרה ל-base64
+        b64_image = base64.b64encode(image_bytes).decode('utf-8')
+        
+        # הכנת הפרומפט
+        system_prompt = self._get_receipt_analysis_prompt()
+        user_prompt = "נתח את תמונת הקבלה הזו ותחזיר JSON עם הנתונים:"
+        
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": [
+                {"type": "text", "text": user_prompt},
+                {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{b64_image}"}}
+            ]}
+        ]
     
-    def analyze_receipt_image(self, image_bytes: bytes) -> Dict:
+    def _receipt_from_content(self, content: str) -> Dict:
+        """מפרסר ומנקה את תשובת ה-AI לקבלה"""
+        receipt_data = self._parse_ai_response(content)
+        
+        # ניקוי ואימות
+        receipt_data = self._clean_and_validate_receipt(receipt_data)
+        
+        logger.info(f"Successfully analyzed receipt: {receipt_data.get('vendor', 'Unknown')}")
+        return receipt_data
+    
+    def analyze_receipt_image(self, image_bytes: bytes, mime_type: str = "image/jpeg") -> Dict:
         """מנתח תמונת קבלה ומחזיר נתונים מובנים"""
         
         if not self.client:
             return self._create_fallback_receipt()
         
         try:
-            # המרה ל-base64
-            b64_image = base64.b64encode(image_bytes).decode('utf-8')
-            
-            # הכנת הפרומפט
-            system_prompt = self._get_receipt_analysis_prompt()
-            user_prompt = "נתח את תמונת הקבלה הזו ותחזיר JSON עם הנתונים:"
-            
-            # קריאה ל-OpenAI
-            response = self.client.chat.completions.create(
-                model=AI_SETTINGS["model"],
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": [
-                        {"type": "text", "text": user_prompt},
-                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{b64_image}"}}
-                    ]}
-                ],
+            content = self._complete(
+                self._receipt_messages(image_bytes, mime_type),
                 temperature=AI_SETTINGS["temperature"],
-                max_tokens=AI_SETTINGS["max_tokens"]
+                max_tokens=AI_SETTINGS["max_tokens"],
+                timeout=AI_SETTINGS["vision_timeout_seconds"]
             )
+            return self._receipt_from_content(content)
             
-            # עיבוד התשובה
-            content = response.choices[0].message.content.strip()
-            receipt_data = self._parse_ai_response(content)
-            
-            # ניקוי ואימות
-            receipt_data = self._clean_and_validate_receipt(receipt_data)
-            
-            logger.info(f"Successfully analyzed receipt: {receipt_data.get('vendor', 'Unknown')}")
-            return receipt_data
+        except Exception as e:
+            logger.error(f"Receipt analysis failed: {e}")
+            return self._create_fallback_receipt()
+    
+    async def analyze_receipt_image_async(self, image_bytes: bytes, mime_type: str = "image/jpeg") -> Dict:
+        """גרסה אסינכרונית של analyze_receipt_image"""
+        
+        if not self.async_client:
+            return self._create_fallback_receipt()
+        
+        try:
+            content = await self._complete_async(
+                self._receipt_messages(image_bytes, mime_type),
+                temperature=AI_SETTINGS["temperature"],
+                max_tokens=AI_SETTINGS["max_tokens"],
+                timeout=AI_SETTINGS["vision_timeout_seconds"]
+            )
+            return self._receipt_from_content(content)
             
         except Exception as e:
             logger.error(f"Receipt analysis failed: {e}")
@@ -279,14 +374,9 @@ JSON נדרש:
     
     # === זיהוי עדכונים בהודעות ===
     
-    def analyze_message_for_updates(self, message: str, recent_expense: Dict) -> Optional[Dict]:
-        """מנתח הודעה לזיהוי בקשות עדכון"""
-        
-        if not self.client or not message.strip():
-            return None
-        
-        try:
-            prompt = f"""אנתח הודעה כדי לראות אם זה בקשת עדכון לקבלה אחרונה.
+    def _update_detection_prompt(self, message: str, recent_expense: Dict) -> str:
+        """בונה פרומפט לזיהוי בקשת עדכון לקבלה האחרונה"""
+        return f"""אנתח הודעה כדי לראות אם זה בקשת עדכון לקבלה אחרונה.
 
 הקבלה האחרונה:
 ספק: {recent_expense.get('vendor', 'לא ידוע')}
@@ -317,22 +407,67 @@ JSON נדרש:
 - "מחק את זה" → update_type: "delete", new_value: null
 
 החזר רק JSON!"""
-
-            response = self.client.chat.completions.create(
-                model=AI_SETTINGS["model"],
-                messages=[{"role": "user", "content": prompt}],
+    
+    def _update_from_content(self, content: str) -> Optional[Dict]:
+        """מחזיר את בקשת העדכון רק אם ה-AI בטוח מספיק"""
+        result = self._parse_ai_response(content)
+        
+        if result.get('is_update') and result.get('confidence', 0) > 60:
+            logger.info(f"Detected update request: {result.get('update_type')}")
+            return result
+        
+        return None
+    
+    def _local_update_intent(self, message: str) -> Tuple[bool, Optional[Dict]]:
+        """סיווג מקומי לפני ה-AI - מחזיר (הוכרע, בקשה)"""
+        verdict, update = classify_update_intent(message)
+        
+        if verdict == UPDATE:
+            logger.info(f"Detected update request locally: {update['update_type']}")
+            return True, update
+        
+        return verdict == NOT_UPDATE, None
+    
+    def analyze_message_for_updates(self, message: str, recent_expense: Dict) -> Optional[Dict]:
+        """מנתח הודעה לזיהוי בקשות עדכון"""
+        
+        if not message.strip():
+            return None
+        
+        # רוב ההודעות מוכרעות מקומית - רק הודעות עמומות נשלחות ל-AI
+        decided, update = self._local_update_intent(message)
+        if decided or not self.client:
+            return update
+        
+        try:
+            content = self._complete(
+                [{"role": "user", "content": self._update_detection_prompt(message, recent_expense)}],
                 temperature=0.1,
                 max_tokens=200
             )
+            return self._update_from_content(content)
             
-            content = response.choices[0].message.content.strip()
-            result = self._parse_ai_response(content)
-            
-            if result.get('is_update') and result.get('confidence', 0) > 60:
-                logger.info(f"Detected update request: {result.get('update_type')}")
-                return result
-            
+        except Exception as e:
+            logger.error(f"Message analysis failed: {e}")
+            return None
+    
+    async def analyze_message_for_updates_async(self, message: str, recent_expense: Dict) -> Optional[Dict]:
+        """גרסה אסינכרונית של analyze_message_for_updates"""
+        
+        if not message.strip():
             return None
+        
+        decided, update = self._local_update_intent(message)
+        if decided or not self.async_client:
+            return update
+        
+        try:
+            content = await self._complete_async(
+                [{"role": "user", "content": self._update_detection_prompt(message, recent_expense)}],
+                temperature=0.1,
+                max_tokens=200
+            )
+            return self._update_from_content(content)
             
         except Exception as e:
             logger.error(f"Message analysis failed: {e}")
@@ -343,52 +478,13 @@ JSON נדרש:
     # תיקונים ל-ai_analyzer.py
 # החלף את enhance_vendor_with_category:
 
-    def enhance_vendor_with_category(self, vendor_name: str, existing_category: str = None) -> Dict:
-        """מנתח ספק ומציע קטגוריה מתאימה עם למידה משופרת"""
-        
-        VENDOR_KEYWORDS = {
-            'אולם': ['אולם', 'גן אירועים', 'מתחם', 'אולמי', 'גני'],
-            'מזון': ['קייטרינג', 'מסעדה', 'שף', 'מטבח', 'אוכל', 'בר', 'משקאות', 'יין', 'עוגה', 'קונדיטור'],
-            'צילום': ['צלם', 'צילום', 'וידאו', 'סטודיו', 'סטילס', 'דרון', 'אלבום'],
-            'לבוש': ['שמלה', 'חליפה', 'בגדים', 'נעליים', 'חנות אופנה', 'בוטיק', 'חייט'],
-            'עיצוב': ['פרחים', 'עיצוב', 'דקורציה', 'קישוט', 'זר', 'סידור'],
-            'הדפסות': ['הזמנות', 'דפוס', 'הדפסה', 'גרפיקה', 'עיצוב גרפי'],
-            'אקססוריז': ['תכשיטים', 'טבעת', 'שעון', 'אקססוריז', 'מאקס', 'max', 'תיק'],
-            'מוזיקה': ['דיג׳יי', 'DJ', 'להקה', 'זמר', 'נגן', 'מוזיקה', 'הגברה'],
-            'הסעות': ['הסעה', 'אוטובוס', 'מונית', 'רכב', 'טיולים', 'נסיעות']
-        }
-        
-        vendor_lower = vendor_name.lower()
-        
-        for category, keywords in VENDOR_KEYWORDS.items():
-            for keyword in keywords:
-                if keyword.lower() in vendor_lower:
-                    return {
-                        'vendor_name': vendor_name,
-                        'category': category,
-                        'confidence': 95
-                    }
-        
-        KNOWN_VENDORS = {
-            'מאקס': 'אקססוריז',
-            'max': 'אקססוריז',
-            'זארה': 'לבוש',
-            'רמי לוי': 'מזון',
-            'שופרסל': 'מזון',
-            'איקאה': 'עיצוב'
-        }
-        
-        for vendor_key, category in KNOWN_VENDORS.items():
-            if vendor_key in vendor_lower:
-                return {
-                    'vendor_name': vendor_name,
-                    'category': category,
-                    'confidence': 90
-                }
-        
-        if self.client:
-            try:
-                prompt = f"""נתח את שם הספק וקבע קטגוריה לחתונה.
+    def _local_vendor_category(self, vendor_name: str) -> Optional[Dict]:
+        """מזהה קטגוריה לפי מילות מפתח וספקים מוכרים, בלי קריאה ל-AI"""
+        return self.vendor_classifier.classify(vendor_name)
+    
+    def _vendor_category_prompt(self, vendor_name: str) -> str:
+        """בונה פרומפט לסיווג ספק"""
+        return f"""נתח את שם הספק וקבע קטגוריה לחתונה.
 
 ספק: "{vendor_name}"
 
@@ -406,28 +502,92 @@ JSON נדרש:
   "category": "קטגוריה מהרשימה",
   "confidence": 80-100
 }}"""
-
-                response = self.client.chat.completions.create(
-                    model=AI_SETTINGS["model"],
-                    messages=[{"role": "user", "content": prompt}],
+    
+    def _default_vendor_category(self, vendor_name: str, existing_category: str = None) -> Dict:
+        return {
+            'vendor_name': vendor_name,
+            'category': existing_category or 'אחר',
+            'confidence': 50
+        }
+    
+    def enhance_vendor_with_category(self, vendor_name: str, existing_category: str = None) -> Dict:
+        """מנתח ספק ומציע קטגוריה מתאימה עם למידה משופרת"""
+        local = self._local_vendor_category(vendor_name)
+        if local:
+            return local
+        
+        cached = self.category_cache.get(vendor_name) if self.category_cache else None
+        if cached:
+            return dict(cached, vendor_name=vendor_name)
+        
+        if self.client:
+            try:
+                content = self._complete(
+                    [{"role": "user", "content": self._vendor_category_prompt(vendor_name)}],
                     temperature=0.1,
                     max_tokens=150
                 )
-                
-                content = response.choices[0].message.content.strip()
                 result = self._parse_ai_response(content)
                 
                 if result.get('category') in CATEGORY_LIST:
-                    return result
+                    if self.category_cache:
+                        self.category_cache.put(vendor_name, result)
+                    return dict(result, vendor_name=vendor_name)
                     
             except Exception as e:
                 logger.error(f"AI vendor categorization failed: {e}")
         
-        return {
-            'vendor_name': vendor_name,
-            'category': existing_category or 'אחר',
-            'confidence': 50
-        }
+        return self._default_vendor_category(vendor_name, existing_category)
+    
+    async def _categorize_vendor_async(self, vendor_name: str) -> Optional[Dict]:
+        """סיווג ספק דרך ה-cache המתמיד, ואם אין - קריאה אחת ל-LLM"""
+        loop = asyncio.get_running_loop()
+        
+        if self.category_cache:
+            cached = await loop.run_in_executor(None, self.category_cache.get, vendor_name)
+            if cached:
+                return cached
+        
+        if not self.async_client:
+            return None
+        
+        content = await self._complete_async(
+            [{"role": "user", "content": self._vendor_category_prompt(vendor_name)}],
+            temperature=0.1,
+            max_tokens=150
+        )
+        result = self._parse_ai_response(content)
+        
+        if result.get('category') not in CATEGORY_LIST:
+            return None
+        
+        if self.category_cache:
+            await loop.run_in_executor(None, self.category_cache.put, vendor_name, result)
+        return result
+    
+    async def enhance_vendor_with_category_async(self, vendor_name: str, existing_category: str = None) -> Dict:
+        """גרסה אסינכרונית של enhance_vendor_with_category"""
+        local = self._local_vendor_category(vendor_name)
+        if local:
+            return local
+        
+        # בקשות מקבילות לאותו ספק ממתינות לקריאה אחת - באותו מפתח כמו ה-cache
+        key = normalize_vendor_name(vendor_name) or vendor_name.strip().lower()
+        pending = self._categorizing.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._categorize_vendor_async(vendor_name))
+            self._categorizing[key] = pending
+            pending.add_done_callback(lambda _: self._categorizing.pop(key, None))
+        
+        try:
+            result = await asyncio.shield(pending)
+            if result:
+                return dict(result, vendor_name=vendor_name)
+                
+        except Exception as e:
+            logger.error(f"AI vendor categorization failed: {e}")
+        
+        return self._default_vendor_category(vendor_name, existing_category)
 
     def health_check(self) -> Dict[str, bool]:
         """בודק שה-AI עובד"""
@@ -439,13 +599,28 @@ JSON נדרש:
         
         if self.client:
             try:
-                response = self.client.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=[{"role": "user", "content": "Test"}],
-                    max_tokens=10
-                )
-                
-                if response.choices:
+                if self._complete([{"role": "user", "content": "Test"}], temperature=0, max_tokens=10,
+                                  model="gpt-3.5-turbo") is not None:
+                    checks["can_analyze_text"] = True
+                    checks["model_accessible"] = True
+                    
+            except Exception as e:
+                logger.error(f"AI health check failed: {e}")
+        
+        return checks
+    
+    async def health_check_async(self) -> Dict[str, bool]:
+        """גרסה אסינכרונית של health_check"""
+        checks = {
+            "openai_configured": bool(self.async_client),
+            "can_analyze_text": False,
+            "model_accessible": False
+        }
+        
+        if self.async_client:
+            try:
+                if await self._complete_async([{"role": "user", "content": "Test"}], temperature=0, max_tokens=10,
+                                              model="gpt-3.5-turbo") is not None:
                     checks["can_analyze_text"] = True
                     checks["model_accessible"] = True
                     
@@ -2,6 +2,7 @@ import logging
 from typing import Dict, List, Optional
 from datetime import datetime, timedelta
 from config import WEDDING_CATEGORIES, PAYMENT_TYPES
+from manual_entry_parser import parse_manual_entry
 
 logger = logging.getLogger(__name__)
 
@@ -46,6 +47,39 @@ class BotMessages:
         return f"""✅ *נשמר!*
 {emoji} {vendor} • {amount:,.0f} ₪"""
 
+    @staticmethod
+    def receipts_batch_saved(expenses: List[Dict], skipped: Dict[str, int]) -> str:
+        """אישור אחד לאלבום קבלות - מה נשמר ומה דורש טיפול"""
+        lines = []
+
+        if expenses:
+            total = sum(float(expense.get('amount', 0) or 0) for expense in expenses)
+            lines.append(f"✅ *נשמרו {len(expenses)} קבלות!*")
+            for expense in expenses:
+                emoji = WEDDING_CATEGORIES.get(expense.get('category', 'אחר'), "📋")
+                lines.append(f"{emoji} {expense.get('vendor', 'ספק')} • {float(expense.get('amount', 0) or 0):,.0f} ₪")
+            lines.append(f"💰 סה״כ: {total:,.0f} ₪")
+        else:
+            lines.append("😅 לא הצלחתי לשמור אף קבלה מהתמונות")
+
+        notes = {
+            'duplicate_receipt': "♻️ {} כפולות - כבר נשמרו",
+            'image_unclear': "🔍 {} לא ברורות - כתבו לי סכום וספק",
+            'image_rejected': "🖼️ {} לא בפורמט נתמך או גדולות מדי",
+            'failed': "⚠️ {} לא נקלטו - נסו לשלוח שוב"
+        }
+        extra = [notes[reason].format(count) for reason, count in skipped.items() if count and reason in notes]
+        if extra:
+            lines.append("")
+            lines.extend(extra)
+
+        return "\n".join(lines)
+
+    @staticmethod
+    def receipts_save_failed() -> str:
+        """קבלות נותחו אבל השמירה לאחסון נכשלה - הן ינוסו שוב אוטומטית"""
+        return "⚠️ שגיאה בשמירה - אנסה לשמור שוב בעוד כמה רגעים, אין צורך לשלוח מחדש"
+
     @staticmethod
     def receipt_updated_success(expense_data: Dict, changed_field: str = "") -> str:
         """הודעת עדכון קצרה"""
@@ -69,6 +103,20 @@ class BotMessages:
         vendor = expense_data.get('vendor', 'ספק')
         return f"🗑️ *נמחק* • {vendor}"
 
+    @staticmethod
+    def duplicate_receipt_detected(expense_data: Dict) -> str:
+        """הודעה כשנשלחה שוב קבלה שכבר נשמרה"""
+        vendor = expense_data.get('vendor', 'ספק')
+        try:
+            amount = float(expense_data.get('amount', 0) or 0)
+        except (ValueError, TypeError):
+            amount = 0
+        
+        return f"""♻️ *הקבלה הזו כבר נשמרה*
+{vendor} • {amount:,.0f} ₪
+
+אם זה תשלום נוסף - כתבו לי סכום וספק ואשמור בנפרד"""
+
     @staticmethod
     def image_unclear_request() -> str:
         """בקשה לפרטים כשתמונה לא ברורה"""
@@ -80,6 +128,18 @@ class BotMessages:
 
 ואני אדאג לשמור!"""
 
+    @staticmethod
+    def image_rejected(reason: str) -> str:
+        """הודעה על תמונה שלא עומדת במגבלות הגודל או הסוג"""
+        if reason == "too_large":
+            return """📦 התמונה גדולה מדי...
+
+נסו לשלוח אותה שוב כתמונה רגילה (לא כקובץ), או כתבו לי סכום וספק"""
+        
+        return """🖼️ אני יודע לקרוא רק תמונות JPG, PNG או WEBP
+
+שלחו צילום של הקבלה, או כתבו לי סכום וספק"""
+
     @staticmethod
     def manual_entry_saved(vendor: str, amount: float) -> str:
         """אישור הכנסה ידנית"""
@@ -206,112 +266,7 @@ class BotMessages:
     @staticmethod
     def parse_manual_entry(message: str) -> Optional[Dict]:
         """מנתח הודעה להכנסה ידנית משופרת"""
-        import re
-        from datetime import datetime
-        
-        # נרמול הטקסט
-        text = message.strip()
-        
-        # דפוסים לזיהוי סכום
-        amount_patterns = [
-            r'(\d+(?:,?\d{3})*(?:\.\d+)?)\s*(?:ש"ח|שח|שקל|שקלים|₪)',
-            r'(?:שילמתי|שילמנו|עלה|עולה|היה|עלות)\s+(\d+(?:,?\d{3})*(?:\.\d+)?)',
-            r'(\d+(?:,?\d{3})*(?:\.\d+)?)\s+(?:ל|עבור|בשביל)',
-            r'(\d{4,})',  # מספר של לפחות 4 ספרות
-        ]
-        
-        # דפוסים לזיהוי ספק
-        vendor_patterns = [
-            r'(?:ל|עבור|בשביל|אצל|ב|מ|של)\s*([א-ת\s]+?)(?:\s+|$)',
-            r'(צלם|אולם|דיג׳יי|קייטרינג|להקה|זמר|פרחים|שמלה|חליפה|עוגה|הזמנות)',
-            r'([א-ת]{2,}(?:\s+[א-ת]+)?)',  # כל מילה בעברית
-        ]
-        
-        # דפוסים לזיהוי סוג תשלום
-        payment_type_keywords = {
-            'מקדמה': 'advance',
-            'קדימה': 'advance',
-            'ראשון': 'advance',
-            'סופי': 'final',
-            'אחרון': 'final',
-            'יתרה': 'final'
-        }
-        
-        amount = None
-        vendor = None
-        payment_type = 'full'
-        category = 'אחר'
-        
-        # חיפוש סכום
-        for pattern in amount_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                try:
-                    amount_str = match.group(1).replace(',', '')
-                    amount = float(amount_str)
-                    if amount > 0:
-                        break
-                except (ValueError, AttributeError):
-                    continue
-        
-        # חיפוש ספק
-        for pattern in vendor_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                potential_vendor = match.group(1).strip()
-                # ניקוי מילים מיותרות
-                stop_words = ['שילמתי', 'שילמנו', 'עלה', 'עולה', 'ש"ח', 'שקל', 'שקלים']
-                if potential_vendor and len(potential_vendor) > 1:
-                    if not any(word in potential_vendor for word in stop_words):
-                        vendor = potential_vendor
-                        break
-        
-        # זיהוי סוג תשלום
-        for keyword, ptype in payment_type_keywords.items():
-            if keyword in text:
-                payment_type = ptype
-                break
-        
-        # זיהוי קטגוריה לפי מילות מפתח
-        category_keywords = {
-            'צלם': 'צילום',
-            'צילום': 'צילום',
-            'אולם': 'אולם',
-            'גן': 'אולם',
-            'דיג׳יי': 'מוזיקה',
-            'DJ': 'מוזיקה',
-            'להקה': 'מוזיקה',
-            'זמר': 'מוזיקה',
-            'קייטרינג': 'מזון',
-            'אוכל': 'מזון',
-            'עוגה': 'מזון',
-            'פרחים': 'עיצוב',
-            'עיצוב': 'עיצוב',
-            'שמלה': 'לבוש',
-            'חליפה': 'לבוש',
-            'הזמנות': 'הדפסות'
-        }
-        
-        for keyword, cat in category_keywords.items():
-            if keyword in text:
-                category = cat
-                break
-        
-        # אם מצאנו גם סכום וגם ספק
-        if amount and vendor:
-            return {
-                'vendor': vendor,
-                'amount': amount,
-                'category': category,
-                'date': datetime.now().strftime('%Y-%m-%d'),
-                'payment_type': payment_type,
-                'payment_method': None,
-                'confidence': 70,
-                'needs_review': False,
-                'source': 'manual_text'
-            }
-        
-        return None
+        return parse_manual_entry(message)
 
     @staticmethod
     def format_expense_for_display(expense: Dict) -> str:
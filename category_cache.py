@@ -0,0 +1,155 @@
+import time
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+from config import VENDOR_CATEGORIES_HEADERS, CATEGORY_CACHE_SETTINGS
+from storage_backend import StorageBackend
+from vendor_index import normalize_vendor_name
+
+logger = logging.getLogger(__name__)
+
+TABLE = "vendor_categories"
+
+class VendorCategoryCache:
+    """cache מתמיד לסיווגי ספקים שהתקבלו מה-LLM, לפי שם ספק מנורמל.
+
+    נשמר בטבלה vendor_categories במנוע האחסון, כך שכל המופעים חולקים אותו:
+    ספק שסווג פעם אחת (בכל קבוצה) לא נשלח שוב ל-OpenAI עד שהרשומה פגה.
+    תוקף הרשומה תלוי בביטחון - סיווג בטוח נשמר חודשים, ניחוש נמוך ימים.
+    """
+
+    def __init__(self, backend: StorageBackend):
+        self.backend = backend
+        self._lock = threading.RLock()
+        self._entries: Dict[str, Dict] = {}
+        self._row_numbers: Dict[str, int] = {}
+        self._loaded_at: Optional[float] = None
+        # הטבלה חסרה/לא נגישה - מדלגים על כתיבות עד טעינה מוצלחת (בכל reload_interval)
+        self._unavailable = False
+
+    # === טעינה ===
+
+    def _ensure_loaded(self):
+        """טוען את הטבלה אם עדיין לא נטענה או שפג תוקפה"""
+        interval = CATEGORY_CACHE_SETTINGS["reload_interval_seconds"]
+        if (self._loaded_at is None or
+                (interval and time.monotonic() - self._loaded_at > interval)):
+            try:
+                self.reload()
+            except Exception as e:
+                # למשל גיליון vendor_categories שעוד לא נוצר - לא מנסים שוב עד הטעינה הבאה
+                self._mark_unavailable(e)
+                self._loaded_at = time.monotonic()
+
+    def _mark_unavailable(self, error: Exception):
+        """מסמן את הטבלה כלא זמינה - אזהרה אחת במקום שגיאה בכל כתיבה"""
+        if not self._unavailable:
+            logger.warning(f"Vendor category cache unavailable, skipping writes until the next reload: {error}")
+        self._unavailable = True
+
+    def reload(self):
+        """טוען מחדש את כל הסיווגים - כולל כאלה שנכתבו ע"י מופעים אחרים"""
+        with self._lock:
+            rows = self.backend.read_table(TABLE)
+
+            self._entries = {}
+            self._row_numbers = {}
+
+            # שורה 1 היא כותרת - שורות הנתונים מתחילות בשורה 2
+            for i, row in enumerate(rows[1:]):
+                values = list(row) + [''] * (len(VENDOR_CATEGORIES_HEADERS) - len(row))
+                entry = dict(zip(VENDOR_CATEGORIES_HEADERS, values))
+                if entry['vendor_key']:
+                    self._entries[entry['vendor_key']] = entry
+                    self._row_numbers[entry['vendor_key']] = i + 2
+
+            self._loaded_at = time.monotonic()
+            self._unavailable = False
+            logger.info(f"Vendor category cache loaded: {len(self._entries)} entries")
+
+    @staticmethod
+    def ttl_for(confidence: int) -> timedelta:
+        """תוקף לפי ביטחון - הסף הראשון שהביטחון עובר אותו"""
+        for min_confidence, days in CATEGORY_CACHE_SETTINGS["ttl_days_by_confidence"]:
+            if confidence >= min_confidence:
+                return timedelta(days=days)
+        return timedelta(0)
+
+    # === קריאה וכתיבה ===
+
+    def get(self, vendor_name: str) -> Optional[Dict]:
+        """מחזיר סיווג שמור ובתוקף, או None"""
+        key = normalize_vendor_name(vendor_name)
+        if not key:
+            return None
+
+        try:
+            with self._lock:
+                self._ensure_loaded()
+                entry = self._entries.get(key)
+
+            if not entry:
+                return None
+
+            if datetime.fromisoformat(entry['expires_at']) <= datetime.now(timezone.utc):
+                return None
+
+            return {
+                'vendor_name': vendor_name,
+                'category': entry['category'],
+                'confidence': int(float(entry['confidence'] or 0))
+            }
+
+        except Exception as e:
+            logger.error(f"Failed to read vendor category cache: {e}")
+            return None
+
+    def put(self, vendor_name: str, result: Dict) -> bool:
+        """שומר סיווג (מחליף רשומה קיימת לאותו ספק)"""
+        key = normalize_vendor_name(vendor_name)
+        if not key or not result.get('category'):
+            return False
+
+        try:
+            confidence = int(result.get('confidence', 0))
+            ttl = self.ttl_for(confidence)
+            if not ttl:
+                return False
+
+            now = datetime.now(timezone.utc)
+            entry = {
+                'vendor_key': key,
+                'vendor_name': vendor_name,
+                'category': result['category'],
+                'confidence': str(confidence),
+                'cached_at': now.isoformat(),
+                'expires_at': (now + ttl).isoformat()
+            }
+            row = [entry[header] for header in VENDOR_CATEGORIES_HEADERS]
+
+            with self._lock:
+                self._ensure_loaded()
+                if self._unavailable:
+                    return False
+                row_number = self._row_numbers.get(key)
+
+                if row_number:
+                    self.backend.update_rows(TABLE, {row_number: row})
+                else:
+                    first_row = self.backend.append_rows(TABLE, [row])
+                    if first_row:
+                        self._row_numbers[key] = first_row
+                    else:
+                        # לא ידוע איפה נכתבה השורה - נטען מחדש בגישה הבאה
+                        self._loaded_at = None
+
+                self._entries[key] = entry
+
+            logger.debug(f"Cached vendor category for {vendor_name}: {entry['category']} ({confidence}, ttl {ttl.days}d)")
+            return True
+
+        except Exception as e:
+            with self._lock:
+                self._mark_unavailable(e)
+            return False
@@ -29,7 +29,7 @@ PORT = int(os.getenv("PORT", "8080"))
 DEBUG = os.getenv("DEBUG", "False").lower() == "true"
 
 # === Google Sheets - טווחי עמודות ===
-EXPENSES_SHEET = "expenses!A:L"  # טבלת הוצאות
+EXPENSES_SHEET = "expenses!A:M"  # טבלת הוצאות
 COUPLES_SHEET = "couples!A:G"   # טבלת זוגות
 VENDORS_SHEET = "vendors!A:F"   # טבלת ספקים
 
@@ -46,7 +46,7 @@ EXPENSE_HEADERS = [
     "created_at",
     "needs_review",
     "status",
-    "deleted_at"
+    "deleted_at",
     "last_updated"
 ]
 
@@ -71,6 +71,45 @@ VENDORS_HEADERS = [
     "created_at"
 ]
 
+# === כותרות עמודות - תקציבי ספקים וקטגוריות ===
+VENDOR_BUDGETS_HEADERS = [
+    "group_id",
+    "vendor_name",
+    "budget_amount",
+    "created_at",
+    "status",
+    "notes"
+]
+
+CATEGORY_BUDGETS_HEADERS = [
+    "group_id",
+    "category",
+    "budget_amount",
+    "created_at",
+    "status",
+    "notes"
+]
+
+# === כותרות עמודות - cache סיווגי ספקים (LLM) ===
+VENDOR_CATEGORIES_HEADERS = [
+    "vendor_key",
+    "vendor_name",
+    "category",
+    "confidence",
+    "cached_at",
+    "expires_at"
+]
+
+# כל הטבלאות במנוע האחסון (שם טבלה = שם גיליון)
+TABLE_HEADERS = {
+    "expenses": EXPENSE_HEADERS,
+    "couples": COUPLES_HEADERS,
+    "vendors": VENDORS_HEADERS,
+    "vendor_budgets": VENDOR_BUDGETS_HEADERS,
+    "category_budgets": CATEGORY_BUDGETS_HEADERS,
+    "vendor_categories": VENDOR_CATEGORIES_HEADERS
+}
+
 # === 10 קטגוריות קבועות ===
 WEDDING_CATEGORIES = {
     "אולם": "🏛️",
@@ -116,6 +155,12 @@ AI_SETTINGS = {
     "max_tokens": 500,
     "temperature": 0.1,
     "model": "gpt-4o-mini",
+    # קריאות אסינכרוניות - מגבלת מקביליות, timeouts ו-retry
+    "max_concurrent_requests": int(os.getenv("OPENAI_MAX_CONCURRENCY", "4")),
+    "vision_timeout_seconds": float(os.getenv("OPENAI_VISION_TIMEOUT", "30")),
+    "text_timeout_seconds": float(os.getenv("OPENAI_TEXT_TIMEOUT", "15")),
+    "max_retries": 3,
+    "retry_base_delay_seconds": 1.0,
     "fallback_vendor_names": {
         "restaurant": "מסעדה לא מזוהה",
         "store": "חנות לא מזוהה", 
@@ -134,6 +179,77 @@ WHATSAPP_SETTINGS = {
     "edit_window_minutes": 10  # זמן לעריכת הודעות
 }
 
+# === לקוח Green API (מאגר חיבורים) ===
+GREEN_API_SETTINGS = {
+    "base_url": os.getenv("GREENAPI_BASE_URL", "https://api.green-api.com"),
+    "max_connections": int(os.getenv("GREENAPI_MAX_CONNECTIONS", "20")),
+    "max_keepalive_connections": int(os.getenv("GREENAPI_MAX_KEEPALIVE", "10")),
+    "keepalive_expiry_seconds": 60,
+    "http2": os.getenv("GREENAPI_HTTP2", "true").lower() == "true",
+    "download_chunk_size": 64 * 1024
+}
+
+# === מנוע אחסון ===
+STORAGE_SETTINGS = {
+    "backend": os.getenv("STORAGE_BACKEND", "sheets").lower(),  # sheets / sqlite
+    "sqlite_path": os.getenv("SQLITE_PATH", "wedding.db"),
+    # במצב sqlite - שיקוף הטבלאות לגיליון (אם הוגדרו פרטי Google)
+    "sheets_export_enabled": os.getenv("SHEETS_EXPORT_ENABLED", "true").lower() == "true",
+    "sheets_export_interval_seconds": int(os.getenv("SHEETS_EXPORT_INTERVAL_SECONDS", "60")),
+    # טבלה ריקה ב-SQLite לא דורסת גיליון עם נתונים, אלא אם זה מותר במפורש
+    "sheets_export_allow_empty": os.getenv("SHEETS_EXPORT_ALLOW_EMPTY", "false").lower() == "true"
+}
+
+USES_GOOGLE_SHEETS = STORAGE_SETTINGS["backend"] == "sheets"
+
+# === הגדרות גישה לגיליון ===
+DATABASE_SETTINGS = {
+    "io_workers": int(os.getenv("SHEETS_IO_WORKERS", "8"))  # threads לפעולות Sheets חוסמות
+}
+
+# === הגדרות מאגר הוצאות בזיכרון ===
+EXPENSE_STORE_SETTINGS = {
+    # טעינה מחדש מהגיליון - מגן מפני שינויים שנעשו ע"י מופעים אחרים (0 = ללא)
+    "reload_interval_seconds": int(os.getenv("EXPENSE_STORE_RELOAD_SECONDS", "300"))
+}
+
+# === cache פרטי זוג (stale-while-revalidate) ===
+COUPLE_CACHE_SETTINGS = {
+    "fresh_seconds": int(os.getenv("COUPLE_CACHE_FRESH_SECONDS", "60")),
+    # עד גיל זה מוחזר ערך ישן מיד ונטען מחדש ברקע; אחריו הקורא ממתין לאחסון
+    "stale_seconds": int(os.getenv("COUPLE_CACHE_STALE_SECONDS", "900"))
+}
+
+# === אינדקס ספקים ===
+VENDOR_INDEX_SETTINGS = {
+    # טעינה מחדש מהאחסון - מגן מפני שינויים שנעשו ע"י מופעים אחרים (0 = ללא)
+    "reload_interval_seconds": int(os.getenv("VENDOR_INDEX_RELOAD_SECONDS", "600")),
+    # דמיון מינימלי (Dice על שלשות תווים) להתאמה מקורבת
+    "min_similarity": 0.6,
+    # איחוד שורות כפולות בטבלת הספקים - בפריסה עם כמה מופעים להפעיל במופע אחד בלבד
+    "compaction_enabled": os.getenv("VENDOR_COMPACTION_ENABLED", "true").lower() == "true",
+    "compaction_interval_seconds": int(os.getenv("VENDOR_COMPACTION_INTERVAL_SECONDS", "21600")),
+    # ספקים שנלמדו בביטחון כזה ומעלה מצטרפים למסווג המקומי של ה-AI
+    "classifier_min_confidence": 85
+}
+
+# === cache סיווגי ספקים מה-LLM ===
+CATEGORY_CACHE_SETTINGS = {
+    # טעינה מחדש - קולט סיווגים שנכתבו ע"י מופעים אחרים
+    "reload_interval_seconds": int(os.getenv("CATEGORY_CACHE_RELOAD_SECONDS", "600")),
+    # (ביטחון מינימלי, ימי תוקף) - מהגבוה לנמוך; מתחת לסף האחרון לא נשמר
+    "ttl_days_by_confidence": [(90, 180), (75, 30), (50, 3)]
+}
+
+# === הגדרות כתיבה מושהית (write-behind) ===
+WRITE_BEHIND_SETTINGS = {
+    # ב-SQLite הכתיבה מקומית וזולה - אין צורך ביומן
+    "enabled": os.getenv("WRITE_BEHIND_ENABLED", "true" if USES_GOOGLE_SHEETS else "false").lower() == "true",
+    "journal_path": os.getenv("WRITE_JOURNAL_PATH", "write_journal.db"),
+    "flush_interval_seconds": float(os.getenv("WRITE_BEHIND_FLUSH_SECONDS", "2")),
+    "max_batch_size": 500  # מקסימום רשומות יומן לכל סבב דחיפה
+}
+
 # === הגדרות דשבורד ===
 DASHBOARD_SETTINGS = {
     "items_per_page": 20,
@@ -157,7 +273,7 @@ def validate_config() -> Dict[str, bool]:
     checks = {
         "green_api": bool(GREENAPI_INSTANCE_ID and GREENAPI_TOKEN),
         "openai": bool(OPENAI_API_KEY),
-        "google_sheets": bool(GSHEETS_SPREADSHEET_ID and GOOGLE_CREDENTIALS_JSON),
+        "storage": not USES_GOOGLE_SHEETS or bool(GSHEETS_SPREADSHEET_ID and GOOGLE_CREDENTIALS_JSON),
         "webhook_secret": bool(WEBHOOK_SHARED_SECRET)
     }
     return checks
@@ -166,7 +282,69 @@ def validate_config() -> Dict[str, bool]:
 LOGGING_CONFIG = {
     "level": "INFO" if not DEBUG else "DEBUG",
     "format": "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    "handlers": ["console"]
+    "handlers": ["console"],
+    # רישום payloads של webhooks (DEBUG בלבד, מצונזר) - איזה חלק מהבקשות לרשום
+    "payload_sample_rate": float(os.getenv("PAYLOAD_LOG_SAMPLE_RATE", "1.0" if DEBUG else "0.1")),
+    "payload_max_chars": 4000
+}
+
+# === תור עבודות לעיבוד webhooks ===
+JOB_QUEUE_SETTINGS = {
+    # כבוי = עיבוד בתוך בקשת ה-webhook (כמו פעם)
+    "enabled": os.getenv("JOB_QUEUE_ENABLED", "true").lower() == "true",
+    "path": os.getenv("JOB_QUEUE_PATH", "job_queue.db"),
+    "workers": int(os.getenv("JOB_QUEUE_WORKERS", "4")),
+    "max_attempts": 3,
+    "retry_base_delay_seconds": 5,  # ניסיון חוזר אחרי 5, 10, 20... שניות
+    "poll_interval_seconds": 5,
+    # בכיבוי - זמן המתנה לעבודות בעיבוד לפני ביטול (Cloud Run נותן 10 שניות)
+    "shutdown_timeout_seconds": float(os.getenv("JOB_QUEUE_SHUTDOWN_TIMEOUT", "8"))
+}
+
+# === מניעת עיבוד כפול של הודעות ===
+DEDUP_SETTINGS = {
+    "ttl_seconds": int(os.getenv("DEDUP_TTL_SECONDS", "3600")),
+    "max_entries": 10000,
+    # מזהים שטופלו נשמרים באותו קובץ של תור העבודות - שורדים הפעלה מחדש (ריק = זיכרון בלבד)
+    "path": os.getenv("DEDUP_PATH", JOB_QUEUE_SETTINGS["path"] if JOB_QUEUE_SETTINGS["enabled"] else "")
+}
+
+# === cache קבוצות פעילות ===
+GROUP_CACHE_SETTINGS = {
+    "version_check_seconds": int(os.getenv("GROUP_CACHE_VERSION_CHECK_SECONDS", "300")),
+    "max_age_seconds": 1800  # כשהאחסון לא מספק גרסה
+}
+
+# === עיבוד תמונה לפני ניתוח ===
+IMAGE_PREPROCESS_SETTINGS = {
+    "enabled": os.getenv("IMAGE_PREPROCESS_ENABLED", "true").lower() == "true",
+    # high detail של מודל ה-vision: עד 2048 בצד הארוך ו-768 בצד הקצר
+    "max_long_side": 2048,
+    "max_short_side": 768,
+    "jpeg_quality": 85,
+    "auto_crop": True,
+    "crop_threshold": 160  # בהירות מינימלית (0-255) של נייר הקבלה
+}
+
+# === מטמון ניתוח קבלות ===
+RECEIPT_CACHE_SETTINGS = {
+    "max_entries": int(os.getenv("RECEIPT_CACHE_MAX_ENTRIES", "512")),
+    "ttl_seconds": int(os.getenv("RECEIPT_CACHE_TTL_SECONDS", str(24 * 3600))),
+    "phash_max_distance": 4,  # מרחק Hamming מקסימלי בין dHash של העברות
+    # התאמה לפי dHash בלבד (בלי sha256 זהה) - כבוי: קבלות שונות באותה תבנית מתנגשות
+    "phash_match_enabled": os.getenv("RECEIPT_CACHE_PHASH_MATCH", "false").lower() == "true",
+    "disk_path": os.getenv("RECEIPT_CACHE_PATH", ""),  # ריק = זיכרון בלבד
+    "disk_ttl_seconds": 30 * 24 * 3600
+}
+
+# === אלבום קבלות (כמה תמונות ברצף מאותה קבוצה) ===
+RECEIPT_BATCH_SETTINGS = {
+    # כבוי (ברירת מחדל) = כל תמונה מעובדת ומאושרת מיד ובנפרד; דולק = אישור אחד לאלבום, במחיר חלון ההמתנה
+    "enabled": os.getenv("RECEIPT_BATCH_ENABLED", "false").lower() == "true",
+    "window_seconds": float(os.getenv("RECEIPT_BATCH_WINDOW_SECONDS", "4")),  # שקט אחרי התמונה האחרונה
+    "max_wait_seconds": 20,  # מהתמונה הראשונה - אלבום לא מחכה יותר מזה
+    "max_batch_size": 20,
+    "max_concurrent_analyses": 5  # קריאות vision במקביל לאלבום
 }
 
 # === הגדרות בטיחות ===
@@ -189,11 +367,13 @@ def validate_required_env_vars() -> bool:
     """בודק שמשתני הסביבה הקריטיים קיימים"""
     required = {
         "GREENAPI_INSTANCE_ID": GREENAPI_INSTANCE_ID,
-        "GREENAPI_TOKEN": GREENAPI_TOKEN,
-        "GSHEETS_SPREADSHEET_ID": GSHEETS_SPREADSHEET_ID,
-        "GOOGLE_CREDENTIALS_JSON": GOOGLE_CREDENTIALS_JSON
+        "GREENAPI_TOKEN": GREENAPI_TOKEN
     }
     
+    if USES_GOOGLE_SHEETS:
+        required["GSHEETS_SPREADSHEET_ID"] = GSHEETS_SPREADSHEET_ID
+        required["GOOGLE_CREDENTIALS_JSON"] = GOOGLE_CREDENTIALS_JSON
+    
     missing = [name for name, value in required.items() if not value]
     
     if missing:
@@ -0,0 +1,104 @@
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+from config import COUPLE_CACHE_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+class CoupleCache:
+    """cache לפרטי זוג לפי group_id בשיטת stale-while-revalidate.
+
+    ערך טרי מוחזר מיד; ערך ישן (עד stale_seconds) מוחזר מיד ובמקביל נטען
+    מחדש ברקע, כך שקורא ממתין לאחסון רק כשאין ערך בכלל. כתיבה לזוג
+    מחליפה את הרשומה מיד, וטעינת רקע שהתחילה לפני הכתיבה לא תדרוס אותה.
+    """
+
+    def __init__(self, loader: Callable[[str], Optional[Dict]],
+                 submit: Callable[..., Any],
+                 fresh_seconds: int = None, stale_seconds: int = None):
+        # loader קורא זוג מהאחסון (None אם לא קיים) וזורק חריגה בכישלון
+        self._loader = loader
+        # submit מריץ טעינת רקע (למשל ThreadPoolExecutor.submit)
+        self._submit = submit
+        self.fresh_seconds = fresh_seconds if fresh_seconds is not None else COUPLE_CACHE_SETTINGS["fresh_seconds"]
+        self.stale_seconds = stale_seconds if stale_seconds is not None else COUPLE_CACHE_SETTINGS["stale_seconds"]
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Tuple[Optional[Dict], float]] = {}
+        # מונה כתיבות לכל מפתח - טעינה שהתחילה לפני כתיבה נזרקת
+        self._generations: Dict[str, int] = {}
+        self._refreshing = set()
+
+    @staticmethod
+    def _copy(couple: Optional[Dict]) -> Optional[Dict]:
+        return dict(couple) if couple is not None else None
+
+    def lookup(self, group_id: str) -> Tuple[bool, Optional[Dict]]:
+        """מחזיר (hit, couple) בלי לגשת לאחסון; ערך ישן מפעיל טעינה ברקע"""
+        with self._lock:
+            entry = self._entries.get(group_id)
+        if entry is None:
+            return False, None
+
+        couple, loaded_at = entry
+        age = time.monotonic() - loaded_at
+        if age > self.stale_seconds:
+            return False, None
+        if age > self.fresh_seconds:
+            self._revalidate(group_id)
+
+        return True, self._copy(couple)
+
+    def get(self, group_id: str) -> Optional[Dict]:
+        """מחזיר זוג מה-cache, או טוען מהאחסון אם אין ערך שמיש"""
+        hit, couple = self.lookup(group_id)
+        if hit:
+            return couple
+
+        with self._lock:
+            generation = self._generations.get(group_id, 0)
+        couple = self._loader(group_id)
+        self._store(group_id, couple, generation)
+        return self._copy(couple)
+
+    def set(self, group_id: str, couple: Optional[Dict]):
+        """מחליף את הרשומה אחרי כתיבה"""
+        with self._lock:
+            self._generations[group_id] = self._generations.get(group_id, 0) + 1
+            self._entries[group_id] = (self._copy(couple), time.monotonic())
+
+    def invalidate(self, group_id: str):
+        """מוחק את הרשומה - הקריאה הבאה תטען מהאחסון"""
+        with self._lock:
+            self._generations[group_id] = self._generations.get(group_id, 0) + 1
+            self._entries.pop(group_id, None)
+
+    def _store(self, group_id: str, couple: Optional[Dict], generation: int):
+        with self._lock:
+            if self._generations.get(group_id, 0) == generation:
+                self._entries[group_id] = (self._copy(couple), time.monotonic())
+
+    def _revalidate(self, group_id: str):
+        """מתזמן טעינה ברקע - לכל היותר אחת בכל רגע לכל זוג"""
+        with self._lock:
+            if group_id in self._refreshing:
+                return
+            self._refreshing.add(group_id)
+            generation = self._generations.get(group_id, 0)
+
+        try:
+            self._submit(self._refresh, group_id, generation)
+        except Exception as e:
+            # למשל executor שכבר נסגר - הערך הישן נשאר עד שיפוג
+            logger.debug(f"Could not schedule couple refresh for {group_id}: {e}")
+            with self._lock:
+                self._refreshing.discard(group_id)
+
+    def _refresh(self, group_id: str, generation: int):
+        try:
+            self._store(group_id, self._loader(group_id), generation)
+        except Exception as e:
+            logger.warning(f"Background refresh of couple {group_id} failed, serving stale value: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(group_id)
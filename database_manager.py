@@ -1,130 +1,155 @@
-import json
+import asyncio
 import logging
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
-from typing import List, Dict, Optional, Tuple
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from typing import Any, Callable, List, Dict, Optional, Tuple
 from config import *
+from expense_store import ExpenseStore
+from couple_cache import CoupleCache
+from category_cache import VendorCategoryCache
+from vendor_index import VendorIndex, redundant_vendor_rows, normalize_vendor_name, vendor_rank
+from storage_backend import StorageBackend, SheetsBackend, SheetsExporter, create_storage_backend
+from write_journal import WriteBehindJournal, EXPENSE_APPEND, EXPENSE_UPDATE, VENDOR_APPEND, VENDOR_UPSERT
 
 logger = logging.getLogger(__name__)
 
 class DatabaseManager:
-    """מנהל את כל הפעולות עם Google Sheets"""
+    """מנהל את כל הפעולות מול מנוע האחסון (Google Sheets או SQLite)"""
     
-    def __init__(self):
-        self.sheets = None
-        self.credentials = None
-        self._init_google_sheets()
-    
-    def _init_google_sheets(self):
-        """מאתחל חיבור לGoogle Sheets"""
-        try:
-            if GOOGLE_CREDENTIALS_JSON:
-                creds_dict = json.loads(GOOGLE_CREDENTIALS_JSON)
-                self.credentials = service_account.Credentials.from_service_account_info(
-                    creds_dict, 
-                    scopes=["https://www.googleapis.com/auth/spreadsheets"]
-                )
-            else:
-                raise ValueError("Missing Google credentials")
-            
-            self.sheets = build("sheets", "v4", credentials=self.credentials)
-            logger.info("Google Sheets initialized successfully")
-            
-        except Exception as e:
-            logger.error(f"Failed to initialize Google Sheets: {e}")
-            raise
+    def __init__(self, backend: Optional[StorageBackend] = None):
+        # מנוע האחסון נבחר לפי STORAGE_SETTINGS, אלא אם הוזרק מבחוץ
+        self.backend = backend or create_storage_backend()
+        self._executor = ThreadPoolExecutor(
+            max_workers=DATABASE_SETTINGS["io_workers"],
+            thread_name_prefix="storage-io"
+        )
+        
+        # במצב SQLite - שיקוף תקופתי לגיליון (אם יש פרטי Google)
+        self.exporter = None
+        if self.backend.name != "sheets" and GSHEETS_SPREADSHEET_ID and GOOGLE_CREDENTIALS_JSON:
+            seed = self.backend.is_empty()
+            if seed or STORAGE_SETTINGS["sheets_export_enabled"]:
+                try:
+                    exporter = SheetsExporter(self.backend, SheetsBackend())
+                    
+                    # קובץ SQLite חדש בהתקנה קיימת - הנתונים מגיעים מהגיליון
+                    if seed:
+                        exporter.seed()
+                    
+                    if STORAGE_SETTINGS["sheets_export_enabled"]:
+                        self.exporter = exporter
+                except Exception as e:
+                    logger.warning(f"Sheets export disabled: {e}")
+        
+        # יומן כתיבות מושהות - השינוי נרשם מקומית והגיליון מתעדכן ברקע
+        self.journal = None
+        self._flush_lock = threading.Lock()
+        if WRITE_BEHIND_SETTINGS["enabled"]:
+            self.journal = WriteBehindJournal(WRITE_BEHIND_SETTINGS["journal_path"])
+        
+        # מאזינים לשינויי זוגות (למשל cache הקבוצות ב-WebhookHandler)
+        self._couple_listeners: List[Callable[[Dict], None]] = []
+        
+        # פרטי זוג לפי group_id - קוראים לא ממתינים לאחסון כשיש ערך עדכני
+        self.couples = CoupleCache(self._load_couple, self._executor.submit)
+        
+        # סיווגי ספקים מה-LLM - משותפים לכל המופעים דרך האחסון
+        self.category_cache = VendorCategoryCache(self.backend)
+        
+        # טבלת הוצאות בזיכרון - נטענת פעם אחת, האחסון מתעדכן ב-write-through
+        self.expenses = ExpenseStore(
+            lambda: self.backend.read_table("expenses"),
+            on_reload=self._overlay_pending_writes if self.journal else None
+        )
+        
+        # אינדקס ספקים בזיכרון - חיפוש קטגוריה בלי לקרוא את כל טבלת הספקים
+        self._vendors_lock = threading.Lock()
+        self.vendors = VendorIndex(
+            lambda: self.backend.read_table("vendors"),
+            on_reload=self._overlay_pending_vendors if self.journal else None
+        )
     
     def _get_current_timestamp(self) -> str:
         """מחזיר timestamp נוכחי"""
         return datetime.now(timezone.utc).isoformat()
     
+    @staticmethod
+    def _table_name(range_name: str) -> str:
+        """ממיר טווח בסגנון גיליון ("couples!A:G") לשם טבלה"""
+        return range_name.split('!')[0]
+    
     def _read_sheet_range(self, range_name: str) -> List[List[str]]:
-        """קורא טווח מהגיליון"""
+        """קורא טבלה שלמה (כולל כותרת) לפי טווח בסגנון גיליון"""
+        table = self._table_name(range_name)
         try:
-            result = self.sheets.spreadsheets().values().get(
-                spreadsheetId=GSHEETS_SPREADSHEET_ID,
-                range=range_name
-            ).execute()
-            
-            values = result.get('values', [])
-            logger.debug(f"Read {len(values)} rows from {range_name}")
-            return values
+            return self.backend.read_table(table)
             
         except Exception as e:
-            logger.error(f"Failed to read {range_name}: {e}")
+            logger.error(f"Failed to read {table}: {e}")
             return []
     
-    def _append_sheet_row(self, range_name: str, values: List) -> bool:
-        """מוסיף שורה לגיליון"""
+    def _append_rows(self, table: str, rows: List[List]) -> Tuple[bool, Optional[int]]:
+        """מוסיף שורות לטבלה ומחזיר (הצלחה, מספר השורה הראשונה שנכתבה)"""
         try:
-            body = {'values': [values]}
-            
-            result = self.sheets.spreadsheets().values().append(
-                spreadsheetId=GSHEETS_SPREADSHEET_ID,
-                range=range_name,
-                valueInputOption='USER_ENTERED',
-                insertDataOption='INSERT_ROWS',
-                body=body
-            ).execute()
-            
-            logger.info(f"Added row to {range_name}")
-            return True
+            return True, self.backend.append_rows(table, rows)
             
         except Exception as e:
-            logger.error(f"Failed to append to {range_name}: {e}")
-            return False
+            logger.error(f"Failed to append to {table}: {e}")
+            return False, None
+    
+    def _append_sheet_row(self, range_name: str, values: List) -> bool:
+        """מוסיף שורה לטבלה לפי טווח בסגנון גיליון"""
+        success, _ = self._append_rows(self._table_name(range_name), [values])
+        return success
     
-    def _update_sheet_row(self, range_name: str, values: List) -> bool:
-        """מעדכן שורה בגיליון"""
+    def _update_rows(self, table: str, rows_by_number: Dict[int, List]) -> List[int]:
+        """מעדכן שורות שלמות ומחזיר את מספרי השורות שנכתבו"""
         try:
-            body = {'values': [values]}
-            
-            result = self.sheets.spreadsheets().values().update(
-                spreadsheetId=GSHEETS_SPREADSHEET_ID,
-                range=range_name,
-                valueInputOption='USER_ENTERED',
-                body=body
-            ).execute()
-            
-            logger.info(f"Updated row in {range_name}")
-            return True
+            return self.backend.update_rows(table, rows_by_number)
             
         except Exception as e:
-            logger.error(f"Failed to update {range_name}: {e}")
-            return False
+            logger.error(f"Failed to update {len(rows_by_number)} row(s) in {table}: {e}")
+            return []
     
     # === הוצאות ===
     
+    def _prepare_new_expense(self, expense_data: Dict):
+        """משלים מזהה וערכי ברירת מחדל להוצאה חדשה"""
+        # יצירת expense_id ייחודי
+        if not expense_data.get('expense_id'):
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            import random
+            expense_data['expense_id'] = f"EXP_{timestamp}_{random.randint(1000, 9999)}"
+        
+        # מילוי ערכי ברירת מחדל
+        current_time = self._get_current_timestamp()
+        expense_data.setdefault('created_at', current_time)
+        expense_data.setdefault('status', 'active')
+        expense_data.setdefault('needs_review', False)
+        expense_data.setdefault('last_updated', '')
+    
     def save_expense(self, expense_data: Dict) -> bool:
         """שומר הוצאה חדשה"""
         try:
-            # יצירת expense_id ייחודי
-            if not expense_data.get('expense_id'):
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                import random
-                expense_data['expense_id'] = f"EXP_{timestamp}_{random.randint(1000, 9999)}"
-            
-            # מילוי ערכי ברירת מחדל
-            current_time = self._get_current_timestamp()
-            expense_data.setdefault('created_at', current_time)
-            expense_data.setdefault('status', 'active')
-            expense_data.setdefault('needs_review', False)
-            expense_data.setdefault('last_updated', '')
+            self._prepare_new_expense(expense_data)
+            
+            if self.journal:
+                # כתיבה מושהית - נרשם ביומן, והשורה תתווסף לגיליון ע"י ה-flusher
+                record = ExpenseStore.row_to_expense(ExpenseStore.expense_to_row(expense_data))
+                self.journal.record(EXPENSE_APPEND, record['expense_id'], record)
+                self.expenses.add(record, None, pending=True)
+                logger.info(f"Journaled expense: {record['expense_id']}")
+                return True
             
-            # יצירת שורה לפי סדר הכותרות (כולל last_updated)
-            row_values = []
-            headers = EXPENSE_HEADERS
-            if 'last_updated' not in headers:
-                headers = headers + ['last_updated']
-                
-            for header in headers:
-                value = expense_data.get(header, '')
-                row_values.append(str(value) if value is not None else '')
+            # יצירת שורה לפי סדר הכותרות
+            row_values = ExpenseStore.expense_to_row(expense_data)
             
-            success = self._append_sheet_row(EXPENSES_SHEET, row_values)
+            success, row_number = self._append_rows("expenses", [row_values])
             
             if success:
+                self.expenses.add(expense_data, row_number)
                 logger.info(f"Saved expense: {expense_data.get('expense_id')}")
             
             return success
@@ -133,36 +158,56 @@ class DatabaseManager:
             logger.error(f"Failed to save expense: {e}")
             return False
     
-    def get_expenses_by_group(self, group_id: str, include_deleted: bool = False) -> List[Dict]:
-        """מחזיר כל ההוצאות של קבוצה"""
+    def save_expenses_bulk(self, expenses: List[Dict]) -> bool:
+        """שומר כמה הוצאות חדשות בכתיבה אחת (למשל אלבום קבלות)"""
+        if not expenses:
+            return True
+        
         try:
-            rows = self._read_sheet_range(EXPENSES_SHEET)
+            expense_ids = set()
+            for expense_data in expenses:
+                self._prepare_new_expense(expense_data)
+                # מזהים נוצרים לפי השנייה - באותה כתיבה מוודאים שאין כפילות
+                while expense_data['expense_id'] in expense_ids:
+                    del expense_data['expense_id']
+                    self._prepare_new_expense(expense_data)
+                expense_ids.add(expense_data['expense_id'])
+            
+            if self.journal:
+                for expense_data in expenses:
+                    record = ExpenseStore.row_to_expense(ExpenseStore.expense_to_row(expense_data))
+                    self.journal.record(EXPENSE_APPEND, record['expense_id'], record)
+                    self.expenses.add(record, None, pending=True)
+                logger.info(f"Journaled {len(expenses)} expenses")
+                return True
             
-            if not rows:
-                return []
+            rows = [ExpenseStore.expense_to_row(expense_data) for expense_data in expenses]
+            success, first_row = self._append_rows("expenses", rows)
             
-            # הסר כותרת
-            data_rows = rows[1:] if len(rows) > 1 else []
-            expenses = []
+            if success:
+                for i, expense_data in enumerate(expenses):
+                    self.expenses.add(expense_data, first_row + i if first_row else None)
+                logger.info(f"Saved {len(expenses)} expenses in one append")
             
-            for row in data_rows:
-                # וודא שיש מספיק עמודות
-                headers = EXPENSE_HEADERS
-                if 'last_updated' not in headers:
-                    headers = headers + ['last_updated']
-                    
-                if len(row) < len(headers):
-                    row.extend([''] * (len(headers) - len(row)))
-                
-                expense = dict(zip(headers, row))
-                
-                # סנן לפי קבוצה
-                if expense.get('group_id') == group_id:
-                    # סנן מחוקים אם צריך
-                    if not include_deleted and expense.get('status') == 'deleted':
-                        continue
-                    
-                    expenses.append(expense)
+            return success
+            
+        except Exception as e:
+            logger.error(f"Failed to save {len(expenses)} expenses: {e}")
+            return False
+    
+    def get_expense(self, expense_id: str) -> Optional[Dict]:
+        """מחזיר הוצאה לפי מזהה"""
+        try:
+            return self.expenses.get(expense_id)
+            
+        except Exception as e:
+            logger.error(f"Failed to get expense {expense_id}: {e}")
+            return None
+    
+    def get_expenses_by_group(self, group_id: str, include_deleted: bool = False) -> List[Dict]:
+        """מחזיר כל ההוצאות של קבוצה"""
+        try:
+            expenses = self.expenses.get_by_group(group_id, include_deleted)
             
             logger.debug(f"Found {len(expenses)} expenses for group {group_id}")
             return expenses
@@ -173,46 +218,86 @@ class DatabaseManager:
     
     def update_expense(self, expense_id: str, updates: Dict) -> bool:
         """מעדכן הוצאה קיימת עם כל השדות"""
+        results = self.update_expenses_bulk({expense_id: updates})
+        return results.get(expense_id, False)
+    
+    def update_expenses_bulk(self, updates_by_id: Dict[str, Dict]) -> Dict[str, bool]:
+        """מעדכן כמה הוצאות בקריאת batchUpdate אחת ומחזיר הצלחה לכל expense_id"""
+        results = {expense_id: False for expense_id in updates_by_id}
+        
         try:
-            rows = self._read_sheet_range(EXPENSES_SHEET)
+            if not updates_by_id:
+                return results
             
-            if not rows or len(rows) < 2:
-                return False
+            if not all(self.expenses.contains(eid) for eid in updates_by_id):
+                # אולי נוספו ע"י מופע אחר - טעינה מחדש אחת לפני שמוותרים
+                self.expenses.reload()
+            
+            timestamp = self._get_current_timestamp()
+            rows_by_id = {}
+            # עותקים עם last_updated - הקלט של הקורא לא משתנה
+            applied = {}
             
-            headers = rows[0]
-            # וודא שיש עמודת last_updated
-            if 'last_updated' not in headers:
-                headers.append('last_updated')
+            for expense_id, updates in updates_by_id.items():
+                expense = self.expenses.get(expense_id)
                 
-            data_rows = rows[1:]
+                if not expense:
+                    logger.warning(f"Expense {expense_id} not found for update")
+                    continue
+                
+                # הוסף timestamp לעדכון
+                updates = dict(updates, last_updated=timestamp)
+                applied[expense_id] = updates
+                
+                # עדכן את כל השדות הרלוונטיים
+                for field, value in updates.items():
+                    if field in expense:
+                        expense[field] = value
+                
+                rows_by_id[expense_id] = ExpenseStore.expense_to_row(expense)
             
-            for i, row in enumerate(data_rows):
-                if len(row) > 0 and row[0] == expense_id:
-                    # הוסף timestamp לעדכון
-                    updates['last_updated'] = self._get_current_timestamp()
-                    
-                    # וודא שהשורה מספיק ארוכה
-                    if len(row) < len(headers):
-                        row.extend([''] * (len(headers) - len(row)))
-                    
-                    # עדכן את כל השדות הרלוונטיים
-                    for field, value in updates.items():
-                        if field in headers:
-                            field_index = headers.index(field)
-                            row[field_index] = str(value) if value is not None else ''
-                    
-                    # עדכון בגיליון
-                    row_number = i + 2
-                    range_name = f"expenses!A{row_number}:M{row_number}"  # כולל עמודה M ל-last_updated
-                    
-                    return self._update_sheet_row(range_name, row)
+            if self.journal:
+                # כתיבה מושהית - ה-flusher יאחד עדכונים לאותה שורה
+                written = list(rows_by_id)
+                for expense_id in written:
+                    self.journal.record(EXPENSE_UPDATE, expense_id, applied[expense_id])
+            else:
+                # עדכון באחסון - ישירות לשורות הידועות, בלי קריאה מחדש
+                written = self._write_expense_rows(rows_by_id)
             
-            logger.warning(f"Expense {expense_id} not found for update")
-            return False
+            for expense_id in written:
+                self.expenses.apply_updates(expense_id, applied[expense_id])
+                results[expense_id] = True
+            
+            failed = [eid for eid, ok in results.items() if not ok]
+            if failed:
+                logger.warning(f"Failed to update {len(failed)} expense(s): {failed}")
+            
+            return results
             
         except Exception as e:
-            logger.error(f"Failed to update expense: {e}")
-            return False
+            logger.error(f"Failed to update expenses: {e}")
+            return results
+    
+    def _write_expense_rows(self, rows_by_id: Dict[str, List[str]]) -> List[str]:
+        """כותב שורות הוצאה שלמות לשורות הידועות שלהן ומחזיר את המזהים שנכתבו"""
+        rows_by_number = {}
+        rows_to_ids = {}
+        
+        for expense_id, row in rows_by_id.items():
+            row_number = self.expenses.get_row_number(expense_id)
+            if not row_number:
+                logger.warning(f"No sheet row known for expense {expense_id}")
+                continue
+            
+            rows_by_number[row_number] = row
+            rows_to_ids[row_number] = expense_id
+        
+        if not rows_by_number:
+            return []
+        
+        written = self._update_rows("expenses", rows_by_number)
+        return [rows_to_ids[row_number] for row_number in written if row_number in rows_to_ids]
     
     def delete_expense(self, expense_id: str) -> bool:
         """מוחק הוצאה (מעדכן סטטוס ל-deleted)"""
@@ -241,28 +326,66 @@ class DatabaseManager:
     
     # === זוגות ===
     
-    def get_couple_by_group_id(self, group_id: str) -> Optional[Dict]:
-        """מחזיר פרטי זוג לפי group_id"""
+    def add_couple_listener(self, listener: Callable[[Dict], None]):
+        """רושם פונקציה שתיקרא עם הזוג המעודכן אחרי כל כתיבה לזוג"""
+        self._couple_listeners.append(listener)
+    
+    def _notify_couple_changed(self, couple: Dict):
+        self.couples.set(couple.get('whatsapp_group_id'), couple)
+        for listener in self._couple_listeners:
+            try:
+                listener(couple)
+            except Exception as e:
+                logger.error(f"Couple listener failed: {e}")
+    
+    def get_couples_version(self) -> Optional[str]:
+        """מזהה גרסה זול לטבלת הזוגות - None אם המנוע לא תומך"""
         try:
-            rows = self._read_sheet_range(COUPLES_SHEET)
+            return self.backend.get_table_version("couples")
             
-            if not rows or len(rows) < 2:
-                return None
+        except Exception as e:
+            logger.debug(f"Failed to get couples version: {e}")
+            return None
+    
+    def add_couple(self, couple_data: Dict) -> bool:
+        """שומר זוג חדש"""
+        try:
+            # יצירת שורה לפי סדר הכותרות
+            row_values = []
+            for header in COUPLES_HEADERS:
+                value = couple_data.get(header, '')
+                row_values.append(str(value) if value is not None else '')
             
-            data_rows = rows[1:]
+            success, _ = self._append_rows("couples", [row_values])
             
-            for row in data_rows:
-                if len(row) < len(COUPLES_HEADERS):
-                    row.extend([''] * (len(COUPLES_HEADERS) - len(row)))
-                
-                couple = dict(zip(COUPLES_HEADERS, row))
-                
-                if couple.get('whatsapp_group_id') == group_id:
-                    logger.debug(f"Found couple for group {group_id}")
-                    return couple
+            if success:
+                logger.info(f"Saved couple for group {couple_data.get('whatsapp_group_id')}")
+                self._notify_couple_changed(dict(zip(COUPLES_HEADERS, row_values)))
             
-            logger.warning(f"No couple found for group {group_id}")
-            return None
+            return success
+            
+        except Exception as e:
+            logger.error(f"Failed to save couple: {e}")
+            return False
+    
+    def _load_couple(self, group_id: str) -> Optional[Dict]:
+        """קורא זוג מהאחסון (זורק חריגה בכישלון)"""
+        matches = self.backend.find_rows("couples", "whatsapp_group_id", group_id)
+        
+        for _, row in matches:
+            if len(row) < len(COUPLES_HEADERS):
+                row.extend([''] * (len(COUPLES_HEADERS) - len(row)))
+            
+            logger.debug(f"Found couple for group {group_id}")
+            return dict(zip(COUPLES_HEADERS, row))
+        
+        logger.warning(f"No couple found for group {group_id}")
+        return None
+    
+    def get_couple_by_group_id(self, group_id: str) -> Optional[Dict]:
+        """מחזיר פרטי זוג לפי group_id"""
+        try:
+            return self.couples.get(group_id)
             
         except Exception as e:
             logger.error(f"Failed to get couple by group {group_id}: {e}")
@@ -299,29 +422,26 @@ class DatabaseManager:
     def update_couple_field(self, group_id: str, field: str, value: str) -> bool:
         """מעדכן שדה בודד של זוג"""
         try:
-            rows = self._read_sheet_range(COUPLES_SHEET)
+            if field not in COUPLES_HEADERS:
+                return False
             
-            if not rows or len(rows) < 2:
+            # גם אם הכתיבה תיכשל באמצע - ערך שנקרא לפניה כבר לא אמין
+            self.couples.invalidate(group_id)
+            
+            matches = self.backend.find_rows("couples", "whatsapp_group_id", group_id)
+            if not matches:
                 return False
             
-            headers = rows[0]
-            data_rows = rows[1:]
+            row_number, row = matches[0]
+            if len(row) < len(COUPLES_HEADERS):
+                row.extend([''] * (len(COUPLES_HEADERS) - len(row)))
+            row[COUPLES_HEADERS.index(field)] = str(value)
             
-            for i, row in enumerate(data_rows):
-                if len(row) > 2 and row[2] == group_id:  # whatsapp_group_id בעמודה 3
-                    if field in COUPLES_HEADERS:
-                        field_index = COUPLES_HEADERS.index(field)
-                        if len(row) <= field_index:
-                            row.extend([''] * (field_index + 1 - len(row)))
-                        row[field_index] = str(value)
-                        
-                        # עדכון בגיליון
-                        row_number = i + 2
-                        range_name = f"couples!A{row_number}:G{row_number}"
-                        
-                        return self._update_sheet_row(range_name, row)
+            success = bool(self._update_rows("couples", {row_number: row}))
+            if success:
+                self._notify_couple_changed(dict(zip(COUPLES_HEADERS, row)))
             
-            return False
+            return success
             
         except Exception as e:
             logger.error(f"Failed to update couple field: {e}")
@@ -332,28 +452,11 @@ class DatabaseManager:
     def get_vendor_category(self, vendor_name: str) -> Optional[str]:
         """מחזיר קטגוריה של ספק קיים"""
         try:
-            rows = self._read_sheet_range(VENDORS_SHEET)
-            
-            if not rows or len(rows) < 2:
-                return None
-            
-            data_rows = rows[1:]
-            vendor_lower = vendor_name.lower().strip()
+            vendor = self.vendors.lookup(vendor_name)
             
-            for row in data_rows:
-                if len(row) < len(VENDORS_HEADERS):
-                    continue
-                
-                vendor = dict(zip(VENDORS_HEADERS, row))
-                stored_vendor = vendor.get('vendor_name', '').lower().strip()
-                
-                # חיפוש מדויק או חלקי
-                if (stored_vendor == vendor_lower or 
-                    vendor_lower in stored_vendor or 
-                    stored_vendor in vendor_lower):
-                    
-                    logger.debug(f"Found category for vendor {vendor_name}: {vendor.get('category')}")
-                    return vendor.get('category')
+            if vendor:
+                logger.debug(f"Found category for vendor {vendor_name} ({vendor.get('vendor_name')}): {vendor.get('category')}")
+                return vendor.get('category')
             
             return None
             
@@ -361,24 +464,61 @@ class DatabaseManager:
             logger.error(f"Failed to get vendor category: {e}")
             return None
     
+    def get_learned_vendors(self, min_confidence: int = 0) -> List[Dict]:
+        """מחזיר את הספקים שנלמדו, בביטחון של min_confidence ומעלה"""
+        try:
+            return [vendor for vendor in self.vendors.all() if vendor_rank(vendor)[0] >= min_confidence]
+            
+        except Exception as e:
+            logger.error(f"Failed to get learned vendors: {e}")
+            return []
+    
     def save_vendor_category(self, vendor_name: str, category: str, confidence: int = 85, group_id: str = "") -> bool:
-        """שומר ספק וקטגוריה חדשים"""
+        """שומר ספק וקטגוריה - ספק קיים (לפי שם מנורמל) מתעדכן במקום"""
         try:
             current_time = self._get_current_timestamp()
+            existing = self.vendors.get_exact(vendor_name)
+            
+            if existing:
+                # שם, מקור ותאריך יצירה נשמרים; קטגוריה מוחלפת רק בביטחון גבוה יותר
+                existing_confidence, _ = vendor_rank(existing)
+                if category == existing.get('category'):
+                    confidence = max(confidence, existing_confidence)
+                elif confidence < existing_confidence:
+                    category, confidence = existing.get('category'), existing_confidence
+                
+                row_values = [
+                    existing.get('vendor_name') or vendor_name,
+                    category,
+                    str(confidence),
+                    current_time,
+                    existing.get('group_id_source', ''),
+                    existing.get('created_at') or current_time
+                ]
+            else:
+                row_values = [
+                    vendor_name,
+                    category,
+                    str(confidence),
+                    current_time,
+                    group_id,
+                    current_time
+                ]
+            
+            vendor = dict(zip(VENDORS_HEADERS, row_values))
+            
+            if self.journal:
+                self.journal.record(VENDOR_UPSERT, normalize_vendor_name(vendor_name), {'row': row_values})
+                self.vendors.add(vendor)
+                logger.info(f"Journaled vendor: {vendor_name} -> {category}")
+                return True
             
-            row_values = [
-                vendor_name,
-                category,
-                str(confidence),
-                current_time,
-                group_id,
-                current_time
-            ]
-            
-            success = self._append_sheet_row(VENDORS_SHEET, row_values)
+            with self._vendors_lock:
+                success = self._write_vendor_rows({vendor_name: row_values}) == [vendor_name]
             
             if success:
-                logger.info(f"Saved vendor: {vendor_name} -> {category}")
+                self.vendors.add(vendor)
+                logger.info(f"{'Updated' if existing else 'Saved'} vendor: {vendor_name} -> {category}")
             
             return success
             
@@ -386,6 +526,96 @@ class DatabaseManager:
             logger.error(f"Failed to save vendor: {e}")
             return False
     
+    def touch_vendor(self, vendor_name: str) -> bool:
+        """מעדכן last_seen של הספק שהתאים לשם (פעם ביום לכל היותר)"""
+        try:
+            vendor = self.vendors.lookup(vendor_name)
+            if not vendor:
+                return False
+            
+            if vendor.get('last_seen', '')[:10] == self._get_current_timestamp()[:10]:
+                return True
+            
+            confidence, _ = vendor_rank(vendor)
+            return self.save_vendor_category(vendor['vendor_name'], vendor['category'], confidence)
+            
+        except Exception as e:
+            logger.error(f"Failed to touch vendor: {e}")
+            return False
+    
+    def _write_vendor_rows(self, rows_by_name: Dict[str, List], recheck: bool = True) -> List[str]:
+        """כותב ספקים: עדכון במקום לספק שיש לו שורה, הוספה לחדשים. מחזיר את השמות שנכתבו"""
+        updates = {}
+        update_names = {}
+        new_names = []
+        
+        for vendor_name, row in rows_by_name.items():
+            row_number = self.vendors.get_row_number(vendor_name)
+            if row_number:
+                updates[row_number] = row
+                update_names[row_number] = vendor_name
+            else:
+                new_names.append(vendor_name)
+        
+        if updates and recheck:
+            # מופע אחר אולי איחד את הטבלה והשורות זזו - לא דורסים שורה של ספק אחר
+            current = self.backend.read_rows("vendors", list(updates))
+            moved = [
+                row_number for row_number, vendor_name in update_names.items()
+                if normalize_vendor_name((current.get(row_number) or [''])[0]) != normalize_vendor_name(vendor_name)
+            ]
+            if moved:
+                logger.warning(f"Vendor rows moved since the last load ({len(moved)}) - reloading the index")
+                self.vendors.reload()
+                return self._write_vendor_rows(rows_by_name, recheck=False)
+        
+        written = [update_names[row_number] for row_number in self._update_rows("vendors", updates)] if updates else []
+        
+        if new_names:
+            success, first_row = self._append_rows("vendors", [rows_by_name[name] for name in new_names])
+            if success:
+                for i, vendor_name in enumerate(new_names):
+                    self.vendors.set_row_number(vendor_name, first_row + i if first_row else None)
+                written.extend(new_names)
+        
+        return written
+    
+    def compact_vendors(self) -> int:
+        """מוחק שורות כפולות מטבלת הספקים ומחזיר כמה שורות הוסרו.
+        
+        הנחת מקביליות: האיחוד רץ במופע אחד בלבד (VENDOR_COMPACTION_ENABLED), כי אין נעילה בין
+        מופעים. השורות המיותרות נמחקות במקומן בפעולה אחת, אחרי בדיקה חוזרת שלא השתנו - שורות
+        שנוספו או עודכנו בינתיים לא נדרסות. מופעים אחרים מזהים שורות שזזו לפני עדכון במקום.
+        """
+        if self.vendors.duplicate_rows() == 0:
+            return 0
+        
+        try:
+            width = len(VENDORS_HEADERS)
+            pad = lambda row: (list(row) + [''] * width)[:width]
+            
+            with self._vendors_lock:
+                rows = self.backend.read_table("vendors")[1:]
+                redundant = [i + 2 for i in redundant_vendor_rows(rows)]
+                if not redundant:
+                    return 0
+                
+                # שורה שהשתנתה מאז הקריאה (כתיבה של מופע אחר) נשארת לסבב הבא
+                current = self.backend.read_rows("vendors", redundant)
+                redundant = [n for n in redundant if pad(current.get(n, [])) == pad(rows[n - 2])]
+                
+                removed = self.backend.delete_rows("vendors", redundant)
+                # מספרי השורות השתנו - עדכונים ממתינים ביומן יחושבו מחדש מול האינדקס החדש
+                self.vendors.reload()
+            
+            logger.info(f"Compacted vendors table: removed {removed} of {len(rows)} rows")
+            return removed
+            
+        except Exception as e:
+            logger.error(f"Failed to compact vendors table: {e}")
+            self.vendors.invalidate()
+            return 0
+    
     # === מקדמות ===
     
     def find_related_expenses(self, vendor_name: str, group_id: str) -> List[Dict]:
@@ -420,27 +650,125 @@ class DatabaseManager:
             if len(expenses) <= 1:
                 return True
             
+            updates = {}
+            
             # עדכן כל התשלומים חוץ מהאחרון למקדמות
             for i, expense in enumerate(expenses[:-1]):
                 payment_type = f"advance_{i+1}" if len(expenses) > 2 else "advance"
-                self.update_expense(expense['expense_id'], {'payment_type': payment_type})
+                updates[expense['expense_id']] = {'payment_type': payment_type}
             
             # האחרון תמיד סופי
-            self.update_expense(expenses[-1]['expense_id'], {'payment_type': 'final'})
+            updates[expenses[-1]['expense_id']] = {'payment_type': 'final'}
             
-            logger.info(f"Updated payment types for {len(expenses)} expenses")
-            return True
+            results = self.update_expenses_bulk(updates)
+            
+            logger.info(f"Updated payment types for {sum(results.values())}/{len(expenses)} expenses")
+            return all(results.values())
             
         except Exception as e:
             logger.error(f"Failed to update payment types: {e}")
             return False
     
+    # === כתיבה מושהית ===
+    
+    def _overlay_pending_writes(self, store: ExpenseStore):
+        """מחיל על המאגר שנטען מהגיליון כתיבות שעדיין ממתינות ביומן"""
+        for _, kind, key, payload in self.journal.pending(limit=-1):
+            if kind == EXPENSE_APPEND:
+                store.add(payload, None, pending=True)
+            elif kind == EXPENSE_UPDATE:
+                store.apply_updates(key, payload)
+    
+    def _overlay_pending_vendors(self, index: VendorIndex):
+        """מחיל על האינדקס ספקים שעדיין ממתינים ביומן"""
+        for _, kind, _, payload in self.journal.pending(limit=-1):
+            if kind in (VENDOR_APPEND, VENDOR_UPSERT):
+                index.add(dict(zip(VENDORS_HEADERS, payload['row'])))
+    
+    def flush_pending_writes(self) -> int:
+        """דוחף כתיבות ממתינות מהיומן לגיליון ומחזיר כמה רשומות נדחפו"""
+        if not self.journal or not self._flush_lock.acquire(blocking=False):
+            return 0
+        
+        try:
+            entries = self.journal.pending(WRITE_BEHIND_SETTINGS["max_batch_size"])
+            if not entries:
+                return 0
+            
+            # איחוד: עדכונים לאותה הוצאה מתמזגים, ועדכון להוצאה שטרם נכתבה נכנס לשורה החדשה
+            appends = {}
+            append_entries = []
+            updated = {}
+            # ספקים: השורה האחרונה לכל שם מנורמל
+            vendor_rows = {}
+            vendor_entries = {}
+            
+            for entry_id, kind, key, payload in entries:
+                if kind == EXPENSE_APPEND and self.expenses.get_row_number(key):
+                    # כבר נכתבה לפני קריסה - רק מעדכנים את השורה כדי לא לשכפל
+                    updated.setdefault(key, []).append(entry_id)
+                elif kind == EXPENSE_APPEND:
+                    appends[key] = payload
+                    append_entries.append(entry_id)
+                elif kind == EXPENSE_UPDATE and key in appends:
+                    appends[key].update(payload)
+                    append_entries.append(entry_id)
+                elif kind == EXPENSE_UPDATE:
+                    updated.setdefault(key, []).append(entry_id)
+                elif kind in (VENDOR_APPEND, VENDOR_UPSERT):
+                    vendor_key = normalize_vendor_name(payload['row'][0])
+                    vendor_rows[vendor_key] = payload['row']
+                    vendor_entries.setdefault(vendor_key, []).append(entry_id)
+            
+            flushed = []
+            
+            if appends:
+                rows = [ExpenseStore.expense_to_row(expense) for expense in appends.values()]
+                success, first_row = self._append_rows("expenses", rows)
+                if not success:
+                    # בלי השורות החדשות אין טעם לעדכן אותן - ננסה שוב בסבב הבא
+                    return 0
+                
+                for i, expense_id in enumerate(appends):
+                    self.expenses.set_row_number(expense_id, first_row + i if first_row else None)
+                flushed.extend(append_entries)
+            
+            if updated:
+                rows_by_id = {}
+                for expense_id, entry_ids in updated.items():
+                    expense = self.expenses.get(expense_id)
+                    if expense:
+                        rows_by_id[expense_id] = ExpenseStore.expense_to_row(expense)
+                    else:
+                        # ההוצאה נמחקה מהגיליון ידנית - אין מה לעדכן
+                        logger.warning(f"Dropping journaled update for missing expense {expense_id}")
+                        flushed.extend(entry_ids)
+                
+                for expense_id in self._write_expense_rows(rows_by_id):
+                    flushed.extend(updated[expense_id])
+            
+            if vendor_rows:
+                with self._vendors_lock:
+                    for vendor_key in self._write_vendor_rows(vendor_rows):
+                        flushed.extend(vendor_entries[vendor_key])
+            
+            self.journal.remove(flushed)
+            logger.info(f"Flushed {len(flushed)}/{len(entries)} journaled write(s) to {self.backend.name}")
+            return len(flushed)
+            
+        except Exception as e:
+            logger.error(f"Failed to flush journaled writes: {e}")
+            return 0
+            
+        finally:
+            self._flush_lock.release()
+    
     # === בדיקות תקינות ===
     
     def health_check(self) -> Dict[str, bool]:
         """בודק שהמערכת עובדת"""
         checks = {
-            "sheets_connection": False,
+            "storage_connection": False,
             "can_read_expenses": False,
             "can_read_couples": False,
             "can_read_vendors": False
@@ -448,23 +776,115 @@ class DatabaseManager:
         
         try:
             # בדיקת חיבור
-            if self.sheets:
-                checks["sheets_connection"] = True
+            checks["storage_connection"] = self.backend.health_check().get("connection", False)
             
             # בדיקת קריאה
-            expenses = self._read_sheet_range(EXPENSES_SHEET)
-            if expenses is not None:
-                checks["can_read_expenses"] = True
-            
-            couples = self._read_sheet_range(COUPLES_SHEET)
-            if couples is not None:
-                checks["can_read_couples"] = True
-                
-            vendors = self._read_sheet_range(VENDORS_SHEET)
-            if vendors is not None:
-                checks["can_read_vendors"] = True
+            for table in ("expenses", "couples", "vendors"):
+                try:
+                    self.backend.read_table(table)
+                    checks[f"can_read_{table}"] = True
+                except Exception as e:
+                    logger.error(f"Health check cannot read {table}: {e}")
             
         except Exception as e:
             logger.error(f"Health check failed: {e}")
         
-        return checks
\ No newline at end of file
+        return checks
+    
+    # === API אסינכרוני ===
+    # כל פעולות האחסון חוסמות - מריצים אותן ב-thread pool מוגבל כדי לא לתקוע את ה-event loop
+    
+    async def run_async(self, func: Callable, *args, **kwargs) -> Any:
+        """מריץ פעולה חוסמת על ה-thread pool של האחסון"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+    
+    async def save_expense_async(self, expense_data: Dict) -> bool:
+        return await self.run_async(self.save_expense, expense_data)
+    
+    async def save_expenses_bulk_async(self, expenses: List[Dict]) -> bool:
+        return await self.run_async(self.save_expenses_bulk, expenses)
+    
+    async def get_expense_async(self, expense_id: str) -> Optional[Dict]:
+        return await self.run_async(self.get_expense, expense_id)
+    
+    async def get_expenses_by_group_async(self, group_id: str, include_deleted: bool = False) -> List[Dict]:
+        return await self.run_async(self.get_expenses_by_group, group_id, include_deleted)
+    
+    async def update_expense_async(self, expense_id: str, updates: Dict) -> bool:
+        return await self.run_async(self.update_expense, expense_id, updates)
+    
+    async def update_expenses_bulk_async(self, updates_by_id: Dict[str, Dict]) -> Dict[str, bool]:
+        return await self.run_async(self.update_expenses_bulk, updates_by_id)
+    
+    async def delete_expense_async(self, expense_id: str) -> bool:
+        return await self.run_async(self.delete_expense, expense_id)
+    
+    async def update_expense_status_async(self, expense_id: str, status: str, deleted_at: Optional[str] = None) -> bool:
+        return await self.run_async(self.update_expense_status, expense_id, status, deleted_at)
+    
+    async def get_couple_by_group_id_async(self, group_id: str) -> Optional[Dict]:
+        # פגיעה ב-cache לא צריכה לעבור דרך ה-thread pool
+        hit, couple = self.couples.lookup(group_id)
+        if hit:
+            return couple
+        return await self.run_async(self.get_couple_by_group_id, group_id)
+    
+    async def get_all_active_couples_async(self) -> List[Dict]:
+        return await self.run_async(self.get_all_active_couples)
+    
+    async def add_couple_async(self, couple_data: Dict) -> bool:
+        return await self.run_async(self.add_couple, couple_data)
+    
+    async def get_couples_version_async(self) -> Optional[str]:
+        return await self.run_async(self.get_couples_version)
+    
+    async def update_couple_field_async(self, group_id: str, field: str, value: str) -> bool:
+        return await self.run_async(self.update_couple_field, group_id, field, value)
+    
+    async def get_vendor_category_async(self, vendor_name: str) -> Optional[str]:
+        return await self.run_async(self.get_vendor_category, vendor_name)
+    
+    async def get_learned_vendors_async(self, min_confidence: int = 0) -> List[Dict]:
+        return await self.run_async(self.get_learned_vendors, min_confidence)
+    
+    async def save_vendor_category_async(self, vendor_name: str, category: str, confidence: int = 85, group_id: str = "") -> bool:
+        return await self.run_async(self.save_vendor_category, vendor_name, category, confidence, group_id)
+    
+    async def touch_vendor_async(self, vendor_name: str) -> bool:
+        return await self.run_async(self.touch_vendor, vendor_name)
+    
+    async def compact_vendors_async(self) -> int:
+        return await self.run_async(self.compact_vendors)
+    
+    async def find_related_expenses_async(self, vendor_name: str, group_id: str) -> List[Dict]:
+        return await self.run_async(self.find_related_expenses, vendor_name, group_id)
+    
+    async def update_payment_types_async(self, expenses: List[Dict]) -> bool:
+        return await self.run_async(self.update_payment_types, expenses)
+    
+    async def health_check_async(self) -> Dict[str, bool]:
+        return await self.run_async(self.health_check)
+    
+    async def flush_pending_writes_async(self) -> int:
+        return await self.run_async(self.flush_pending_writes)
+    
+    def export_to_sheets(self) -> int:
+        """משקף לגיליון טבלאות שהשתנו (במצב SQLite בלבד)"""
+        if not self.exporter:
+            return 0
+        return self.exporter.export()
+    
+    async def export_to_sheets_async(self) -> int:
+        return await self.run_async(self.export_to_sheets)
+    
+    def close(self):
+        """דוחף כתיבות ממתינות, משחרר את ה-thread pool וסוגר את האחסון"""
+        self._executor.shutdown(wait=True)
+        
+        if self.journal:
+            self.flush_pending_writes()
+            self.journal.close()
+        
+        self.export_to_sheets()
+        self.backend.close()
@@ -0,0 +1,181 @@
+import time
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+from config import EXPENSE_HEADERS, EXPENSE_STORE_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+class ExpenseStore:
+    """טבלת הוצאות בזיכרון עם אינדקסים לפי expense_id ו-group_id.
+
+    הגיליון נשאר מקור האמת (write-through) - המאגר נטען פעם אחת ומתעדכן
+    בכל כתיבה, כך שחיפושים לא דורשים קריאה מלאה של הגיליון.
+    """
+
+    def __init__(self, loader: Callable[[], List[List[str]]],
+                 on_reload: Optional[Callable[['ExpenseStore'], None]] = None):
+        # loader מחזיר את כל שורות הגיליון כולל שורת הכותרת, וזורק חריגה בכישלון
+        self._loader = loader
+        # on_reload מאפשר להחיל מחדש שינויים שעוד לא הגיעו לגיליון
+        self._on_reload = on_reload
+        self._lock = threading.RLock()
+        self._by_id: Dict[str, Dict] = {}
+        self._by_group: Dict[str, List[str]] = {}
+        self._row_numbers: Dict[str, int] = {}
+        self._loaded_at: Optional[float] = None
+
+    # === טעינה ===
+
+    def _is_stale(self) -> bool:
+        """בודק אם צריך לטעון מחדש מהגיליון"""
+        if self._loaded_at is None:
+            return True
+
+        interval = EXPENSE_STORE_SETTINGS["reload_interval_seconds"]
+        return bool(interval) and time.monotonic() - self._loaded_at > interval
+
+    def _ensure_loaded(self):
+        """טוען את הטבלה אם עדיין לא נטענה או שפג תוקפה"""
+        if self._is_stale():
+            self.reload()
+
+    def reload(self):
+        """טוען מחדש את כל ההוצאות מהגיליון ובונה אינדקסים"""
+        with self._lock:
+            rows = self._loader()
+
+            by_id = {}
+            by_group = {}
+            row_numbers = {}
+
+            # שורה 1 היא כותרת - שורות הנתונים מתחילות בשורה 2
+            for i, row in enumerate(rows[1:]):
+                expense = self.row_to_expense(row)
+                expense_id = expense.get('expense_id')
+                if not expense_id:
+                    continue
+
+                if expense_id not in by_id:
+                    by_group.setdefault(expense.get('group_id', ''), []).append(expense_id)
+
+                by_id[expense_id] = expense
+                row_numbers[expense_id] = i + 2
+
+            self._by_id = by_id
+            self._by_group = by_group
+            self._row_numbers = row_numbers
+            self._loaded_at = time.monotonic()
+
+            if self._on_reload:
+                self._on_reload(self)
+
+            logger.info(f"Expense store loaded: {len(by_id)} expenses, {len(by_group)} groups")
+
+    def invalidate(self):
+        """מסמן את המאגר לטעינה מחדש בגישה הבאה"""
+        with self._lock:
+            self._loaded_at = None
+
+    # === המרות ===
+
+    @staticmethod
+    def row_to_expense(row: List) -> Dict:
+        """ממיר שורת גיליון ל-dict לפי סדר הכותרות"""
+        values = list(row) + [''] * (len(EXPENSE_HEADERS) - len(row))
+        return dict(zip(EXPENSE_HEADERS, values))
+
+    @staticmethod
+    def expense_to_row(expense: Dict) -> List[str]:
+        """ממיר הוצאה לשורת גיליון לפי סדר הכותרות"""
+        row = []
+        for header in EXPENSE_HEADERS:
+            value = expense.get(header, '')
+            row.append(str(value) if value is not None else '')
+        return row
+
+    # === קריאה ===
+
+    def get(self, expense_id: str) -> Optional[Dict]:
+        """מחזיר עותק של הוצאה לפי מזהה"""
+        with self._lock:
+            self._ensure_loaded()
+            expense = self._by_id.get(expense_id)
+            return dict(expense) if expense else None
+
+    def get_by_group(self, group_id: str, include_deleted: bool = False) -> List[Dict]:
+        """מחזיר עותקים של הוצאות קבוצה לפי סדר הגיליון"""
+        with self._lock:
+            self._ensure_loaded()
+            expenses = []
+
+            for expense_id in self._by_group.get(group_id, []):
+                expense = self._by_id[expense_id]
+                if not include_deleted and expense.get('status') == 'deleted':
+                    continue
+                expenses.append(dict(expense))
+
+            return expenses
+
+    def get_row_number(self, expense_id: str) -> Optional[int]:
+        """מחזיר את מספר השורה של הוצאה בגיליון"""
+        with self._lock:
+            self._ensure_loaded()
+            return self._row_numbers.get(expense_id)
+
+    # === כתיבה (אחרי שהגיליון עודכן) ===
+
+    def add(self, expense: Dict, row_number: Optional[int], pending: bool = False):
+        """מוסיף הוצאה שנשמרה בגיליון (או שממתינה ביומן הכתיבות כש-pending)"""
+        with self._lock:
+            if self._loaded_at is None:
+                # טרם נטען - הטעינה הבאה תכלול את השורה החדשה
+                return
+
+            if row_number is None and not pending:
+                # לא ידוע איפה נכתבה השורה - עדיף לטעון מחדש מאשר לנחש
+                self.invalidate()
+                return
+
+            record = self.row_to_expense(self.expense_to_row(expense))
+            expense_id = record['expense_id']
+
+            if expense_id not in self._by_id:
+                self._by_group.setdefault(record.get('group_id', ''), []).append(expense_id)
+
+            self._by_id[expense_id] = record
+            if row_number is not None:
+                self._row_numbers[expense_id] = row_number
+
+    def set_row_number(self, expense_id: str, row_number: Optional[int]):
+        """רושם את מספר השורה של הוצאה שנדחפה מהיומן לגיליון"""
+        with self._lock:
+            if row_number is None:
+                self.invalidate()
+            elif expense_id in self._by_id:
+                self._row_numbers[expense_id] = row_number
+
+    def contains(self, expense_id: str) -> bool:
+        """בודק אם הוצאה קיימת במאגר (כולל הוצאות שממתינות לכתיבה)"""
+        with self._lock:
+            self._ensure_loaded()
+            return expense_id in self._by_id
+
+    def apply_updates(self, expense_id: str, updates: Dict):
+        """מעדכן שדות של הוצאה קיימת"""
+        with self._lock:
+            expense = self._by_id.get(expense_id)
+            if not expense:
+                return
+
+            old_group = expense.get('group_id', '')
+
+            for field, value in updates.items():
+                if field in expense:
+                    expense[field] = str(value) if value is not None else ''
+
+            # העברת הוצאה בין קבוצות (נדיר, אבל האינדקס חייב להישאר נכון)
+            new_group = expense.get('group_id', '')
+            if new_group != old_group:
+                self._by_group[old_group].remove(expense_id)
+                self._by_group.setdefault(new_group, []).append(expense_id)
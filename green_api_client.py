@@ -0,0 +1,113 @@
+import hashlib
+import logging
+import importlib.util
+from typing import Dict, List, NamedTuple, Optional
+import httpx
+from config import *
+
+logger = logging.getLogger(__name__)
+
+def _http2_available() -> bool:
+    """HTTP/2 ב-httpx דורש את החבילה h2 (httpx[http2])"""
+    return importlib.util.find_spec("h2") is not None
+
+class FileTooLargeError(Exception):
+    """הקובץ להורדה חורג מהגודל המותר"""
+
+class DownloadedFile(NamedTuple):
+    content: bytes
+    sha256: str  # מחושב תוך כדי ההורדה
+
+class GreenAPIClient:
+    """לקוח HTTP יחיד ל-Green API עם מאגר חיבורים פתוחים (keep-alive).
+
+    נפתח פעם אחת בעליית השרת ונסגר בכיבוי, כך שהודעות יוצאות לא משלמות
+    על לחיצת TCP/TLS חדשה בכל שליחה.
+    """
+
+    def __init__(self, instance_id: str = GREENAPI_INSTANCE_ID, token: str = GREENAPI_TOKEN):
+        self.instance_id = instance_id
+        self.token = token
+        self.base_url = GREEN_API_SETTINGS["base_url"].rstrip('/')
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _create_client(self) -> httpx.AsyncClient:
+        """יוצר את ה-AsyncClient עם מגבלות החיבורים מההגדרות"""
+        http2 = GREEN_API_SETTINGS["http2"] and _http2_available()
+        limits = httpx.Limits(
+            max_connections=GREEN_API_SETTINGS["max_connections"],
+            max_keepalive_connections=GREEN_API_SETTINGS["max_keepalive_connections"],
+            keepalive_expiry=GREEN_API_SETTINGS["keepalive_expiry_seconds"]
+        )
+
+        # retries בשכבת ה-transport חוזר רק על כשלי התחברות - בטוח גם ל-POST
+        transport = httpx.AsyncHTTPTransport(
+            http2=http2,
+            limits=limits,
+            retries=WHATSAPP_SETTINGS["max_retries"]
+        )
+
+        logger.info(f"Green API client started (http2={http2}, max_connections={limits.max_connections})")
+        return httpx.AsyncClient(transport=transport, timeout=WHATSAPP_SETTINGS["api_timeout"])
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """מחזיר את הלקוח המשותף (נוצר בעצלתיים אם start לא נקרא)"""
+        if self._client is None or self._client.is_closed:
+            self._client = self._create_client()
+        return self._client
+
+    async def start(self):
+        """פותח את מאגר החיבורים"""
+        _ = self.client
+
+    async def close(self):
+        """סוגר את כל החיבורים הפתוחים"""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+            logger.info("Green API client closed")
+        self._client = None
+
+    def _url(self, method: str) -> str:
+        return f"{self.base_url}/waInstance{self.instance_id}/{method}/{self.token}"
+
+    async def _post(self, method: str, payload: Dict) -> Dict:
+        """שולח בקשת POST ל-Green API ומחזיר את ה-JSON - זורק חריגה בכישלון"""
+        response = await self.client.post(self._url(method), json=payload)
+        response.raise_for_status()
+        return response.json()
+
+    # === API ===
+
+    async def send_message(self, chat_id: str, message: str) -> Dict:
+        """שולח הודעת טקסט ומחזיר את תשובת השרת (כולל idMessage)"""
+        return await self._post("sendMessage", {"chatId": chat_id, "message": message})
+
+    async def create_group(self, group_name: str, chat_ids: List[str]) -> Dict:
+        """יוצר קבוצת WhatsApp ומחזיר את תשובת השרת (created, chatId)"""
+        return await self._post("createGroup", {"groupName": group_name, "chatIds": chat_ids})
+
+    async def download_file(self, download_url: str, max_bytes: Optional[int] = None) -> DownloadedFile:
+        """מוריד קובץ מדיה מ-downloadUrl שהתקבל ב-webhook.
+
+        ההורדה בזרימה: נעצרת ברגע שעוברים את max_bytes (זורקת FileTooLargeError),
+        כך שקובץ ענק לא נטען לזיכרון, וה-sha256 מחושב על כל chunk בזמן שהוא מגיע.
+        """
+        hasher = hashlib.sha256()
+        buffer = bytearray()
+
+        async with self.client.stream("GET", download_url) as response:
+            response.raise_for_status()
+
+            declared_size = int(response.headers.get("content-length") or 0)
+            if max_bytes and declared_size > max_bytes:
+                raise FileTooLargeError(f"File is {declared_size} bytes, limit is {max_bytes}")
+
+            async for chunk in response.aiter_bytes(GREEN_API_SETTINGS["download_chunk_size"]):
+                if max_bytes and len(buffer) + len(chunk) > max_bytes:
+                    raise FileTooLargeError(f"File exceeded {max_bytes} bytes while downloading")
+
+                hasher.update(chunk)
+                buffer.extend(chunk)
+
+        return DownloadedFile(bytes(buffer), hasher.hexdigest())
@@ -0,0 +1,38 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+class GroupLanes:
+    """נתיב עיבוד סדרתי לכל קבוצה.
+
+    הודעות של אותה קבוצה ממתינות זו לזו (asyncio.Lock הוגן - לפי סדר ההגעה),
+    וקבוצות שונות רצות במקביל. נעילה נמחקת כשאין מי שמחכה לה, כך שהמבנה
+    לא גדל עם מספר הקבוצות שאי פעם כתבו.
+    """
+
+    def __init__(self):
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._users: Dict[str, int] = {}
+
+    @asynccontextmanager
+    async def lane(self, group_id: str):
+        lock = self._locks.get(group_id)
+        if lock is None:
+            lock = self._locks[group_id] = asyncio.Lock()
+        self._users[group_id] = self._users.get(group_id, 0) + 1
+
+        try:
+            async with lock:
+                yield
+        finally:
+            self._users[group_id] -= 1
+            if not self._users[group_id]:
+                del self._users[group_id]
+                del self._locks[group_id]
+
+    def active_groups(self) -> int:
+        """מספר הקבוצות שיש להן הודעה בעיבוד או בהמתנה"""
+        return len(self._locks)
@@ -0,0 +1,136 @@
+import io
+import logging
+from typing import Optional, Tuple
+from config import SAFETY_SETTINGS, IMAGE_PREPROCESS_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # בלי Pillow התמונה נשלחת כמו שהיא, רק עם סוג נכון
+    Image = None
+    ImageOps = None
+
+# פורמט -> (סיומות מתאימות ב-allowed_image_types, MIME)
+IMAGE_FORMATS = {
+    "jpeg": ((".jpg", ".jpeg"), "image/jpeg"),
+    "png": ((".png",), "image/png"),
+    "webp": ((".webp",), "image/webp"),
+    "gif": ((".gif",), "image/gif"),
+    "heic": ((".heic", ".heif"), "image/heic")
+}
+
+class ImageRejectedError(Exception):
+    """תמונה שלא עוברת את SAFETY_SETTINGS (גודל או סוג קובץ)"""
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason  # too_large / unsupported_type
+
+def detect_image_format(data: bytes) -> Optional[str]:
+    """מזהה את פורמט התמונה לפי magic bytes (לא לפי סיומת או כותרת)"""
+    if data.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if data[4:8] == b"ftyp" and data[8:12] in (b"heic", b"heix", b"mif1", b"msf1"):
+        return "heic"
+    return None
+
+def check_image_size(size_bytes: int):
+    """זורק ImageRejectedError אם הקובץ חורג מ-max_file_size_mb"""
+    max_bytes = SAFETY_SETTINGS["max_file_size_mb"] * 1024 * 1024
+    if size_bytes > max_bytes:
+        raise ImageRejectedError(
+            "too_large",
+            f"Image is {size_bytes / 1024 / 1024:.1f}MB, limit is {SAFETY_SETTINGS['max_file_size_mb']}MB"
+        )
+
+def validate_image(data: bytes) -> str:
+    """בודק גודל וסוג קובץ לפי SAFETY_SETTINGS ומחזיר את הפורמט שזוהה"""
+    check_image_size(len(data))
+
+    image_format = detect_image_format(data)
+    extensions = IMAGE_FORMATS.get(image_format, ((), None))[0]
+    if not any(ext in SAFETY_SETTINGS["allowed_image_types"] for ext in extensions):
+        raise ImageRejectedError("unsupported_type", f"Unsupported image type: {image_format or 'unknown'}")
+
+    return image_format
+
+def _crop_to_receipt(image: "Image.Image") -> "Image.Image":
+    """חותך לגבולות הנייר - האזור הבהיר על רקע כהה יותר"""
+    small = image.copy()
+    small.thumbnail((256, 256))
+    threshold = IMAGE_PREPROCESS_SETTINGS["crop_threshold"]
+    bbox = small.point(lambda p: 255 if p >= threshold else 0).getbbox()
+
+    if not bbox:
+        return image
+
+    # חיתוך רק כשהוא משמעותי והגיוני - אחרת כנראה שזה לא רקע
+    area_ratio = ((bbox[2] - bbox[0]) * (bbox[3] - bbox[1])) / float(small.width * small.height)
+    if not 0.2 <= area_ratio <= 0.95:
+        return image
+
+    scale_x = image.width / float(small.width)
+    scale_y = image.height / float(small.height)
+    margin = 4
+    return image.crop((
+        max(0, int((bbox[0] - margin) * scale_x)),
+        max(0, int((bbox[1] - margin) * scale_y)),
+        min(image.width, int((bbox[2] + margin) * scale_x)),
+        min(image.height, int((bbox[3] + margin) * scale_y))
+    ))
+
+def _target_size(width: int, height: int) -> Tuple[int, int]:
+    """גודל שמתאים לרזולוציה שמודל ה-vision באמת משתמש בה"""
+    long_side, short_side = max(width, height), min(width, height)
+    scale = min(
+        1.0,
+        IMAGE_PREPROCESS_SETTINGS["max_long_side"] / float(long_side),
+        IMAGE_PREPROCESS_SETTINGS["max_short_side"] / float(short_side)
+    )
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+def preprocess_receipt_image(data: bytes) -> Tuple[bytes, str]:
+    """מכין תמונת קבלה לניתוח ומחזיר (בייטים, MIME).
+
+    בודק גודל וסוג, מיישר לפי EXIF, חותך לגבולות הקבלה, מקטין לרזולוציית
+    המודל וממיר ל-JPEG אפור. זורק ImageRejectedError לתמונה לא מורשית.
+    """
+    image_format = validate_image(data)
+    mime_type = IMAGE_FORMATS[image_format][1]
+
+    if Image is None or not IMAGE_PREPROCESS_SETTINGS["enabled"]:
+        return data, mime_type
+
+    try:
+        with Image.open(io.BytesIO(data)) as source:
+            if image_format == "jpeg":
+                # פענוח JPEG מוקטן מראש - חוסך זיכרון ו-CPU בתמונות גדולות
+                source.draft("L", _target_size(*source.size))
+            image = ImageOps.exif_transpose(source)
+            image = image.convert("L")
+
+        if IMAGE_PREPROCESS_SETTINGS["auto_crop"]:
+            image = _crop_to_receipt(image)
+
+        target = _target_size(*image.size)
+        if target != image.size:
+            image = image.resize(target, Image.LANCZOS)
+
+        output = io.BytesIO()
+        image.save(output, "JPEG", quality=IMAGE_PREPROCESS_SETTINGS["jpeg_quality"], optimize=True)
+        processed = output.getvalue()
+
+        logger.info(f"Preprocessed receipt image: {len(data)} -> {len(processed)} bytes, {image.size[0]}x{image.size[1]}")
+        return processed, "image/jpeg"
+
+    except Exception as e:
+        # תמונה שלא הצלחנו לעבד עדיין עשויה להיות קריאה למודל
+        logger.warning(f"Image preprocessing failed, sending original: {e}")
+        return data, mime_type
@@ -0,0 +1,259 @@
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from config import JOB_QUEUE_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+class RetryableJobError(Exception):
+    """כישלון זמני (אחסון/רשת) - ה-handler זורק אותה כדי שהעבודה תחזור לתור"""
+
+class JobQueue:
+    """תור עבודות מקומי ומתמיד (SQLite WAL) לעיבוד webhooks ברקע.
+
+    כל עבודה משויכת למפתח קבוצה; עבודה נמסרת לעיבוד רק כשאין עבודה אחרת
+    של אותה קבוצה בעיבוד, כך שהודעות של זוג מעובדות לפי הסדר. עבודה מוחזקת
+    (held) כבר טופלה וממתינה לתוצאה מאוחרת - היא לא מעכבת את הקבוצה, אבל
+    נשארת בתור עד complete/fail.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                group_key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at TEXT NOT NULL,
+                available_at REAL NOT NULL DEFAULT 0
+            )
+        """)
+        # תור שנוצר לפני שהיה backoff
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")]
+        if "available_at" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN available_at REAL NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, id)")
+
+    def enqueue(self, group_key: str, payload: Dict) -> int:
+        """מוסיף עבודה לתור ומחזיר את המזהה שלה"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (group_key, payload, created_at) VALUES (?, ?, ?)",
+                (group_key, json.dumps(payload, ensure_ascii=False), datetime.now(timezone.utc).isoformat())
+            )
+            return cursor.lastrowid
+
+    def claim(self) -> Optional[Tuple[int, str, Dict]]:
+        """תופס את העבודה הוותיקה ביותר שהיא הראשונה בתור של הקבוצה שלה.
+
+        עבודה שממתינה לניסיון חוזר (backoff) מעכבת את שאר הודעות הקבוצה,
+        כדי שהסדר בתוך הקבוצה יישמר.
+        """
+        with self._lock:
+            row = self._conn.execute("""
+                SELECT id, group_key, payload FROM jobs
+                WHERE status = 'pending'
+                  AND available_at <= ?
+                  AND NOT EXISTS (
+                      SELECT 1 FROM jobs AS earlier
+                      WHERE earlier.group_key = jobs.group_key AND earlier.id < jobs.id
+                        AND earlier.status != 'held'
+                  )
+                ORDER BY id
+                LIMIT 1
+            """, (time.time(),)).fetchone()
+
+            if not row:
+                return None
+
+            self._conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1 WHERE id = ?", (row[0],)
+            )
+
+        return row[0], row[1], json.loads(row[2])
+
+    def complete(self, job_id: int):
+        """מוחק עבודה שהסתיימה"""
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def hold(self, job_id: int):
+        """משחרר את הקבוצה לעבודות הבאות, בלי למחוק את העבודה (ממתינה לתוצאה)"""
+        with self._lock:
+            self._conn.execute("UPDATE jobs SET status = 'held' WHERE id = ?", (job_id,))
+
+    def fail(self, job_id: int) -> bool:
+        """מחזיר עבודה שנכשלה לתור (עם backoff), או מוותר עליה אחרי max_attempts. מחזיר True אם תנוסה שוב"""
+        with self._lock:
+            row = self._conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row and row[0] < JOB_QUEUE_SETTINGS["max_attempts"]:
+                delay = JOB_QUEUE_SETTINGS["retry_base_delay_seconds"] * 2 ** (row[0] - 1)
+                self._conn.execute(
+                    "UPDATE jobs SET status = 'pending', available_at = ? WHERE id = ?",
+                    (time.time() + delay, job_id)
+                )
+                return True
+
+            self._conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            return False
+
+    def reset_running(self) -> int:
+        """מחזיר לתור עבודות שנתקעו בעיבוד (או שחיכו לתוצאה) בזמן קריסה/כיבוי"""
+        with self._lock:
+            cursor = self._conn.execute("UPDATE jobs SET status = 'pending' WHERE status IN ('running', 'held')")
+            return cursor.rowcount
+
+    def count(self) -> int:
+        """מחזיר את מספר העבודות בתור (כולל בעיבוד)"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def close(self):
+        """סוגר את החיבור לתור"""
+        with self._lock:
+            self._conn.close()
+
+class JobWorkerPool:
+    """מאגר workers אסינכרוניים שמריצים את עבודות התור.
+
+    handler שמחזיר בתוצאה "pending" (future) עוד לא סיים: העבודה מוחזקת בתור
+    ונמחקת רק כשה-future מצליח; חריגה בו מחזירה אותה לתור כמו כישלון רגיל.
+    """
+
+    def __init__(self, queue: JobQueue, handler: Callable[[Dict], Awaitable[Dict]], workers: int = None,
+                 on_give_up: Optional[Callable[[Dict], Awaitable]] = None):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers or JOB_QUEUE_SETTINGS["workers"]
+        # נקרא כשעבודה נזרקת אחרי max_attempts (למשל הודעת שגיאה לקבוצה)
+        self.on_give_up = on_give_up
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        self._tasks: List[asyncio.Task] = []
+        self._held: Set[asyncio.Task] = set()
+
+    async def _run_io(self, func: Callable, *args):
+        """פעולות SQLite עם fsync - מחוץ ל-event loop"""
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    async def submit(self, group_key: str, payload: Dict) -> int:
+        """מכניס עבודה לתור ומעיר worker פנוי"""
+        job_id = await self._run_io(self.queue.enqueue, group_key, payload)
+        if self._wakeup:
+            self._wakeup.set()
+        return job_id
+
+    def start(self):
+        """מפעיל את ה-workers (בתוך ה-event loop)"""
+        recovered = self.queue.reset_running()
+        if recovered:
+            logger.warning(f"Re-queued {recovered} job(s) interrupted by a previous shutdown")
+
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._wakeup.set()  # עבודות שנשארו בתור מהפעלה קודמת
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"Job queue started with {self.workers} worker(s), {self.queue.count()} job(s) pending")
+
+    async def stop(self, timeout: Optional[float] = None):
+        """מפסיק לקחת עבודות ומחכה שהעבודות בעיבוד יסתיימו (עד timeout).
+
+        ביטול באמצע עבודה עלול לשמור הוצאה ואז להריץ אותה שוב בהפעלה הבאה,
+        ולכן רק מה שלא הסתיים בזמן מבוטל (ויחזור לתור בהפעלה הבאה).
+        """
+        if timeout is None:
+            timeout = JOB_QUEUE_SETTINGS["shutdown_timeout_seconds"]
+
+        self._stopping = True
+        if self._wakeup:
+            self._wakeup.set()
+
+        deadline = time.monotonic() + timeout
+        for tasks in (self._tasks, self._held):
+            if not tasks:
+                continue
+            # עבודות מוחזקות שלא הסתיימו נשארות בתור ויחזרו בהפעלה הבאה
+            _, pending = await asyncio.wait(list(tasks), timeout=max(0, deadline - time.monotonic()))
+            if pending:
+                logger.warning(f"Cancelling {len(pending)} job task(s) still busy after {timeout}s")
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+        self._tasks = []
+
+    async def _fail(self, job_id: int, group_key: str, payload: Dict, error: Exception):
+        retry = await self._run_io(self.queue.fail, job_id)
+        logger.error(f"Job {job_id} for {group_key} failed ({'retrying' if retry else 'dropped'}): {error}")
+        if not retry and self.on_give_up:
+            try:
+                await self.on_give_up(payload)
+            except Exception as notify_error:
+                logger.error(f"Failed to report dropped job {job_id}: {notify_error}")
+
+    async def _settle(self, job_id: int, group_key: str, payload: Dict, pending: Awaitable[Dict]):
+        """מחכה לתוצאה של עבודה מוחזקת ומשלים אותה או מחזיר אותה לתור"""
+        try:
+            result = await asyncio.shield(pending)
+            await self._run_io(self.queue.complete, job_id)
+            logger.info(f"Held job {job_id} for {group_key} done: {result.get('status')}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self._fail(job_id, group_key, payload, e)
+
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def _worker(self, index: int):
+        while not self._stopping:
+            try:
+                job = await self._run_io(self.queue.claim)
+
+                if job is None:
+                    # אין עבודה פנויה - מחכים לעבודה חדשה או לשחרור קבוצה
+                    self._wakeup.clear()
+                    if self._stopping:
+                        break
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), JOB_QUEUE_SETTINGS["poll_interval_seconds"])
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                job_id, group_key, payload = job
+
+                try:
+                    result = await self.handler(payload)
+                    pending = result.pop("pending", None)
+                    if pending is not None:
+                        await self._run_io(self.queue.hold, job_id)
+                        task = asyncio.create_task(self._settle(job_id, group_key, payload, pending))
+                        self._held.add(task)
+                        task.add_done_callback(self._held.discard)
+                        logger.info(f"Job {job_id} for {group_key} held: {result.get('status')}")
+                    else:
+                        await self._run_io(self.queue.complete, job_id)
+                        logger.info(f"Job {job_id} for {group_key} done: {result.get('status')}")
+
+                except Exception as e:
+                    await self._fail(job_id, group_key, payload, e)
+
+                # הקבוצה שוחררה - worker אחר יכול לקחת את ההודעה הבאה שלה
+                self._wakeup.set()
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job worker {index} failed: {e}")
+                await asyncio.sleep(1)
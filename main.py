@@ -2,7 +2,6 @@ import os
 import sys
 import logging
 import asyncio
-import httpx
 from datetime import datetime
 from typing import Dict
 
@@ -14,11 +13,13 @@ if sys.version_info < (3, 8):
 # וולידציה של משתני סביבה קריטיים בטעינה
 CRITICAL_ENV_VARS = [
     "GREENAPI_INSTANCE_ID",
-    "GREENAPI_TOKEN", 
-    "GSHEETS_SPREADSHEET_ID",
-    "GOOGLE_CREDENTIALS_JSON"
+    "GREENAPI_TOKEN"
 ]
 
+# Google Sheets credentials are only required when Sheets is the primary storage
+if os.getenv("STORAGE_BACKEND", "sheets").lower() == "sheets":
+    CRITICAL_ENV_VARS += ["GSHEETS_SPREADSHEET_ID", "GOOGLE_CREDENTIALS_JSON"]
+
 missing_vars = []
 for var in CRITICAL_ENV_VARS:
     if not os.getenv(var):
@@ -42,6 +43,9 @@ from webhook_handler import WebhookHandler
 from bot_messages import BotMessages
 from user_dashboard import UserDashboard
 from admin_panel import AdminPanel
+from budget_manager import BudgetManager
+from green_api_client import GreenAPIClient
+from job_queue import JobQueue, JobWorkerPool
 
 # Configure logging
 logging.basicConfig(
@@ -68,14 +72,26 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize components
+# Initialize components - heavy clients are created once and shared by everyone
 try:
     db = DatabaseManager()
-    ai = AIAnalyzer()
-    webhook_handler = WebhookHandler()
+    ai = AIAnalyzer(category_cache=db.category_cache)
     messages = BotMessages()
+    green_api = GreenAPIClient()
+    webhook_handler = WebhookHandler(db, ai, green_api, messages)
     user_dashboard = UserDashboard(db)
     admin_panel = AdminPanel(db)
+    budget_manager = BudgetManager(db)
+    
+    # Webhooks are persisted to a local queue and processed by background workers
+    job_queue = None
+    job_workers = None
+    if JOB_QUEUE_SETTINGS["enabled"]:
+        job_queue = JobQueue(JOB_QUEUE_SETTINGS["path"])
+        # Receipt images wait in the queue (held) until their album is saved
+        job_workers = JobWorkerPool(job_queue,
+                                    lambda payload: webhook_handler.process_webhook(payload, defer_batches=True),
+                                    on_give_up=webhook_handler.notify_job_failed)
     print("✅ All components initialized successfully")
 except Exception as e:
     print(f"❌ Failed to initialize components: {e}")
@@ -125,8 +141,25 @@ async def webhook_endpoint(request: Request):
             logger.warning("Unauthorized webhook attempt")
             raise HTTPException(status_code=401, detail="Unauthorized")
         
-        # Process webhook
         payload = await request.json()
+        if not isinstance(payload, dict):
+            return JSONResponse({"status": "ignored", "reason": "invalid_payload"})
+        
+        # Retried delivery of a message we already handled
+        if webhook_handler.is_duplicate_delivery(payload):
+            return JSONResponse({"status": "duplicate", "message_id": payload.get("idMessage")})
+        
+        # Queue for background processing and answer Green API immediately
+        if job_workers:
+            chat_id = (payload.get("senderData") or {}).get("chatId", "")
+            if not chat_id:
+                return JSONResponse({"status": "ignored", "reason": "no_chat_id"})
+            
+            job_id = await job_workers.submit(chat_id, payload)
+            logger.info(f"Webhook queued as job {job_id}")
+            return JSONResponse({"status": "queued", "job_id": job_id})
+        
+        # Process webhook
         result = await webhook_handler.process_webhook(payload)
         
         logger.info(f"Webhook processed: {result.get('status')}")
@@ -371,33 +404,22 @@ async def create_whatsapp_group(phone1: str, phone2: str, wedding_date: str = No
         ]
         
         # יצירת קבוצה עם Green API
-        url = f"https://api.green-api.com/waInstance{GREENAPI_INSTANCE_ID}/createGroup/{GREENAPI_TOKEN}"
-        
-        payload = {
-            "groupName": group_name,
-            "chatIds": participants
-        }
+        result = await green_api.create_group(group_name, participants)
         
-        async with httpx.AsyncClient(timeout=30) as client:
-            response = await client.post(url, json=payload)
-            response.raise_for_status()
+        if result.get("created"):
+            group_id = result.get("chatId")
+            logger.info(f"WhatsApp group created: {group_id}")
             
-            result = response.json()
+            return {
+                "success": True,
+                "group_id": group_id,
+                "group_name": group_name
+            }
+        else:
+            error_msg = result.get("message", "יצירת קבוצה נכשלה")
+            logger.error(f"Group creation failed: {error_msg}")
+            return {"success": False, "error": error_msg}
             
-            if result.get("created"):
-                group_id = result.get("chatId")
-                logger.info(f"WhatsApp group created: {group_id}")
-                
-                return {
-                    "success": True,
-                    "group_id": group_id,
-                    "group_name": group_name
-                }
-            else:
-                error_msg = result.get("message", "יצירת קבוצה נכשלה")
-                logger.error(f"Group creation failed: {error_msg}")
-                return {"success": False, "error": error_msg}
-                
     except Exception as e:
         logger.error(f"WhatsApp group creation failed: {e}")
         return {"success": False, "error": f"שגיאה ביצירת קבוצה: {str(e)}"}
@@ -405,15 +427,8 @@ async def create_whatsapp_group(phone1: str, phone2: str, wedding_date: str = No
 async def save_couple_to_sheet(couple_data: Dict) -> bool:
     """שומר זוג חדש בגיליון couples"""
     try:
-        from config import COUPLES_HEADERS
-        
-        # יצירת שורה לפי סדר הכותרות
-        row_values = []
-        for header in COUPLES_HEADERS:
-            value = couple_data.get(header, '')
-            row_values.append(str(value) if value is not None else '')
-        
-        return db._append_sheet_row("couples!A:G", row_values)
+        # הזוג נכנס מיד ל-cache הקבוצות דרך מאזין השינויים של db
+        return await db.add_couple_async(couple_data)
         
     except Exception as e:
         logger.error(f"Failed to save couple to sheet: {e}")
@@ -424,20 +439,11 @@ async def send_welcome_message(group_id: str) -> bool:
     try:
         welcome_msg = messages.welcome_message_step1()
         
-        url = f"https://api.green-api.com/waInstance{GREENAPI_INSTANCE_ID}/sendMessage/{GREENAPI_TOKEN}"
+        await green_api.send_message(group_id, welcome_msg)
         
-        payload = {
-            "chatId": group_id,
-            "message": welcome_msg
-        }
+        logger.info(f"Welcome message sent to group: {group_id}")
+        return True
         
-        async with httpx.AsyncClient(timeout=30) as client:
-            response = await client.post(url, json=payload)
-            response.raise_for_status()
-            
-            logger.info(f"Welcome message sent to group: {group_id}")
-            return True
-            
     except Exception as e:
         logger.error(f"Failed to send welcome message: {e}")
         return False
@@ -447,7 +453,7 @@ async def admin_send_summary(group_id: str):
     """Admin API - Send weekly summary to specific group"""
     try:
         # Get group info
-        couple = db.get_couple_by_group_id(group_id)
+        couple = await db.get_couple_by_group_id_async(group_id)
         if not couple:
             return JSONResponse({"success": False, "error": "Group not found"})
         
@@ -470,11 +476,11 @@ async def user_dashboard_page(group_id: str):
     """User dashboard for specific group"""
     try:
         # Verify group exists and is active
-        couple = db.get_couple_by_group_id(group_id)
+        couple = await db.get_couple_by_group_id_async(group_id)
         if not couple or couple.get('status') != 'active':
             raise HTTPException(status_code=404, detail="Group not found")
         
-        return await user_dashboard.get_dashboard_html(group_id)
+        return await user_dashboard.get_dashboard_html(group_id, couple)
         
     except HTTPException:
         raise
@@ -486,11 +492,11 @@ async def user_dashboard_page(group_id: str):
 async def user_dashboard_data(group_id: str):
     """User dashboard API - Get dashboard data"""
     try:
-        couple = db.get_couple_by_group_id(group_id)
+        couple = await db.get_couple_by_group_id_async(group_id)
         if not couple:
             raise HTTPException(status_code=404, detail="Group not found")
         
-        return await user_dashboard.get_dashboard_data(group_id)
+        return await user_dashboard.get_dashboard_data(group_id, couple)
         
     except HTTPException:
         raise
@@ -511,11 +517,11 @@ async def health_check():
     
     try:
         # Database health
-        db_health = db.health_check()
+        db_health = await db.health_check_async()
         checks["components"]["database"] = db_health
         
         # AI health  
-        ai_health = ai.health_check()
+        ai_health = await ai.health_check_async()
         checks["components"]["ai"] = ai_health
         
         # Configuration check
@@ -566,19 +572,48 @@ async def weekly_summary_task():
             logger.error(f"Weekly summary task failed: {e}")
             await asyncio.sleep(3600)  # Continue despite errors
 
-async def cleanup_task():
-    """Background cleanup task"""
+async def write_behind_flush_task():
+    """Background task that pushes journaled writes to Google Sheets"""
     while True:
         try:
-            # Clean up old data, refresh caches, etc.
-            await webhook_handler._refresh_groups_cache()
+            await db.flush_pending_writes_async()
+            await asyncio.sleep(WRITE_BEHIND_SETTINGS["flush_interval_seconds"])
             
-            # Sleep for 5 minutes
-            await asyncio.sleep(300)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Write-behind flush task failed: {e}")
+            await asyncio.sleep(WRITE_BEHIND_SETTINGS["flush_interval_seconds"])
+
+async def sheets_export_task():
+    """Background task that mirrors the SQLite tables to Google Sheets"""
+    while True:
+        try:
+            await asyncio.sleep(STORAGE_SETTINGS["sheets_export_interval_seconds"])
+            await db.export_to_sheets_async()
             
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            logger.error(f"Cleanup task failed: {e}")
-            await asyncio.sleep(300)
+            logger.error(f"Sheets export task failed: {e}")
+
+async def load_known_vendors():
+    """Teach the local vendor classifier the vendors learned in storage"""
+    vendors = await db.get_learned_vendors_async(VENDOR_INDEX_SETTINGS["classifier_min_confidence"])
+    ai.vendor_classifier.add_known_vendors(vendors)
+
+async def vendor_compaction_task():
+    """Background task that merges duplicate rows in the vendors table"""
+    while True:
+        try:
+            await asyncio.sleep(VENDOR_INDEX_SETTINGS["compaction_interval_seconds"])
+            await db.compact_vendors_async()
+            await load_known_vendors()
+            
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Vendor compaction task failed: {e}")
 
 # === STARTUP EVENTS ===
 
@@ -599,16 +634,40 @@ async def startup_event():
             print(f"❌ Missing services: {', '.join(missing_services)}")
             raise SystemExit("Critical configuration missing")
         
+        # Open the pooled Green API connections
+        await green_api.start()
+        
         # Test database connection
-        db_health = db.health_check()
+        db_health = await db.health_check_async()
         logger.info(f"Database health: {db_health}")
         
-        if not db_health.get("sheets_connection", False):
-            logger.error("Cannot connect to Google Sheets")
-            raise SystemExit("Google Sheets connection failed")
+        if not db_health.get("storage_connection", False):
+            logger.error(f"Cannot connect to {db.backend.name} storage")
+            raise SystemExit("Storage connection failed")
+        
+        # Replay writes journaled before a crash/restart, then keep flushing
+        if db.journal:
+            replayed = await db.flush_pending_writes_async()
+            logger.info(f"Write journal replayed: {replayed} pending write(s)")
+            asyncio.create_task(write_behind_flush_task())
+        
+        # SQLite is the source of truth - keep a Sheets mirror for humans
+        if db.exporter:
+            asyncio.create_task(sheets_export_task())
+        
+        # Learned vendors resolve locally instead of through OpenAI
+        await load_known_vendors()
+        
+        # Keep the vendors table at one row per vendor (one designated instance only)
+        if VENDOR_INDEX_SETTINGS["compaction_enabled"]:
+            asyncio.create_task(vendor_compaction_task())
+        
+        # Start webhook workers (jobs left over from a crash are re-queued first)
+        if job_workers:
+            job_workers.start()
         
         # Test AI connection (warning only)
-        ai_health = ai.health_check()
+        ai_health = await ai.health_check_async()
         logger.info(f"AI health: {ai_health}")
         
         if not ai_health.get("openai_configured", False):
@@ -617,7 +676,6 @@ async def startup_event():
         # Start background tasks only if not in debug
         if not DEBUG:
             asyncio.create_task(weekly_summary_task())
-            asyncio.create_task(cleanup_task())
             logger.info("Background tasks started")
         
         print("✅ Wedding Expenses Bot started successfully!")
@@ -634,6 +692,15 @@ async def startup_event():
 async def shutdown_event():
     """Application shutdown"""
     logger.info("Shutting down Wedding Expenses Bot...")
+    # Receipt albums still waiting for their window are processed first, so their held jobs can finish
+    await webhook_handler.flush_receipt_batches()
+    if job_workers:
+        # In-flight jobs finish (up to a timeout) instead of being replayed after restart
+        await job_workers.stop()
+        job_queue.close()
+    webhook_handler.deduplicator.close()
+    await green_api.close()
+    db.close()
 
 # === ERROR HANDLERS ===
 
@@ -663,9 +730,10 @@ if DEBUG:
         return {
             "green_api_configured": bool(GREENAPI_INSTANCE_ID and GREENAPI_TOKEN),
             "openai_configured": bool(OPENAI_API_KEY),
+            "storage_backend": STORAGE_SETTINGS["backend"],
             "sheets_configured": bool(GSHEETS_SPREADSHEET_ID),
             "webhook_secret_configured": bool(WEBHOOK_SHARED_SECRET),
-            "allowed_phones_count": len(ALLOWED_PHONES),
+            "allowed_phones_count": len(webhook_handler.phone_index),
             "categories": list(WEDDING_CATEGORIES.keys()),
             "debug_mode": DEBUG
         }
@@ -679,7 +747,7 @@ if DEBUG:
     @app.get("/debug/test-ai")
     async def debug_test_ai():
         """Test AI connection (dev only)"""
-        return ai.health_check()
+        return await ai.health_check_async()
 
 # === RUN APPLICATION ===
 
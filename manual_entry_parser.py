@@ -0,0 +1,234 @@
+import re
+import logging
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+from config import CATEGORY_LIST
+from vendor_classifier import VENDOR_KEYWORDS
+
+logger = logging.getLogger(__name__)
+
+# טוקן אחד לכל מילה/מספר, במעבר יחיד על ההודעה. מספר כולל מטבע צמוד
+# (לפניו או אחריו), ומילה כוללת גרש/גרשיים ("דיג׳יי", "ש"ח")
+_TOKEN = re.compile(r'''
+    (?P<pre>₪\s*)?
+    (?P<num>\d+(?:,\d{3})*(?:\.\d+)?)
+    (?:\s*(?P<cur>ש"ח|ש״ח|שח|₪|שקלים|שקל)(?![א-ת]))?
+  | (?P<word>[א-תa-zA-Z][א-תa-zA-Z׳״'"\-]*)
+''', re.VERBOSE)
+
+# פעלים שאחריהם בא הסכום ("שילמתי 2000")
+AMOUNT_VERBS = frozenset(['שילמתי', 'שילמנו', 'עלה', 'עולה', 'היה', 'עלות'])
+
+# מילות יחס שאחריהן בא הספק - כמילה נפרדת ("עבור הצלם") או כתחילית ("לצלם")
+VENDOR_PREPOSITIONS = frozenset(['עבור', 'בשביל', 'אצל', 'של', 'ל', 'ב', 'מ'])
+VENDOR_PREFIXES = 'לבמ'
+AMOUNT_FOLLOWERS = frozenset(['עבור', 'בשביל'])  # "2000 עבור..." כמו "2000 ל..."
+
+PAYMENT_TYPE_KEYWORDS = {
+    'מקדמה': 'advance',
+    'מקדמות': 'advance',
+    'קדימה': 'advance',
+    'ראשון': 'advance',
+    'ראשונה': 'advance',
+    'סופי': 'final',
+    'סופית': 'final',
+    'אחרון': 'final',
+    'אחרונה': 'final',
+    'יתרה': 'final'
+}
+
+# סדר המילון הוא סדר העדיפות כשיש כמה מילות מפתח
+CATEGORY_KEYWORDS = {
+    'צלם': 'צילום',
+    'צילום': 'צילום',
+    'אולם': 'אולם',
+    'גן': 'אולם',
+    'דיג׳יי': 'מוזיקה',
+    'dj': 'מוזיקה',
+    'להקה': 'מוזיקה',
+    'זמר': 'מוזיקה',
+    'קייטרינג': 'מזון',
+    'אוכל': 'מזון',
+    'עוגה': 'מזון',
+    'פרחים': 'עיצוב',
+    'עיצוב': 'עיצוב',
+    'שמלה': 'לבוש',
+    'חליפה': 'לבוש',
+    'הזמנות': 'הדפסות'
+}
+_CATEGORY_RANK = {keyword: i for i, keyword in enumerate(CATEGORY_KEYWORDS)}
+_CATEGORIES = list(CATEGORY_KEYWORDS.values())
+
+# מילים שאינן שם ספק
+STOP_WORDS = frozenset([
+    'שילמתי', 'שילמנו', 'עלה', 'עולה', 'עלתה', 'עלו', 'היה', 'עלות', 'קניתי', 'קנינו',
+    'הזמנתי', 'הזמנו', 'ש"ח', 'ש״ח', 'שח', 'שקל', 'שקלים', 'על', 'את', 'לנו', 'לי',
+    'עם', 'גם', 'רק', 'עוד', 'היום', 'אתמול', 'בערך', 'סך', 'הכל', 'סה"כ', 'תשלום', 'עבור',
+    'בשביל', 'אצל', 'של', 'ל', 'ב', 'מ', 'ו', 'ה'
+]) | frozenset(PAYMENT_TYPE_KEYWORDS)
+
+MAX_VENDOR_WORDS = 3
+
+# ל/ב/מ בתחילת מילה היא אות יחס רק כשמה שנשאר הוא מילה מוכרת ("לצלם", "בחנות").
+# אחרת היא חלק מהשם ("ביטוח", "מאפיית", "ברוך", "מאקס") והמילה נשארת שלמה
+PREFIXED_NOUNS = (
+    frozenset(CATEGORY_KEYWORDS)
+    | frozenset(category.lower() for category in CATEGORY_LIST)
+    | frozenset(term.split()[0].lower() for terms in VENDOR_KEYWORDS.values() for term in terms)
+    | frozenset(['חנות', 'חברת', 'משרד', 'סלון', 'מאפיית', 'מסעדת'])
+)
+
+def _strip_prefix(word: str) -> Optional[str]:
+    """מסיר אות יחס אחת מתחילת המילה ("לצלם" -> "צלם"), רק אם נשארת מילה מוכרת"""
+    if len(word) > 2 and word[0] in VENDOR_PREFIXES and word[1:].lower() in PREFIXED_NOUNS:
+        return word[1:]
+    return None
+
+def _keyword_forms() -> Dict[str, Tuple[Optional[str], Optional[int]]]:
+    """מילון אחד לכל צורות מילות המפתח: המילה עצמה ועם ה/ו/כ/ל/ב/מ/ש לפניה ->
+    (סוג תשלום, דירוג קטגוריה). כך כל מילה בהודעה היא חיפוש יחיד"""
+    forms = {}
+    for keyword in set(PAYMENT_TYPE_KEYWORDS) | set(CATEGORY_KEYWORDS):
+        entry = (PAYMENT_TYPE_KEYWORDS.get(keyword), _CATEGORY_RANK.get(keyword))
+        for form in [keyword] + [prefix + keyword for prefix in 'הוכלבמש']:
+            ptype, rank = forms.get(form, (None, None))
+            # מילה שהיא גם מילת מפתח וגם תחילית + מילת מפתח - מקדמה והדירוג הגבוה גוברים
+            if entry[0] and ptype != 'advance':
+                ptype = entry[0]
+            if entry[1] is not None and (rank is None or entry[1] < rank):
+                rank = entry[1]
+            forms[form] = (ptype, rank)
+    return forms
+
+_KEYWORD_FORMS = _keyword_forms()
+
+def tokenize(text: str) -> List[Tuple[str, str, bool]]:
+    """מפרק הודעה לטוקנים: ('num', ערך, יש_מטבע) / ('word', מילה, False)"""
+    # findall מחזיר את הקבוצות כ-tuple בלי קריאות group() לכל התאמה
+    return [
+        ('num', num, bool(pre or cur)) if num else ('word', word.strip('\'"-'), False)
+        for pre, num, cur, word in _TOKEN.findall(text)
+    ]
+
+def _parse_amount(value: str) -> Optional[float]:
+    try:
+        amount = float(value.replace(',', ''))
+    except ValueError:
+        return None
+    return amount if amount > 0 else None
+
+def _find_amount(tokens: List[Tuple[str, str, bool]]) -> Optional[float]:
+    """סכום לפי עדיפות: עם מטבע > אחרי פועל תשלום > לפני "ל..." > מספר של 4+ ספרות"""
+    best_priority = None
+    best_amount = None
+
+    for i, (kind, value, has_currency) in enumerate(tokens):
+        if kind != 'num':
+            continue
+
+        amount = _parse_amount(value)
+        if amount is None:
+            continue
+
+        previous = tokens[i - 1][1] if i > 0 and tokens[i - 1][0] == 'word' else ''
+        following = tokens[i + 1][1] if i + 1 < len(tokens) and tokens[i + 1][0] == 'word' else ''
+
+        if has_currency:
+            priority = 0
+        elif previous in AMOUNT_VERBS:
+            priority = 1
+        elif following and (following[0] == 'ל' or following in AMOUNT_FOLLOWERS):
+            priority = 2
+        elif len(value.replace(',', '').split('.')[0]) >= 4:
+            priority = 3
+        else:
+            continue
+
+        if priority == 0:
+            return amount
+        if best_priority is None or priority < best_priority:
+            best_priority, best_amount = priority, amount
+
+    return best_amount
+
+def _find_vendor(tokens: List[Tuple[str, str, bool]]) -> Optional[str]:
+    """ספק: המילים אחרי מילת יחס (או תחילית ל/ב/מ), אחרת מילת מפתח, אחרת המילה הראשונה"""
+    words = [(i, value) for i, (kind, value, _) in enumerate(tokens) if kind == 'word']
+
+    def phrase_from(index: int, first_word: str) -> str:
+        # ממשיכים עם מילים צמודות עד מספר / מילת עצירה
+        parts = [first_word]
+        for kind, value, _ in tokens[index + 1:]:
+            if kind != 'word' or value in STOP_WORDS or len(parts) >= MAX_VENDOR_WORDS:
+                break
+            parts.append(value)
+        return ' '.join(parts)
+
+    for i, word in words:
+        if word in VENDOR_PREPOSITIONS:
+            # "עבור הצלם" - הספק הוא המילה הבאה
+            if i + 1 < len(tokens) and tokens[i + 1][0] == 'word' and tokens[i + 1][1] not in STOP_WORDS:
+                return phrase_from(i + 1, tokens[i + 1][1])
+            continue
+
+        if word in STOP_WORDS:
+            continue
+
+        stripped = _strip_prefix(word)
+        if stripped and stripped not in STOP_WORDS:
+            return phrase_from(i, stripped)
+
+    # בלי מילת יחס - מילת מפתח של ספק, ואם אין - המילה הראשונה שאינה מילת עצירה
+    for i, word in words:
+        if word.lower() in CATEGORY_KEYWORDS:
+            return phrase_from(i, word)
+
+    for i, word in words:
+        if word not in STOP_WORDS and len(word) >= 2:
+            return phrase_from(i, word)
+
+    return None
+
+def parse_manual_entry(message: str) -> Optional[Dict]:
+    """מנתח הודעה להכנסה ידנית ("שילמתי 2000 לצלם") - None אם אין סכום וספק"""
+    if not message:
+        return None
+
+    tokens = tokenize(message.strip())
+
+    amount = _find_amount(tokens)
+    if not amount:
+        return None
+
+    vendor = _find_vendor(tokens)
+    if not vendor:
+        return None
+
+    payment_type = 'full'
+    category = 'אחר'
+    category_rank = len(_CATEGORY_RANK)
+
+    for kind, value, _ in tokens:
+        if kind != 'word':
+            continue
+        forms = _KEYWORD_FORMS.get(value.lower())
+        if not forms:
+            continue
+        ptype, rank = forms
+        # מקדמה גוברת על סופי - כמו בסדר הבדיקה הקודם
+        if ptype and (payment_type == 'full' or ptype == 'advance'):
+            payment_type = ptype
+        if rank is not None and rank < category_rank:
+            category_rank, category = rank, _CATEGORIES[rank]
+
+    return {
+        'vendor': vendor,
+        'amount': amount,
+        'category': category,
+        'date': date.today().isoformat(),
+        'payment_type': payment_type,
+        'payment_method': None,
+        'confidence': 70,
+        'needs_review': False,
+        'source': 'manual_text'
+    }
@@ -0,0 +1,108 @@
+import time
+import sqlite3
+import logging
+from collections import OrderedDict
+from typing import Optional, Set
+from config import DEDUP_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+class MessageDeduplicator:
+    """זוכר מזהי הודעות (idMessage) שכבר טופלו, לזמן מוגבל ובכמות מוגבלת.
+
+    Green API שולח שוב webhook שלא אושר בזמן - בלי זה אותה קבלה נותחה
+    ונשמרה פעמיים. מזהה מסומן רק אחרי שההודעה טופלה בהצלחה, כך שניסיון
+    שנכשל יכול לרוץ שוב; עם path המזהים נשמרים גם ב-SQLite (קובץ תור
+    העבודות) ושורדים הפעלה מחדש. רץ בתוך ה-event loop בלבד, ולכן אין צורך בנעילה.
+    """
+
+    def __init__(self, ttl_seconds: int = None, max_entries: int = None, path: Optional[str] = None):
+        self.ttl_seconds = ttl_seconds or DEDUP_SETTINGS["ttl_seconds"]
+        self.max_entries = max_entries or DEDUP_SETTINGS["max_entries"]
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+        self._in_flight: Set[str] = set()
+
+        path = DEDUP_SETTINGS["path"] if path is None else path
+        self._conn = None
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS processed_messages (message_id TEXT PRIMARY KEY, processed_at REAL NOT NULL)"
+            )
+
+    def _purge(self, now: float):
+        """מסיר רשומות שפג תוקפן ושומר על הגבול העליון (הוותיקות ראשונות)"""
+        while self._seen:
+            message_id, seen_at = next(iter(self._seen.items()))
+            if now - seen_at <= self.ttl_seconds and len(self._seen) <= self.max_entries:
+                break
+            self._seen.popitem(last=False)
+
+    def _is_processed(self, message_id: str) -> bool:
+        now = time.time()
+        self._purge(now)
+
+        if message_id in self._seen:
+            return True
+
+        if self._conn:
+            row = self._conn.execute(
+                "SELECT processed_at FROM processed_messages WHERE message_id = ?", (message_id,)
+            ).fetchone()
+            if row and now - row[0] <= self.ttl_seconds:
+                self._seen[message_id] = row[0]
+                return True
+
+        return False
+
+    def is_duplicate(self, message_id: Optional[str]) -> bool:
+        """בודק בלי לסמן - הודעה בלי מזהה לעולם לא נחשבת כפולה"""
+        if not message_id:
+            return False
+        return self._is_processed(message_id)
+
+    def begin(self, message_id: Optional[str]) -> bool:
+        """מחזיר False אם ההודעה כבר טופלה או בעיבוד כרגע, אחרת מסמן אותה כבעיבוד"""
+        if not message_id:
+            return True
+
+        if message_id in self._in_flight or self._is_processed(message_id):
+            logger.info(f"Duplicate delivery of message {message_id} ignored")
+            return False
+
+        self._in_flight.add(message_id)
+        return True
+
+    def complete(self, message_id: Optional[str]):
+        """מסמן שההודעה טופלה - משלוח חוזר שלה ייחשב כפול"""
+        if not message_id:
+            return
+
+        now = time.time()
+        self._in_flight.discard(message_id)
+        self._seen[message_id] = now
+        if len(self._seen) > self.max_entries:
+            self._seen.popitem(last=False)
+
+        if self._conn:
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO processed_messages (message_id, processed_at) VALUES (?, ?)",
+                    (message_id, now)
+                )
+                self._conn.execute(
+                    "DELETE FROM processed_messages WHERE processed_at < ?", (now - self.ttl_seconds,)
+                )
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to persist processed message {message_id}: {e}")
+
+    def release(self, message_id: Optional[str]):
+        """הטיפול נכשל - משלוח חוזר / ניסיון חוזר יעובד שוב"""
+        if message_id:
+            self._in_flight.discard(message_id)
+
+    def close(self):
+        if self._conn:
+            self._conn.close()
+            self._conn = None
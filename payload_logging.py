@@ -0,0 +1,60 @@
+import re
+import json
+import random
+import logging
+from typing import Any
+from urllib.parse import urlsplit
+from config import LOGGING_CONFIG
+
+# מספרי טלפון (גם בתוך chatId כמו 972501234567@c.us) - משאירים 3 ספרות אחרונות
+PHONE_PATTERN = re.compile(r'\+?\d{4,}(\d{3})')
+
+SECRET_KEYS = ("token", "secret", "password", "apikey", "api_key", "authorization")
+NAME_KEYS = ("senderName", "senderContactName", "chatName")
+URL_KEYS = ("downloadUrl", "url")
+LONG_STRING = 200  # מחרוזות ארוכות (כמו jpegThumbnail ב-base64) מוחלפות באורך בלבד
+
+def redact(value: Any, key: str = "") -> Any:
+    """מחזיר עותק של ה-payload בלי טלפונים, טוקנים, שמות ותוכן בינארי"""
+    if isinstance(value, dict):
+        return {k: redact(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact(item, key) for item in value]
+    if not isinstance(value, str):
+        return value
+
+    key_lower = key.lower()
+    if any(secret in key_lower for secret in SECRET_KEYS):
+        return "[REDACTED]"
+    if key in NAME_KEYS:
+        return "[NAME]"
+    if key in URL_KEYS:
+        # ב-URL של Green API הטוקן חלק מהנתיב - משאירים רק את השרת
+        parts = urlsplit(value)
+        return f"{parts.scheme}://{parts.netloc}/..." if parts.netloc else "[URL]"
+    if len(value) > LONG_STRING:
+        return f"<{len(value)} chars>"
+
+    return PHONE_PATTERN.sub(lambda m: "*" * (len(m.group(0)) - 3) + m.group(1), value)
+
+class LazyPayload:
+    """עוטף payload כך שהצנזור והסריאליזציה קורים רק אם הרשומה באמת נכתבת"""
+
+    __slots__ = ("payload",)
+
+    def __init__(self, payload: Any):
+        self.payload = payload
+
+    def __str__(self) -> str:
+        rendered = json.dumps(redact(self.payload), ensure_ascii=False, separators=(",", ":"))
+        max_chars = LOGGING_CONFIG["payload_max_chars"]
+        return rendered if len(rendered) <= max_chars else rendered[:max_chars] + "...(truncated)"
+
+def log_payload(logger: logging.Logger, payload: Any, message: str = "Webhook payload"):
+    """רושם payload מצונזר ברמת DEBUG, לפי אחוז הדגימה ב-LOGGING_CONFIG"""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if random.random() >= LOGGING_CONFIG["payload_sample_rate"]:
+        return
+
+    logger.debug("%s: %s", message, LazyPayload(payload))
@@ -0,0 +1,91 @@
+import re
+import logging
+import threading
+from typing import FrozenSet, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COUNTRY_CODE = "972"  # ישראל
+
+_NON_DIGITS = re.compile(r'\D')
+
+def normalize_phone(raw: str, default_country_code: str = DEFAULT_COUNTRY_CODE) -> Optional[str]:
+    """ממיר מספר טלפון לפורמט E.164 (+972501234567).
+
+    מקבל את כל הצורות שמגיעות מהגיליון, מההגדרות ומ-WhatsApp:
+    "050-123-4567", "+972 50 1234567", "00972501234567", "972501234567@c.us".
+    מחזיר None לערך שאינו נראה כמו מספר טלפון.
+    """
+    if not raw:
+        return None
+
+    value = str(raw).split('@')[0].strip()
+    has_plus = value.startswith('+')
+    digits = _NON_DIGITS.sub('', value)
+
+    if not digits:
+        return None
+
+    if not has_plus:
+        if digits.startswith('00'):
+            # קידומת בינלאומית
+            digits = digits[2:]
+        elif digits.startswith('0'):
+            # מספר מקומי - מחליפים את ה-0 בקידומת המדינה
+            digits = default_country_code + digits[1:]
+        elif len(digits) <= 9:
+            # מספר מקומי שנכתב בלי ה-0 המוביל (למשל מגיליון שהפך אותו למספר)
+            digits = default_country_code + digits
+
+    # E.164: עד 15 ספרות; פחות מ-8 זה לא מספר טלפון אמיתי
+    if not 8 <= len(digits) <= 15:
+        return None
+
+    return f"+{digits}"
+
+class PhoneIndex:
+    """אינדקס טלפונים מורשים לבדיקה ב-O(1).
+
+    המספרים מנורמלים פעם אחת כשהאינדקס נבנה; כל בדיקה מנרמלת רק את השולח.
+    רשימה קבועה (מ-ALLOWED_PHONES) + רשימה דינמית (טלפוני הזוגות) שמוחלפת
+    בשלמותה כשטבלת הזוגות משתנה.
+    """
+
+    def __init__(self, static_phones: Iterable[str] = ()):
+        self._static: FrozenSet[str] = self._normalize_all(static_phones)
+        self._dynamic: FrozenSet[str] = frozenset()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize_all(phones: Iterable[str]) -> FrozenSet[str]:
+        normalized = set()
+        for phone in phones:
+            canonical = normalize_phone(phone)
+            if canonical:
+                normalized.add(canonical)
+            elif phone:
+                logger.warning(f"Ignoring invalid phone number in allow-list: {phone!r}")
+        return frozenset(normalized)
+
+    @property
+    def has_static(self) -> bool:
+        """האם הוגדרה רשימת טלפונים מורשים קבועה"""
+        return bool(self._static)
+
+    def set_dynamic(self, phones: Iterable[str]):
+        """מחליף את רשימת הטלפונים הדינמית (טלפוני הזוגות)"""
+        with self._lock:
+            self._dynamic = self._normalize_all(phones)
+
+    def add_dynamic(self, phones: Iterable[str]):
+        """מוסיף טלפונים לרשימה הדינמית (זוג חדש)"""
+        with self._lock:
+            self._dynamic = self._dynamic | self._normalize_all(phones)
+
+    def contains(self, raw_phone: str) -> bool:
+        """בודק אם מספר (בכל פורמט) נמצא באינדקס"""
+        canonical = normalize_phone(raw_phone)
+        return canonical is not None and (canonical in self._static or canonical in self._dynamic)
+
+    def __len__(self) -> int:
+        return len(self._static | self._dynamic)
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+from config import RECEIPT_BATCH_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+class ReceiptBatcher:
+    """אוסף תמונות קבלה שמגיעות ברצף מאותה קבוצה לאלבום אחד.
+
+    כל תמונה מאריכה את החלון של הקבוצה ב-window_seconds (עד max_wait_seconds
+    מהתמונה הראשונה, או מיד כשמגיעים ל-max_batch_size). כשהחלון נסגר נקרא
+    on_ready(group_id), ומי שמטפל מוציא את התמונות עם take().
+    """
+
+    def __init__(self, on_ready: Callable[[str], Awaitable], window_seconds: Optional[float] = None,
+                 max_wait_seconds: Optional[float] = None, max_batch_size: Optional[int] = None):
+        self.on_ready = on_ready
+        self.window_seconds = window_seconds if window_seconds is not None else RECEIPT_BATCH_SETTINGS["window_seconds"]
+        self.max_wait_seconds = max_wait_seconds if max_wait_seconds is not None else RECEIPT_BATCH_SETTINGS["max_wait_seconds"]
+        self.max_batch_size = max_batch_size or RECEIPT_BATCH_SETTINGS["max_batch_size"]
+
+        self._items: Dict[str, List[Dict]] = {}
+        self._started: Dict[str, float] = {}
+        self._timers: Dict[str, asyncio.Task] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def add(self, group_id: str, item: Dict) -> int:
+        """מוסיף תמונה לאלבום של הקבוצה ומחזיר כמה תמונות יש בו"""
+        loop = asyncio.get_running_loop()
+
+        items = self._items.setdefault(group_id, [])
+        if not items:
+            self._started[group_id] = loop.time()
+        items.append(item)
+
+        if len(items) >= self.max_batch_size:
+            delay = 0
+        else:
+            deadline = self._started[group_id] + self.max_wait_seconds
+            delay = max(0, min(self.window_seconds, deadline - loop.time()))
+
+        self._schedule(group_id, delay)
+        return len(items)
+
+    def take(self, group_id: str) -> List[Dict]:
+        """מוציא את התמונות שממתינות לקבוצה (ומבטל את הטיימר שלה)"""
+        timer = self._timers.pop(group_id, None)
+        if timer:
+            timer.cancel()
+        self._started.pop(group_id, None)
+        return self._items.pop(group_id, [])
+
+    def pending(self, group_id: str) -> int:
+        """כמה תמונות ממתינות לקבוצה"""
+        return len(self._items.get(group_id, ()))
+
+    async def close(self):
+        """סוגר מיד את כל האלבומים הפתוחים (בכיבוי) ומחכה לסיום העיבוד"""
+        for group_id in list(self._items):
+            self._schedule(group_id, 0)
+
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _schedule(self, group_id: str, delay: float):
+        timer = self._timers.pop(group_id, None)
+        if timer:
+            timer.cancel()
+
+        task = asyncio.create_task(self._fire(group_id, delay))
+        self._timers[group_id] = task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _fire(self, group_id: str, delay: float):
+        await asyncio.sleep(delay)
+
+        # מכאן הטיימר כבר לא ניתן לביטול - תמונה חדשה תפתח אלבום חדש
+        if self._timers.get(group_id) is asyncio.current_task():
+            del self._timers[group_id]
+
+        try:
+            await self.on_ready(group_id)
+        except Exception as e:
+            logger.error(f"Receipt batch for {group_id} failed: {e}")
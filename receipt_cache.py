@@ -0,0 +1,219 @@
+import io
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+from config import RECEIPT_CACHE_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+try:
+    from PIL import Image
+except ImportError:  # hash תפיסתי הוא אופציונלי
+    Image = None
+
+# (sha256, dHash) - מזהה תמונה לחיפוש במטמון
+Fingerprint = Tuple[str, Optional[int]]
+
+def perceptual_hash(image_bytes: bytes, hash_size: int = 8) -> Optional[int]:
+    """מחשב dHash של 64 ביט - יציב מול דחיסה מחדש והקטנה של תמונות מועברות"""
+    if Image is None:
+        return None
+
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            image.draft('L', (hash_size * 16, hash_size * 16))  # פענוח JPEG מוקטן - מהיר בהרבה
+            pixels = list(image.convert('L').resize((hash_size + 1, hash_size)).getdata())
+
+        value = 0
+        for row in range(hash_size):
+            for col in range(hash_size):
+                left = pixels[row * (hash_size + 1) + col]
+                right = pixels[row * (hash_size + 1) + col + 1]
+                value = (value << 1) | (left > right)
+        return value
+
+    except Exception as e:
+        logger.debug(f"Perceptual hash failed: {e}")
+        return None
+
+class ReceiptAnalysisCache:
+    """מטמון לתוצאות ניתוח קבלות לפי תוכן התמונה.
+
+    מפתח ראשי הוא sha256 של הבייטים - רק התאמה מדויקת משמשת לשימוש חוזר
+    בניתוח ולזיהוי כפילויות. dHash קרוב (העברה שנדחסה מחדש, אבל גם קבלה
+    אחרת באותה תבנית) רק נרשם כאזהרה, אלא אם phash_match_enabled.
+    שכבת זיכרון עם LRU ו-TTL, ושכבת SQLite אופציונלית ששורדת הפעלה מחדש.
+    לכל רשומה נשמר גם איזו הוצאה נוצרה ממנה בכל קבוצה, כדי לזהות כפילויות.
+    """
+
+    def __init__(self, max_entries: int = None, ttl_seconds: int = None, disk_path: str = None):
+        self.max_entries = max_entries or RECEIPT_CACHE_SETTINGS["max_entries"]
+        self.ttl_seconds = ttl_seconds or RECEIPT_CACHE_SETTINGS["ttl_seconds"]
+        self.max_distance = RECEIPT_CACHE_SETTINGS["phash_max_distance"]
+        self.phash_match_enabled = RECEIPT_CACHE_SETTINGS["phash_match_enabled"]
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+
+        self._disk = None
+        disk_path = disk_path if disk_path is not None else RECEIPT_CACHE_SETTINGS["disk_path"]
+        if disk_path:
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False, isolation_level=None)
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute("""
+                CREATE TABLE IF NOT EXISTS receipt_cache (
+                    sha256 TEXT PRIMARY KEY,
+                    phash TEXT,
+                    analysis TEXT NOT NULL,
+                    expense_ids TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            self._disk.execute(
+                "DELETE FROM receipt_cache WHERE created_at < ?",
+                (time.time() - RECEIPT_CACHE_SETTINGS["disk_ttl_seconds"],)
+            )
+
+    @staticmethod
+    def fingerprint(image_bytes: bytes, sha256: Optional[str] = None) -> Fingerprint:
+        """מחשב את מפתחות המטמון לתמונה (עבודת CPU - להריץ מחוץ ל-event loop).
+
+        sha256 שכבר חושב בזמן ההורדה נחסך כאן.
+        """
+        return sha256 or hashlib.sha256(image_bytes).hexdigest(), perceptual_hash(image_bytes)
+
+    # === קריאה ===
+
+    def get(self, fingerprint: Fingerprint) -> Optional[Dict]:
+        """מחזיר {'analysis', 'expense_ids'} לתמונה זהה (או כמעט זהה, אם הופעל), או None"""
+        sha256, phash = fingerprint
+
+        with self._lock:
+            entry = self._get_memory(sha256)
+
+            if entry is None and self._disk:
+                entry = self._get_disk(sha256)
+
+            if entry is None and phash is not None:
+                similar = self._find_similar(phash)
+                if similar is not None and self.phash_match_enabled:
+                    entry = similar
+                elif similar is not None:
+                    # שתי קבלות שונות באותה תבנית (אותו ספק/קופה) יכולות להיות קרובות - לא מסתמכים על זה
+                    logger.warning(f"Receipt {sha256[:12]} looks like a cached receipt (dHash) - analyzing it anyway")
+
+            if entry is None:
+                return None
+
+            # גם העתק שנדחס מחדש נרשם תחת ה-sha256 שלו (אותה רשומה משותפת)
+            self._store_memory(sha256, entry)
+
+            return {
+                'analysis': dict(entry['analysis']),
+                'expense_ids': dict(entry['expense_ids'])
+            }
+
+    def _is_expired(self, entry: Dict) -> bool:
+        return time.monotonic() - entry['stored_at'] > self.ttl_seconds
+
+    def _get_memory(self, sha256: str) -> Optional[Dict]:
+        entry = self._entries.get(sha256)
+        if entry is None:
+            return None
+
+        if self._is_expired(entry):
+            del self._entries[sha256]
+            return None
+
+        self._entries.move_to_end(sha256)
+        return entry
+
+    def _find_similar(self, phash: int) -> Optional[Dict]:
+        """מחפש תמונה עם dHash קרוב (מרחק Hamming קטן)"""
+        for entry in reversed(self._entries.values()):
+            if entry['phash'] is None or self._is_expired(entry):
+                continue
+            if bin(entry['phash'] ^ phash).count('1') <= self.max_distance:
+                return entry
+        return None
+
+    def _get_disk(self, sha256: str) -> Optional[Dict]:
+        try:
+            row = self._disk.execute(
+                "SELECT phash, analysis, expense_ids FROM receipt_cache WHERE sha256 = ?", (sha256,)
+            ).fetchone()
+        except Exception as e:
+            logger.error(f"Receipt cache disk read failed: {e}")
+            return None
+
+        if not row:
+            return None
+
+        return {
+            'phash': int(row[0], 16) if row[0] else None,
+            'analysis': json.loads(row[1]),
+            'expense_ids': json.loads(row[2]),
+            'stored_at': time.monotonic()
+        }
+
+    # === כתיבה ===
+
+    def put(self, fingerprint: Fingerprint, analysis: Dict):
+        """שומר תוצאת ניתוח של תמונה"""
+        sha256, phash = fingerprint
+        entry = {
+            'phash': phash,
+            'analysis': dict(analysis),
+            'expense_ids': {},
+            'stored_at': time.monotonic()
+        }
+
+        with self._lock:
+            self._store_memory(sha256, entry)
+            self._store_disk(sha256, entry)
+
+    def mark_saved(self, fingerprint: Fingerprint, group_id: str, expense_id: str):
+        """רושם שמהתמונה נוצרה הוצאה בקבוצה - לזיהוי שליחה כפולה"""
+        sha256, _ = fingerprint
+
+        with self._lock:
+            entry = self._entries.get(sha256)
+            if entry is None:
+                return
+
+            entry['expense_ids'][group_id] = expense_id
+            self._store_disk(sha256, entry)
+
+    def _store_memory(self, sha256: str, entry: Dict):
+        self._entries[sha256] = entry
+        self._entries.move_to_end(sha256)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _store_disk(self, sha256: str, entry: Dict):
+        if not self._disk:
+            return
+
+        # dHash נשמר כ-hex - 64 ביט unsigned לא נכנס ב-INTEGER של SQLite
+        phash = format(entry['phash'], '016x') if entry['phash'] is not None else None
+
+        try:
+            self._disk.execute(
+                "INSERT OR REPLACE INTO receipt_cache (sha256, phash, analysis, expense_ids, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (sha256, phash, json.dumps(entry['analysis'], ensure_ascii=False),
+                 json.dumps(entry['expense_ids']), time.time())
+            )
+        except Exception as e:
+            logger.error(f"Receipt cache disk write failed: {e}")
+
+    def close(self):
+        with self._lock:
+            if self._disk:
+                self._disk.close()
+                self._disk = None
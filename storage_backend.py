@@ -0,0 +1,573 @@
+import json
+import hashlib
+import sqlite3
+import logging
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Set, Tuple
+import httplib2
+import google_auth_httplib2
+from google.oauth2 import service_account
+from googleapiclient.discovery import build
+from config import *
+
+logger = logging.getLogger(__name__)
+
+def column_letter(index: int) -> str:
+    """ממיר אינדקס עמודה (מ-1) לאות בסגנון A1"""
+    letters = ""
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+class StorageBackend(ABC):
+    """ממשק אחסון טבלאי משותף לכל הטבלאות (expenses, couples, vendors, ...).
+
+    הטבלאות מתנהגות כמו גיליון: שורה 1 היא כותרת ושורות הנתונים ממוספרות
+    מ-2, כך שמספרי שורות שנשמרים בזיכרון תקפים בכל מימוש.
+    כל המתודות זורקות חריגה בכישלון - הטיפול בשגיאות נעשה ב-DatabaseManager.
+    """
+
+    name = "base"
+
+    @staticmethod
+    def headers(table: str) -> List[str]:
+        """מחזיר את כותרות הטבלה"""
+        return TABLE_HEADERS[table]
+
+    @abstractmethod
+    def read_table(self, table: str) -> List[List[str]]:
+        """מחזיר את כל שורות הטבלה כולל שורת הכותרת"""
+
+    @abstractmethod
+    def append_rows(self, table: str, rows: List[List]) -> Optional[int]:
+        """מוסיף שורות ומחזיר את מספר השורה הראשונה שנכתבה (None אם לא ידוע)"""
+
+    @abstractmethod
+    def update_rows(self, table: str, rows_by_number: Dict[int, List]) -> List[int]:
+        """מעדכן שורות שלמות לפי מספר שורה ומחזיר את מספרי השורות שנכתבו"""
+
+    @abstractmethod
+    def replace_table(self, table: str, rows: List[List]):
+        """מחליף את כל שורות הנתונים בטבלה (הכותרת נשמרת)"""
+
+    @abstractmethod
+    def delete_rows(self, table: str, row_numbers: List[int]) -> int:
+        """מוחק שורות לפי מספר בפעולה אחת; השורות שמתחתיהן עולות (כמו בגיליון). מחזיר כמה נמחקו"""
+
+    def read_rows(self, table: str, row_numbers: List[int]) -> Dict[int, List[str]]:
+        """מחזיר את התוכן הנוכחי של שורות לפי מספר (רשימה ריקה לשורה שלא קיימת)"""
+        rows = self.read_table(table)
+        return {n: list(rows[n - 1]) if 1 < n <= len(rows) else [] for n in row_numbers}
+
+    def find_rows(self, table: str, column: str, value: str) -> List[Tuple[int, List[str]]]:
+        """מחזיר (מספר שורה, שורה) לכל השורות שבהן column == value"""
+        column_index = self.headers(table).index(column)
+        matches = []
+
+        for i, row in enumerate(self.read_table(table)[1:]):
+            if len(row) > column_index and row[column_index] == value:
+                matches.append((i + 2, row))
+
+        return matches
+
+    def get_table_version(self, table: str) -> Optional[str]:
+        """מחזיר מזהה גרסה זול לטבלה (None אם לא נתמך)"""
+        return None
+
+    def is_empty(self) -> bool:
+        """האם אין אף שורת נתונים באף טבלה"""
+        return not any(len(self.read_table(table)) > 1 for table in TABLE_HEADERS)
+
+    def health_check(self) -> Dict[str, bool]:
+        return {"connection": True}
+
+    def close(self):
+        pass
+
+class SheetsBackend(StorageBackend):
+    """אחסון ב-Google Sheets - כל טבלה היא גיליון בשם הטבלה"""
+
+    name = "sheets"
+
+    def __init__(self):
+        self.sheets = None
+        self.drive = None
+        self.credentials = None
+        self._init_google_sheets()
+
+        # גרסה לכל טבלה: (modifiedTime של הקובץ, hash של הגיליון)
+        self._table_versions: Dict[str, Tuple[str, str]] = {}
+
+        # httplib2 אינו thread-safe - כל thread מקבל חיבור משלו
+        self._local = threading.local()
+
+        try:
+            self.ensure_tables()
+        except Exception as e:
+            logger.warning(f"Failed to verify sheets in the spreadsheet: {e}")
+
+    def _init_google_sheets(self):
+        """מאתחל חיבור לGoogle Sheets"""
+        try:
+            if GOOGLE_CREDENTIALS_JSON:
+                creds_dict = json.loads(GOOGLE_CREDENTIALS_JSON)
+                self.credentials = service_account.Credentials.from_service_account_info(
+                    creds_dict,
+                    scopes=[
+                        "https://www.googleapis.com/auth/spreadsheets",
+                        # modifiedTime של הקובץ - בדיקת גרסה זולה בלי לקרוא את הגיליון
+                        "https://www.googleapis.com/auth/drive.metadata.readonly",
+                    ]
+                )
+            else:
+                raise ValueError("Missing Google credentials")
+
+            self.sheets = build("sheets", "v4", credentials=self.credentials)
+            self.drive = build("drive", "v3", credentials=self.credentials)
+            logger.info("Google Sheets initialized successfully")
+
+        except Exception as e:
+            logger.error(f"Failed to initialize Google Sheets: {e}")
+            raise
+
+    def ensure_tables(self) -> List[str]:
+        """יוצר גיליונות חסרים (למשל vendor_categories בהתקנה קיימת) עם שורת כותרת"""
+        spreadsheet = self.sheets.spreadsheets().get(
+            spreadsheetId=GSHEETS_SPREADSHEET_ID,
+            fields="sheets.properties.title"
+        ).execute(http=self._get_http())
+
+        existing = {sheet['properties']['title'] for sheet in spreadsheet.get('sheets', [])}
+        missing = [table for table in TABLE_HEADERS if table not in existing]
+        if not missing:
+            return []
+
+        self.sheets.spreadsheets().batchUpdate(
+            spreadsheetId=GSHEETS_SPREADSHEET_ID,
+            body={'requests': [{'addSheet': {'properties': {'title': table}}} for table in missing]}
+        ).execute(http=self._get_http())
+
+        self.sheets.spreadsheets().values().batchUpdate(
+            spreadsheetId=GSHEETS_SPREADSHEET_ID,
+            body={
+                'valueInputOption': 'USER_ENTERED',
+                'data': [{'range': f"{table}!A1", 'values': [self.headers(table)]} for table in missing]
+            }
+        ).execute(http=self._get_http())
+
+        logger.info(f"Created missing sheet(s): {', '.join(missing)}")
+        return missing
+
+    def _get_http(self) -> google_auth_httplib2.AuthorizedHttp:
+        """מחזיר חיבור HTTP מאומת ייחודי ל-thread הנוכחי"""
+        http = getattr(self._local, 'http', None)
+        if http is None:
+            http = google_auth_httplib2.AuthorizedHttp(self.credentials, http=httplib2.Http())
+            self._local.http = http
+        return http
+
+    def _range(self, table: str, first_row: Optional[int] = None, last_row: Optional[int] = None) -> str:
+        """בונה טווח A1 לטבלה או לשורות בה"""
+        last_column = column_letter(len(self.headers(table)))
+        if first_row is None:
+            return f"{table}!A:{last_column}"
+        return f"{table}!A{first_row}:{last_column}{last_row or first_row}"
+
+    @staticmethod
+    def _row_from_range(updated_range: str) -> Optional[int]:
+        """מחלץ את מספר השורה הראשונה מטווח כמו "expenses!A15:M17" """
+        cells = updated_range.split('!')[-1].split(':')[0]
+        digits = ''.join(ch for ch in cells if ch.isdigit())
+        return int(digits) if digits else None
+
+    def read_table(self, table: str) -> List[List[str]]:
+        result = self.sheets.spreadsheets().values().get(
+            spreadsheetId=GSHEETS_SPREADSHEET_ID,
+            range=self._range(table)
+        ).execute(http=self._get_http())
+
+        values = result.get('values', [])
+        logger.debug(f"Read {len(values)} rows from {table}")
+        return values
+
+    def get_table_version(self, table: str) -> Optional[str]:
+        # modifiedTime של Drive (מטא-דאטה בלבד) משתנה בכל כתיבה לכל גיליון בקובץ.
+        # כל עוד הוא לא זז מחזירים את הגרסה השמורה; רק כשזז קוראים את הגיליון עצמו,
+        # כך שכתיבת הוצאות לא משנה את גרסת couples
+        try:
+            modified = self.drive.files().get(
+                fileId=GSHEETS_SPREADSHEET_ID,
+                fields="modifiedTime"
+            ).execute(http=self._get_http()).get('modifiedTime')
+
+            cached = self._table_versions.get(table)
+            if cached and modified and cached[0] == modified:
+                return cached[1]
+
+            content = json.dumps(self.read_table(table), ensure_ascii=False)
+            version = hashlib.sha1(content.encode('utf-8')).hexdigest()
+            if modified:
+                self._table_versions[table] = (modified, version)
+            return version
+
+        except Exception as e:
+            logger.debug(f"Failed to get version for {table}: {e}")
+            return None
+
+    def append_rows(self, table: str, rows: List[List]) -> Optional[int]:
+        result = self.sheets.spreadsheets().values().append(
+            spreadsheetId=GSHEETS_SPREADSHEET_ID,
+            range=self._range(table),
+            valueInputOption='USER_ENTERED',
+            insertDataOption='INSERT_ROWS',
+            body={'values': rows}
+        ).execute(http=self._get_http())
+
+        logger.info(f"Added {len(rows)} row(s) to {table}")
+        return self._row_from_range(result.get('updates', {}).get('updatedRange', ''))
+
+    def update_rows(self, table: str, rows_by_number: Dict[int, List]) -> List[int]:
+        if not rows_by_number:
+            return []
+
+        body = {
+            'valueInputOption': 'USER_ENTERED',
+            'data': [
+                {'range': self._range(table, row_number), 'values': [row]}
+                for row_number, row in rows_by_number.items()
+            ]
+        }
+
+        result = self.sheets.spreadsheets().values().batchUpdate(
+            spreadsheetId=GSHEETS_SPREADSHEET_ID,
+            body=body
+        ).execute(http=self._get_http())
+
+        written = [self._row_from_range(r.get('updatedRange', '')) for r in result.get('responses', [])]
+        logger.info(f"Updated {len(written)} row(s) in {table}")
+        return [row_number for row_number in written if row_number]
+
+    def replace_table(self, table: str, rows: List[List]):
+        values = self.sheets.spreadsheets().values()
+
+        # כתיבת הכותרת והנתונים, ואז ניקוי שאריות מתחת לנתונים החדשים
+        values.update(
+            spreadsheetId=GSHEETS_SPREADSHEET_ID,
+            range=f"{table}!A1",
+            valueInputOption='USER_ENTERED',
+            body={'values': [self.headers(table)] + rows}
+        ).execute(http=self._get_http())
+
+        last_column = column_letter(len(self.headers(table)))
+        values.clear(
+            spreadsheetId=GSHEETS_SPREADSHEET_ID,
+            range=f"{table}!A{len(rows) + 2}:{last_column}",
+            body={}
+        ).execute(http=self._get_http())
+
+        logger.info(f"Replaced {table} with {len(rows)} row(s)")
+
+    def read_rows(self, table: str, row_numbers: List[int]) -> Dict[int, List[str]]:
+        if not row_numbers:
+            return {}
+
+        result = self.sheets.spreadsheets().values().batchGet(
+            spreadsheetId=GSHEETS_SPREADSHEET_ID,
+            ranges=[self._range(table, n) for n in row_numbers]
+        ).execute(http=self._get_http())
+
+        rows = {}
+        for n, value_range in zip(row_numbers, result.get('valueRanges', [])):
+            values = value_range.get('values', [])
+            rows[n] = list(values[0]) if values else []
+        return rows
+
+    def _sheet_id(self, table: str) -> int:
+        """מזהה הגיליון (sheetId) - נדרש לפעולות מבנה כמו מחיקת שורות"""
+        spreadsheet = self.sheets.spreadsheets().get(
+            spreadsheetId=GSHEETS_SPREADSHEET_ID,
+            fields="sheets.properties(sheetId,title)"
+        ).execute(http=self._get_http())
+
+        for sheet in spreadsheet.get('sheets', []):
+            if sheet['properties']['title'] == table:
+                return sheet['properties']['sheetId']
+        raise ValueError(f"Sheet {table} not found")
+
+    def delete_rows(self, table: str, row_numbers: List[int]) -> int:
+        if not row_numbers:
+            return 0
+
+        sheet_id = self._sheet_id(table)
+        # מהתחתונה לעליונה - כל מחיקה לא מזיזה את השורות שעוד נמחקות. batchUpdate אחד
+        # מוחל באופן אטומי, ושורות שנוספו בינתיים בסוף הגיליון לא נפגעות
+        requests = [
+            {'deleteDimension': {'range': {
+                'sheetId': sheet_id, 'dimension': 'ROWS', 'startIndex': n - 1, 'endIndex': n
+            }}}
+            for n in sorted(set(row_numbers), reverse=True)
+        ]
+        self.sheets.spreadsheets().batchUpdate(
+            spreadsheetId=GSHEETS_SPREADSHEET_ID,
+            body={'requests': requests}
+        ).execute(http=self._get_http())
+
+        logger.info(f"Deleted {len(requests)} row(s) from {table}")
+        return len(requests)
+
+    def health_check(self) -> Dict[str, bool]:
+        return {"connection": bool(self.sheets)}
+
+class SQLiteBackend(StorageBackend):
+    """אחסון מקומי ב-SQLite - ללא מגבלת קצב ונוח לבדיקות עומס בלי רשת"""
+
+    name = "sqlite"
+
+    # עמודות שמחפשים לפיהן - מקבלות אינדקס
+    INDEXED_COLUMNS = {
+        "expenses": ["expense_id", "group_id"],
+        "couples": ["whatsapp_group_id"],
+        "vendors": ["vendor_name"],
+        "vendor_budgets": ["group_id"],
+        "category_budgets": ["group_id"],
+        "vendor_categories": ["vendor_key"]
+    }
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+        logger.info(f"SQLite storage initialized at {path}")
+
+    def _create_schema(self):
+        """יוצר טבלאות ואינדקסים אם אינם קיימים"""
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS table_revisions (table_name TEXT PRIMARY KEY, revision INTEGER NOT NULL)"
+            )
+
+            for table, headers in TABLE_HEADERS.items():
+                columns = ", ".join(f'"{header}" TEXT NOT NULL DEFAULT \'\'' for header in headers)
+                self._conn.execute(
+                    f'CREATE TABLE IF NOT EXISTS "{table}" (row_number INTEGER PRIMARY KEY, {columns})'
+                )
+
+                for column in self.INDEXED_COLUMNS.get(table, []):
+                    self._conn.execute(
+                        f'CREATE INDEX IF NOT EXISTS "idx_{table}_{column}" ON "{table}" ("{column}")'
+                    )
+
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO table_revisions (table_name, revision) VALUES (?, 0)", (table,)
+                )
+
+    def _normalize_row(self, table: str, row: List) -> List[str]:
+        """מיישר שורה למספר העמודות בטבלה"""
+        width = len(self.headers(table))
+        values = ['' if value is None else str(value) for value in row[:width]]
+        return values + [''] * (width - len(values))
+
+    @contextmanager
+    def _transaction(self, table: str):
+        """טרנזקציית כתיבה שמקדמת את גרסת הטבלה"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+                self._conn.execute(
+                    "UPDATE table_revisions SET revision = revision + 1 WHERE table_name = ?", (table,)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _insert_rows(self, table: str, rows: List[List]) -> int:
+        """מוסיף שורות בסוף הטבלה (בתוך טרנזקציה) ומחזיר את מספר השורה הראשונה"""
+        headers = self.headers(table)
+        columns = ", ".join(f'"{header}"' for header in headers)
+        placeholders = ", ".join("?" * (len(headers) + 1))
+
+        last_row = self._conn.execute(
+            f'SELECT COALESCE(MAX(row_number), 1) FROM "{table}"'
+        ).fetchone()[0]
+        first_row = last_row + 1
+
+        self._conn.executemany(
+            f'INSERT INTO "{table}" (row_number, {columns}) VALUES ({placeholders})',
+            [[first_row + i] + self._normalize_row(table, row) for i, row in enumerate(rows)]
+        )
+        return first_row
+
+    def _select(self, table: str, where: str = "", params: Tuple = ()) -> List[Tuple]:
+        columns = ", ".join(f'"{header}"' for header in self.headers(table))
+        return self._conn.execute(
+            f'SELECT row_number, {columns} FROM "{table}" {where} ORDER BY row_number', params
+        ).fetchall()
+
+    def read_table(self, table: str) -> List[List[str]]:
+        with self._lock:
+            rows = self._select(table)
+        return [list(self.headers(table))] + [list(row[1:]) for row in rows]
+
+    def append_rows(self, table: str, rows: List[List]) -> Optional[int]:
+        with self._transaction(table):
+            return self._insert_rows(table, rows)
+
+    def update_rows(self, table: str, rows_by_number: Dict[int, List]) -> List[int]:
+        assignments = ", ".join(f'"{header}" = ?' for header in self.headers(table))
+        written = []
+
+        with self._transaction(table):
+            for row_number, row in rows_by_number.items():
+                cursor = self._conn.execute(
+                    f'UPDATE "{table}" SET {assignments} WHERE row_number = ?',
+                    self._normalize_row(table, row) + [row_number]
+                )
+                if cursor.rowcount:
+                    written.append(row_number)
+
+        return written
+
+    def replace_table(self, table: str, rows: List[List]):
+        with self._transaction(table):
+            self._conn.execute(f'DELETE FROM "{table}"')
+            if rows:
+                self._insert_rows(table, rows)
+
+    def delete_rows(self, table: str, row_numbers: List[int]) -> int:
+        deleted = 0
+
+        with self._transaction(table):
+            for n in sorted(set(row_numbers), reverse=True):
+                cursor = self._conn.execute(f'DELETE FROM "{table}" WHERE row_number = ?', (n,))
+                if not cursor.rowcount:
+                    continue
+                deleted += 1
+                # הזזה למעלה כמו בגיליון - דרך ערכים שליליים כדי לא להתנגש במפתח הראשי
+                self._conn.execute(
+                    f'UPDATE "{table}" SET row_number = -(row_number - 1) WHERE row_number > ?', (n,)
+                )
+                self._conn.execute(f'UPDATE "{table}" SET row_number = -row_number WHERE row_number < 0')
+
+        return deleted
+
+    def find_rows(self, table: str, column: str, value: str) -> List[Tuple[int, List[str]]]:
+        if column not in self.headers(table):
+            raise ValueError(f"Unknown column {column} in {table}")
+
+        with self._lock:
+            rows = self._select(table, f'WHERE "{column}" = ?', (value,))
+        return [(row[0], list(row[1:])) for row in rows]
+
+    def get_table_version(self, table: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT revision FROM table_revisions WHERE table_name = ?", (table,)
+            ).fetchone()
+        return str(row[0]) if row else None
+
+    def health_check(self) -> Dict[str, bool]:
+        try:
+            with self._lock:
+                self._conn.execute("SELECT 1").fetchone()
+            return {"connection": True}
+        except Exception as e:
+            logger.error(f"SQLite health check failed: {e}")
+            return {"connection": False}
+
+    def is_empty(self) -> bool:
+        """האם אין אף שורת נתונים באף טבלה (קובץ חדש, לפני העתקה מהגיליון)"""
+        with self._lock:
+            return not any(
+                self._conn.execute(f'SELECT 1 FROM "{table}" LIMIT 1').fetchone()
+                for table in TABLE_HEADERS
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class SheetsExporter:
+    """משקף טבלאות מ-SQLite לגיליון, כדי שהזוגות והמנהל ימשיכו לראות Google Sheets"""
+
+    def __init__(self, source: StorageBackend, target: SheetsBackend):
+        self.source = source
+        self.target = target
+        self._exported_versions: Dict[str, Optional[str]] = {}
+        # טבלאות שהייצוא שלהן נכשל - השגיאה נרשמת פעם אחת ולא בכל מחזור
+        self._failing_tables: Set[str] = set()
+
+    def seed(self) -> int:
+        """מעתיק את הגיליון הקיים ל-SQLite (מעבר של התקנה קיימת) ומחזיר כמה שורות הועתקו"""
+        copied = 0
+
+        for table in TABLE_HEADERS:
+            try:
+                rows = self.target.read_table(table)[1:]
+            except Exception as e:
+                # למשל גיליון שעוד לא נוצר - אין מה להעתיק
+                logger.warning(f"Cannot seed {table} from Sheets: {e}")
+                continue
+
+            if rows:
+                self.source.replace_table(table, rows)
+                copied += len(rows)
+
+            # הגיליון כבר זהה לטבלה - אין צורך לייצא אותה בחזרה
+            self._exported_versions[table] = self.source.get_table_version(table)
+
+        logger.info(f"Seeded {self.source.name} storage from Google Sheets: {copied} row(s)")
+        return copied
+
+    def export(self) -> int:
+        """מייצא טבלאות שהשתנו מאז הייצוא האחרון ומחזיר כמה טבלאות יוצאו"""
+        exported = 0
+
+        for table in TABLE_HEADERS:
+            try:
+                version = self.source.get_table_version(table)
+                if version is not None and self._exported_versions.get(table) == version:
+                    continue
+
+                rows = self.source.read_table(table)[1:]
+
+                # טבלה ריקה לא דורסת גיליון עם נתונים - כנראה אחסון מקומי שלא הועתק
+                if (not rows and not STORAGE_SETTINGS["sheets_export_allow_empty"]
+                        and len(self.target.read_table(table)) > 1):
+                    logger.warning(f"Refusing to overwrite non-empty {table} sheet with an empty table "
+                                   f"(set SHEETS_EXPORT_ALLOW_EMPTY=true to allow)")
+                    continue
+
+                self.target.replace_table(table, rows)
+                self._exported_versions[table] = version
+                self._failing_tables.discard(table)
+                exported += 1
+
+            except Exception as e:
+                if table in self._failing_tables:
+                    logger.debug(f"Export of {table} to Sheets still failing: {e}")
+                else:
+                    self._failing_tables.add(table)
+                    logger.error(f"Failed to export {table} to Sheets (further failures logged at debug): {e}")
+
+        if exported:
+            logger.info(f"Exported {exported} table(s) to Google Sheets")
+        return exported
+
+def create_storage_backend() -> StorageBackend:
+    """יוצר את מנוע האחסון לפי STORAGE_SETTINGS"""
+    backend = STORAGE_SETTINGS["backend"]
+
+    if backend == "sqlite":
+        return SQLiteBackend(STORAGE_SETTINGS["sqlite_path"])
+    if backend == "sheets":
+        return SheetsBackend()
+
+    raise ValueError(f"Unknown storage backend: {backend}")
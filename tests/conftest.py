@@ -0,0 +1,28 @@
+import os
+import sys
+
+# הבדיקות רצות על SQLite מקומי, בלי Google/OpenAI/Green API
+os.environ.setdefault("STORAGE_BACKEND", "sqlite")
+os.environ.setdefault("WRITE_BEHIND_ENABLED", "false")
+os.environ.setdefault("SHEETS_EXPORT_ENABLED", "false")
+os.environ["GSHEETS_SPREADSHEET_ID"] = ""
+os.environ["GOOGLE_CREDENTIALS_JSON"] = ""
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from storage_backend import SQLiteBackend
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "storage.db"))
+    yield backend
+    backend.close()
+
+@pytest.fixture
+def db(backend):
+    from database_manager import DatabaseManager
+    db = DatabaseManager(backend)
+    yield db
+    db.close()
@@ -0,0 +1,123 @@
+import asyncio
+import json
+import logging
+
+import pytest
+
+from ai_analyzer import AIAnalyzer
+from category_cache import VendorCategoryCache
+from config import CATEGORY_CACHE_SETTINGS
+from storage_backend import SQLiteBackend, SheetsExporter
+
+class MissingTableBackend(SQLiteBackend):
+    """מנוע שבו הטבלה vendor_categories חסרה - כמו גיליון שלא נוצר"""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.missing = {"vendor_categories"}
+        self.calls = 0
+
+    def _check(self, table):
+        if table in self.missing:
+            self.calls += 1
+            raise RuntimeError(f"Unable to parse range: {table}")
+
+    def read_table(self, table):
+        self._check(table)
+        return super().read_table(table)
+
+    def append_rows(self, table, rows):
+        self._check(table)
+        return super().append_rows(table, rows)
+
+    def replace_table(self, table, rows):
+        self._check(table)
+        return super().replace_table(table, rows)
+
+@pytest.fixture
+def missing(tmp_path):
+    backend = MissingTableBackend(str(tmp_path / "missing.db"))
+    yield backend
+    backend.close()
+
+def test_put_and_get(backend):
+    cache = VendorCategoryCache(backend)
+    assert cache.put("הצלם יוסי", {"category": "צילום", "confidence": 95})
+    assert cache.put("הצלם יוסי", {"category": "צילום", "confidence": 80})
+
+    # נטען מחדש מהטבלה - רשומה אחת לספק
+    fresh = VendorCategoryCache(backend)
+    assert fresh.get("הצלם יוסי") == {"vendor_name": "הצלם יוסי", "category": "צילום", "confidence": 80}
+    assert len(backend.read_table("vendor_categories")) == 2
+
+def test_low_confidence_is_not_cached(backend):
+    cache = VendorCategoryCache(backend)
+    assert not cache.put("ספק", {"category": "אחר", "confidence": 10})
+    assert cache.get("ספק") is None
+
+def test_missing_table_skips_writes_after_first_failure(missing, caplog):
+    cache = VendorCategoryCache(missing)
+
+    with caplog.at_level(logging.WARNING, logger="category_cache"):
+        for _ in range(5):
+            assert not cache.put("אולם", {"category": "אולם", "confidence": 95})
+            assert cache.get("אולם") is None
+
+    # ניסיון טעינה אחד בלבד, ואזהרה אחת במקום שגיאה לכל כתיבה
+    assert missing.calls == 1
+    assert len(caplog.records) == 1
+    assert not [r for r in caplog.records if r.levelno >= logging.ERROR]
+
+def test_cache_recovers_when_table_appears(missing, monkeypatch):
+    monkeypatch.setitem(CATEGORY_CACHE_SETTINGS, "reload_interval_seconds", 1)
+    cache = VendorCategoryCache(missing)
+    assert not cache.put("אולם", {"category": "אולם", "confidence": 95})
+
+    missing.missing.clear()
+    cache._loaded_at -= 2  # עבר reload_interval
+
+    assert cache.put("אולם", {"category": "אולם", "confidence": 95})
+    assert cache.get("אולם")["category"] == "אולם"
+
+def test_export_logs_missing_sheet_once(backend, missing, caplog):
+    exporter = SheetsExporter(backend, missing)
+    backend.append_rows("vendor_categories", [["k", "v", "אולם", "90", "", ""]])
+
+    with caplog.at_level(logging.DEBUG, logger="storage_backend"):
+        exporter.export()
+        backend.append_rows("vendor_categories", [["k2", "v2", "אולם", "90", "", ""]])
+        exporter.export()
+
+    errors = [r for r in caplog.records if r.levelno >= logging.ERROR]
+    assert len(errors) == 1
+    assert "vendor_categories" in errors[0].getMessage()
+
+async def test_single_flight_uses_the_cache_key(backend):
+    analyzer = AIAnalyzer(VendorCategoryCache(backend))
+    analyzer.async_client = object()
+    calls = []
+
+    async def complete(*args, **kwargs):
+        calls.append(args)
+        await asyncio.sleep(0.01)
+        return json.dumps({"vendor_name": "זורבו", "category": "צילום", "confidence": 90})
+
+    analyzer._complete_async = complete
+    first, second = await asyncio.gather(
+        analyzer.enhance_vendor_with_category_async('זורבו בע"מ'),
+        analyzer.enhance_vendor_with_category_async("זורבו"),
+    )
+
+    # שני שמות שה-cache רואה כספק אחד - קריאה אחת ל-LLM
+    assert len(calls) == 1
+    assert first == {"vendor_name": 'זורבו בע"מ', "category": "צילום", "confidence": 90}
+    assert second["vendor_name"] == "זורבו"
+
+async def test_sync_and_async_return_the_same_result(backend):
+    cache = VendorCategoryCache(backend)
+    cache.put("זורבו", {"category": "צילום", "confidence": 90})
+    analyzer = AIAnalyzer(cache)
+
+    sync = analyzer.enhance_vendor_with_category('זורבו בע"מ')
+    assert sync == await analyzer.enhance_vendor_with_category_async('זורבו בע"מ')
+    assert sync["vendor_name"] == 'זורבו בע"מ'
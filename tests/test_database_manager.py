@@ -0,0 +1,119 @@
+from config import EXPENSE_HEADERS
+
+def expense(expense_id, amount, vendor="צלם", group_id="g1"):
+    return {'expense_id': expense_id, 'amount': amount, 'vendor': vendor, 'date': '2026-01-01',
+            'category': 'צילום', 'group_id': group_id, 'payment_type': 'full'}
+
+def stored(backend, expense_id):
+    rows = [dict(zip(EXPENSE_HEADERS, row)) for row in backend.read_table("expenses")[1:]]
+    return next(row for row in rows if row['expense_id'] == expense_id)
+
+def test_bulk_update_writes_each_expense_to_its_own_row(db, backend):
+    assert db.save_expenses_bulk([expense("a", 100), expense("b", 200), expense("c", 300)])
+
+    results = db.update_expenses_bulk({"c": {'amount': 350}, "a": {'vendor': 'הצלם יוסי'}})
+
+    assert results == {"c": True, "a": True}
+    assert stored(backend, "a")['vendor'] == 'הצלם יוסי'
+    assert stored(backend, "a")['amount'] == '100'
+    assert stored(backend, "b")['amount'] == '200'
+    assert stored(backend, "c")['amount'] == '350'
+    assert stored(backend, "c")['last_updated']
+
+def test_bulk_update_reloads_rows_added_by_another_instance(db, backend):
+    assert db.save_expense(expense("a", 100))
+    db.get_expense("a")
+
+    # שורה שנכתבה ע"י מופע אחר - לא מוכרת למאגר בזיכרון
+    other = [''] * len(EXPENSE_HEADERS)
+    other[0], other[1], other[5], other[10] = "x", "700", "g1", "active"
+    backend.append_rows("expenses", [other])
+
+    results = db.update_expenses_bulk({"x": {'amount': 750}, "missing": {'amount': 1}})
+
+    assert results == {"x": True, "missing": False}
+    assert stored(backend, "x")['amount'] == '750'
+    assert stored(backend, "a")['amount'] == '100'
+
+def test_update_payment_types_marks_advances_and_final(db, backend):
+    payments = [expense("a", 1000), expense("b", 2000), expense("c", 3000)]
+    assert db.save_expenses_bulk(payments)
+
+    assert db.update_payment_types(payments)
+
+    assert [stored(backend, eid)['payment_type'] for eid in "abc"] == ['advance_1', 'advance_2', 'final']
+    assert db.get_expense("c")['payment_type'] == 'final'
+
+def vendor_rows(backend):
+    return [row[:3] for row in backend.read_table("vendors")[1:]]
+
+def test_vendor_upsert_updates_the_existing_row(db, backend):
+    assert db.save_vendor_category('אולמי הגן בע"מ', "אולם", 80, "g1")
+    # אותו ספק בכתיב אחר - אותה שורה, השם המקורי נשמר
+    assert db.save_vendor_category("אולמי הגן", "אולם", 90)
+    # ביטחון נמוך יותר לא מחליף קטגוריה
+    assert db.save_vendor_category("אולמי הגן", "מזון", 50)
+
+    assert vendor_rows(backend) == [['אולמי הגן בע"מ', "אולם", "90"]]
+    assert backend.read_table("vendors")[1][4] == "g1"
+
+    assert db.save_vendor_category("אולמי הגן", "מזון", 95)
+    assert vendor_rows(backend) == [['אולמי הגן בע"מ', "מזון", "95"]]
+
+def test_compact_vendors_removes_duplicate_rows(db, backend):
+    backend.append_rows("vendors", [
+        ["הצלם", "צילום", "95", "2026-01-01", "g1", "2025-12-01"],
+        ["להקה", "מוזיקה", "80", "2026-01-01", "g1", "2026-01-01"],
+        ["הַצלם", "אחר", "60", "2026-02-01", "g2", "2026-02-01"],
+        ["", "", "", "", "", ""],
+    ])
+
+    assert db.compact_vendors() == 2
+    assert vendor_rows(backend) == [["הצלם", "צילום", "95"], ["להקה", "מוזיקה", "80"]]
+    assert backend.read_table("vendors")[1][5] == "2025-12-01"
+
+    # אחרי האיחוד העדכונים נכתבים לשורות הנכונות
+    assert db.save_vendor_category("להקה", "מוזיקה", 90)
+    assert vendor_rows(backend)[1] == ["להקה", "מוזיקה", "90"]
+    assert db.compact_vendors() == 0
+
+def test_compaction_keeps_rows_changed_by_another_instance(db, backend, monkeypatch):
+    backend.append_rows("vendors", [
+        ["הצלם", "צילום", "95", "2026-01-01", "g1", "2026-01-01"],
+        ["הצלם", "אחר", "60", "2026-01-01", "g2", "2026-01-01"],
+    ])
+    read_rows = backend.read_rows
+
+    def read_after_concurrent_write(table, row_numbers):
+        # מופע אחר כותב לשורה הכפולה בין הקריאה למחיקה
+        backend.update_rows("vendors", {3: ["הצלם", "וידאו", "99", "2026-02-01", "g2", "2026-01-01"]})
+        return read_rows(table, row_numbers)
+
+    monkeypatch.setattr(backend, "read_rows", read_after_concurrent_write)
+
+    assert db.compact_vendors() == 0
+    assert len(vendor_rows(backend)) == 2
+
+def test_update_after_another_instance_compacted_hits_the_right_row(backend):
+    from database_manager import DatabaseManager
+    backend.append_rows("vendors", [
+        ["הצלם", "צילום", "60", "2026-01-01", "g1", "2026-01-01"],
+        ["הצלם", "צילום", "95", "2026-01-01", "g1", "2026-01-01"],
+        ["להקה", "מוזיקה", "80", "2026-01-01", "g1", "2026-01-01"],
+    ])
+    compactor, other = DatabaseManager(backend), DatabaseManager(backend)
+    assert other.get_vendor_category("להקה") == "מוזיקה"
+
+    assert compactor.compact_vendors() == 1
+
+    # האינדקס של המופע השני עדיין מצביע על שורה 4 - שכבר לא קיימת
+    assert other.save_vendor_category("להקה", "מוזיקה", 90)
+    assert vendor_rows(backend) == [["הצלם", "צילום", "95"], ["להקה", "מוזיקה", "90"]]
+
+def test_bulk_update_does_not_change_the_callers_updates(db):
+    assert db.save_expense(expense("a", 100))
+    updates = {"a": {'payment_type': 'advance'}}
+
+    assert db.update_expenses_bulk(updates) == {"a": True}
+    assert updates == {"a": {'payment_type': 'advance'}}
+    assert db.get_expense("a")['last_updated']
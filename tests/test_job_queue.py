@@ -0,0 +1,185 @@
+import asyncio
+
+import pytest
+
+from config import JOB_QUEUE_SETTINGS
+from job_queue import JobQueue, JobWorkerPool, RetryableJobError
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setitem(JOB_QUEUE_SETTINGS, "retry_base_delay_seconds", 0)
+    monkeypatch.setitem(JOB_QUEUE_SETTINGS, "poll_interval_seconds", 0.05)
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    yield queue
+    queue.close()
+
+def test_claim_keeps_group_order(queue):
+    first = queue.enqueue("g1", {"n": 1})
+    queue.enqueue("g1", {"n": 2})
+    other = queue.enqueue("g2", {"n": 3})
+
+    assert queue.claim()[0] == first
+    # g1 בעיבוד - העבודה הבאה שלו ממתינה, g2 פנויה
+    assert queue.claim()[0] == other
+    assert queue.claim() is None
+
+    queue.complete(first)
+    assert queue.claim()[2] == {"n": 2}
+
+def test_failed_job_is_retried_then_dropped(queue, monkeypatch):
+    monkeypatch.setitem(JOB_QUEUE_SETTINGS, "max_attempts", 2)
+    job_id = queue.enqueue("g1", {})
+
+    queue.claim()
+    assert queue.fail(job_id) is True
+    assert queue.claim()[0] == job_id
+    assert queue.fail(job_id) is False
+    assert queue.count() == 0
+
+def test_retry_backoff_blocks_the_group(queue, monkeypatch):
+    monkeypatch.setitem(JOB_QUEUE_SETTINGS, "retry_base_delay_seconds", 60)
+    job_id = queue.enqueue("g1", {"n": 1})
+    queue.enqueue("g1", {"n": 2})
+    other = queue.enqueue("g2", {})
+
+    queue.claim()
+    queue.fail(job_id)
+
+    # העבודה שנכשלה ממתינה ל-backoff, וההודעה הבאה של הקבוצה לא עוקפת אותה
+    assert queue.claim()[0] == other
+    assert queue.claim() is None
+
+def test_running_jobs_are_replayed_after_restart(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    queue = JobQueue(path)
+    job_id = queue.enqueue("g1", {"n": 1})
+    queue.claim()
+    queue.close()
+
+    reopened = JobQueue(path)
+    assert reopened.claim() is None
+    assert reopened.reset_running() == 1
+    assert reopened.claim()[0] == job_id
+    reopened.close()
+
+def test_held_job_frees_the_group_until_it_settles(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    queue = JobQueue(path)
+    held = queue.enqueue("g1", {"n": 1})
+    queue.enqueue("g1", {"n": 2})
+
+    queue.claim()
+    queue.hold(held)
+    # ההודעה הבאה של הקבוצה לא מחכה לעבודה המוחזקת
+    assert queue.claim()[2] == {"n": 2}
+    queue.close()
+
+    # קריסה לפני שהעבודה המוחזקת הסתיימה - היא חוזרת לתור
+    reopened = JobQueue(path)
+    assert reopened.reset_running() == 2
+    assert reopened.claim()[0] == held
+    reopened.close()
+
+async def wait_until(condition, timeout=2):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not reached")
+
+async def test_worker_retries_retryable_errors(queue):
+    calls = []
+
+    async def handler(payload):
+        calls.append(payload)
+        if len(calls) == 1:
+            raise RetryableJobError("storage unavailable")
+        return {"status": "ok"}
+
+    pool = JobWorkerPool(queue, handler, workers=2)
+    pool.start()
+    await pool.submit("g1", {"n": 1})
+
+    await wait_until(lambda: queue.count() == 0)
+    await pool.stop()
+    assert calls == [{"n": 1}, {"n": 1}]
+
+async def test_worker_reports_dropped_jobs(queue, monkeypatch):
+    monkeypatch.setitem(JOB_QUEUE_SETTINGS, "max_attempts", 2)
+    dropped = []
+
+    async def handler(payload):
+        raise RetryableJobError("still down")
+
+    async def on_give_up(payload):
+        dropped.append(payload)
+
+    pool = JobWorkerPool(queue, handler, workers=1, on_give_up=on_give_up)
+    pool.start()
+    await pool.submit("g1", {"n": 1})
+
+    await wait_until(lambda: dropped)
+    await pool.stop()
+    assert dropped == [{"n": 1}]
+    assert queue.count() == 0
+
+async def test_stop_drains_in_flight_jobs(queue):
+    started, finished = [], []
+
+    async def handler(payload):
+        started.append(payload)
+        await asyncio.sleep(0.2)
+        finished.append(payload)
+        return {"status": "ok"}
+
+    pool = JobWorkerPool(queue, handler, workers=1)
+    pool.start()
+    await pool.submit("g1", {"n": 1})
+    await wait_until(lambda: started)
+
+    await pool.stop(timeout=5)
+    assert finished == [{"n": 1}]
+    assert queue.count() == 0
+
+async def test_stop_cancels_after_timeout_and_keeps_job(queue):
+    started = []
+
+    async def handler(payload):
+        started.append(payload)
+        await asyncio.sleep(10)
+
+    pool = JobWorkerPool(queue, handler, workers=1)
+    pool.start()
+    await pool.submit("g1", {"n": 1})
+    await wait_until(lambda: started)
+
+    await pool.stop(timeout=0.1)
+    # תחזור לתור בהפעלה הבאה
+    assert queue.count() == 1
+    assert queue.reset_running() == 1
+
+async def test_pending_result_holds_the_job_until_it_resolves(queue):
+    outcomes = {}
+
+    async def handler(payload):
+        outcomes[payload["n"]] = asyncio.get_running_loop().create_future()
+        return {"status": "batched", "pending": outcomes[payload["n"]]}
+
+    pool = JobWorkerPool(queue, handler, workers=1)
+    pool.start()
+    await pool.submit("g1", {"n": 1})
+    await pool.submit("g1", {"n": 2})
+
+    # שתי העבודות של הקבוצה נלקחו, ואף אחת לא נמחקה
+    await wait_until(lambda: len(outcomes) == 2)
+    assert queue.count() == 2
+
+    outcomes[1].set_result({"status": "ok"})
+    outcomes[2].set_exception(RetryableJobError("save failed"))
+    await wait_until(lambda: queue.count() == 1)
+
+    # העבודה שנכשלה חוזרת לתור ומטופלת שוב
+    await wait_until(lambda: not outcomes[2].done())
+    outcomes[2].set_result({"status": "ok"})
+    await wait_until(lambda: queue.count() == 0)
+    await pool.stop()
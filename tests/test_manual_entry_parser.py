@@ -0,0 +1,76 @@
+import random
+import sys
+import timeit
+
+import pytest
+
+from config import CATEGORY_LIST
+from manual_entry_parser import _strip_prefix, parse_manual_entry
+
+# מדידת ביצועים: python -m tests.test_manual_entry_parser [iterations]
+
+EXAMPLES = {
+    "שילמתי 2000 לצלם": ('צלם', 2000.0, 'צילום', 'full'),
+    "5000 מקדמה לאולם": ('אולם', 5000.0, 'אולם', 'advance'),
+    "עלה לנו 1500 בחנות פרחים": ('חנות פרחים', 1500.0, 'עיצוב', 'full'),
+    "שילמנו 3,500 ש\"ח עבור הדיג׳יי": ('הדיג׳יי', 3500.0, 'מוזיקה', 'full'),
+    "₪1200 לקייטרינג יתרה": ('קייטרינג', 1200.0, 'מזון', 'final'),
+    "תשלום סופי 8000 לאולמי הגן": ('אולמי הגן', 8000.0, 'אולם', 'final'),
+    "שמלה 4500 שקל": ('שמלה', 4500.0, 'לבוש', 'full'),
+    "2000 ביטוח": ('ביטוח', 2000.0, 'אחר', 'full'),
+    "שילמתי 3000 מאפיית לחם": ('מאפיית לחם', 3000.0, 'אחר', 'full'),
+    "ברוך הצלם 2000": ('ברוך הצלם', 2000.0, 'צילום', 'full'),
+    "מאקס 300 ש\"ח": ('מאקס', 300.0, 'אחר', 'full'),
+    "שילמתי 300 במאקס": ('מאקס', 300.0, 'אחר', 'full'),
+    "תודה רבה": None,
+    "שילמתי לצלם": None,
+}
+
+FUZZ_WORDS = [
+    'שילמתי', 'שילמנו', 'עלה', 'לנו', 'לצלם', 'אולם', 'מקדמה', 'סופי', 'ש"ח', '₪', 'עבור',
+    'הדיג׳יי', 'פרחים', 'DJ', 'יתרה', 'בגן', 'מ', 'ל', 'של', '2,000', '1500', '12.5', '0',
+    '99999999999999999999', '😀', '"', '-', ',', 'abc', '‏', '\n'
+]
+
+def fuzz_messages(iterations: int):
+    rng = random.Random(2024)
+    for _ in range(iterations):
+        if rng.random() < 0.2:
+            yield ''.join(chr(rng.randint(32, 0x05FF)) for _ in range(rng.randint(0, 40)))
+        else:
+            yield ' '.join(rng.choice(FUZZ_WORDS) for _ in range(rng.randint(0, 8)))
+
+@pytest.mark.parametrize("message, expected", list(EXAMPLES.items()))
+def test_examples(message, expected):
+    result = parse_manual_entry(message)
+    actual = (result['vendor'], result['amount'], result['category'], result['payment_type']) if result else None
+    assert actual == expected
+
+@pytest.mark.parametrize("word, expected", [
+    ("לצלם", "צלם"),
+    ("בחנות", "חנות"),
+    ("לאולמי", "אולמי"),
+    ("במאקס", "מאקס"),
+    # אות ראשונה שהיא חלק מהשם
+    ("ביטוח", None),
+    ("מאפיית", None),
+    ("ברוך", None),
+    ("מאקס", None),
+])
+def test_strip_prefix_only_before_known_words(word, expected):
+    assert _strip_prefix(word) == expected
+
+def test_fuzz_messages_never_crash_or_return_invalid_results():
+    for message in fuzz_messages(2000):
+        result = parse_manual_entry(message)
+        if result:
+            assert result['amount'] > 0 and result['vendor'], message
+            assert result['category'] in CATEGORY_LIST, message
+            assert result['payment_type'] in ('full', 'advance', 'final'), message
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    messages = list(EXAMPLES)
+    # הטוב מבין 5 ריצות, לנטרול רעש
+    total = min(timeit.repeat(lambda: [parse_manual_entry(m) for m in messages], number=iterations, repeat=5))
+    print(f"parse_manual_entry: {total / (iterations * len(messages)) * 1e6:.2f} µs/message")
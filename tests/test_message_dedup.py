@@ -0,0 +1,53 @@
+import pytest
+
+from message_dedup import MessageDeduplicator
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "jobs.db")
+
+def test_message_is_marked_only_after_success(path):
+    dedup = MessageDeduplicator(path=path)
+
+    assert dedup.begin("m1")
+    # משלוח חוזר בזמן העיבוד
+    assert not dedup.begin("m1")
+
+    # הטיפול נכשל - הניסיון הבא מעובד
+    dedup.release("m1")
+    assert not dedup.is_duplicate("m1")
+    assert dedup.begin("m1")
+
+    dedup.complete("m1")
+    assert dedup.is_duplicate("m1")
+    assert not dedup.begin("m1")
+    dedup.close()
+
+def test_processed_ids_survive_restart(path):
+    dedup = MessageDeduplicator(path=path)
+    assert dedup.begin("m1")
+    dedup.complete("m1")
+    dedup.close()
+
+    restarted = MessageDeduplicator(path=path)
+    assert restarted.is_duplicate("m1")
+    assert not restarted.begin("m1")
+    assert restarted.begin("m2")
+    restarted.close()
+
+def test_expired_ids_are_processed_again(path, monkeypatch):
+    dedup = MessageDeduplicator(ttl_seconds=60, path=path)
+    dedup.begin("m1")
+    dedup.complete("m1")
+
+    import message_dedup
+    now = message_dedup.time.time()
+    monkeypatch.setattr(message_dedup.time, "time", lambda: now + 120)
+    assert not dedup.is_duplicate("m1")
+    dedup.close()
+
+def test_messages_without_id_are_never_duplicates():
+    dedup = MessageDeduplicator(path="")
+    assert dedup.begin(None)
+    dedup.complete(None)
+    assert not dedup.is_duplicate(None)
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from ai_analyzer import AIAnalyzer
+from config import DEDUP_SETTINGS, RECEIPT_BATCH_SETTINGS
+from job_queue import RetryableJobError
+from webhook_handler import WebhookHandler
+
+GROUP = "120363000000000000@g.us"
+
+@pytest.fixture
+def handler(db, monkeypatch):
+    monkeypatch.setitem(DEDUP_SETTINGS, "path", "")
+    monkeypatch.setitem(RECEIPT_BATCH_SETTINGS, "enabled", True)
+    monkeypatch.setitem(RECEIPT_BATCH_SETTINGS, "window_seconds", 0.05)
+    handler = WebhookHandler(db, AIAnalyzer(), green_api=None)
+    handler.sent = []
+
+    async def send_message(chat_id, message):
+        handler.sent.append(message)
+        return True
+
+    async def get_group_info(chat_id):
+        return {"whatsapp_group_id": chat_id}
+
+    async def analyze_receipt(message_data, group_id):
+        # downloadUrl "bad" - הורדה שנכשלה
+        url = message_data["imageMessage"]["downloadUrl"]
+        if url == "bad":
+            return {"status": "download_failed"}
+        receipt = {"vendor": url, "amount": 100, "category": "אחר", "payment_type": "full"}
+        return {"status": "analyzed", "receipt_data": receipt, "fingerprint": (url, None)}
+
+    handler._send_message = send_message
+    handler._get_group_info = get_group_info
+    handler._analyze_receipt = analyze_receipt
+    yield handler
+    handler.deduplicator.close()
+
+def image(message_id, url):
+    return {
+        "idMessage": message_id,
+        "senderData": {"chatId": GROUP, "sender": "972501234567@c.us"},
+        "messageData": {"typeMessage": "imageMessage", "imageMessage": {"downloadUrl": url}},
+    }
+
+async def test_batched_image_is_acknowledged_only_after_the_album_is_saved(handler, db):
+    first = await handler.process_webhook(image("m1", "אולם"), defer_batches=True)
+    second = await handler.process_webhook(image("m2", "צלם"), defer_batches=True)
+    assert first["status"] == second["status"] == "receipt_batched"
+
+    # עד שהאלבום נשמר - משלוח חוזר עדיין יעובד
+    assert not handler.deduplicator.is_duplicate("m1")
+
+    results = await asyncio.gather(first["pending"], second["pending"])
+    assert [r["status"] for r in results] == ["receipt_saved", "receipt_saved"]
+    assert db.get_expense(results[0]["expense_data"]["expense_id"])
+    assert handler.deduplicator.is_duplicate("m1")
+    assert len(handler.sent) == 1
+
+async def test_failed_album_save_retries_every_image(handler, db, monkeypatch):
+    async def save_fails(expenses):
+        return False
+    monkeypatch.setattr(db, "save_expenses_bulk_async", save_fails)
+
+    first = await handler.process_webhook(image("m1", "אולם"), defer_batches=True)
+    second = await handler.process_webhook(image("m2", "צלם"), defer_batches=True)
+
+    for result in (first, second):
+        with pytest.raises(RetryableJobError):
+            await result["pending"]
+    # ניסיון חוזר מהתור לא נחסם כהודעה כפולה
+    assert not handler.deduplicator.is_duplicate("m1")
+    assert handler.sent == [handler.messages.receipts_save_failed()]
+
+async def test_download_failure_in_album_retries_only_that_image(handler):
+    good = await handler.process_webhook(image("m1", "אולם"), defer_batches=True)
+    bad = await handler.process_webhook(image("m2", "bad"), defer_batches=True)
+
+    assert (await good["pending"])["status"] == "receipt_saved"
+    with pytest.raises(RetryableJobError):
+        await bad["pending"]
+
+async def test_without_queue_the_webhook_waits_for_the_album(handler):
+    result = await handler.process_webhook(image("m1", "אולם"))
+    assert result["status"] == "receipt_saved"
+    assert handler.deduplicator.is_duplicate("m1")
@@ -0,0 +1,67 @@
+import io
+
+import pytest
+
+from config import RECEIPT_CACHE_SETTINGS
+from receipt_cache import ReceiptAnalysisCache, perceptual_hash
+
+Image = pytest.importorskip("PIL.Image")
+
+def receipt_image(quality: int = 90) -> bytes:
+    # "קבלה" סינתטית - אותו תוכן, דחיסה שונה = bytes שונים ו-dHash קרוב
+    image = Image.new("L", (120, 200), 255)
+    for y in range(20, 180, 16):
+        for x in range(10, 10 + (y * 7) % 100):
+            image.putpixel((x, y), 0)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+ANALYSIS = {"vendor": "צלם יוסי", "amount": 3000, "confidence": 90}
+
+def test_exact_image_reuses_analysis_and_expense_ids():
+    cache = ReceiptAnalysisCache(disk_path="")
+    fingerprint = cache.fingerprint(receipt_image())
+
+    assert cache.get(fingerprint) is None
+    cache.put(fingerprint, ANALYSIS)
+    cache.mark_saved(fingerprint, "g1", "EXP_1")
+
+    hit = cache.get(cache.fingerprint(receipt_image()))
+    assert hit == {"analysis": ANALYSIS, "expense_ids": {"g1": "EXP_1"}}
+
+def test_similar_image_is_not_reused_by_default():
+    cache = ReceiptAnalysisCache(disk_path="")
+    original = cache.fingerprint(receipt_image(quality=90))
+    recompressed = cache.fingerprint(receipt_image(quality=60))
+
+    assert original[0] != recompressed[0]
+    assert bin(original[1] ^ recompressed[1]).count("1") <= cache.max_distance
+
+    cache.put(original, ANALYSIS)
+    cache.mark_saved(original, "g1", "EXP_1")
+    assert cache.get(recompressed) is None
+
+def test_similar_image_match_can_be_enabled(monkeypatch):
+    monkeypatch.setitem(RECEIPT_CACHE_SETTINGS, "phash_match_enabled", True)
+    cache = ReceiptAnalysisCache(disk_path="")
+    cache.put(cache.fingerprint(receipt_image(quality=90)), ANALYSIS)
+
+    hit = cache.get(cache.fingerprint(receipt_image(quality=60)))
+    assert hit["analysis"] == ANALYSIS
+
+def test_disk_layer_survives_restart(tmp_path):
+    path = str(tmp_path / "receipts.db")
+    fingerprint = ReceiptAnalysisCache.fingerprint(receipt_image())
+
+    cache = ReceiptAnalysisCache(disk_path=path)
+    cache.put(fingerprint, ANALYSIS)
+    cache.mark_saved(fingerprint, "g1", "EXP_1")
+    cache.close()
+
+    reopened = ReceiptAnalysisCache(disk_path=path)
+    assert reopened.get(fingerprint)["expense_ids"] == {"g1": "EXP_1"}
+    reopened.close()
+
+def test_perceptual_hash_of_invalid_bytes_is_none():
+    assert perceptual_hash(b"not an image") is None
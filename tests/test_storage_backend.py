@@ -0,0 +1,135 @@
+import pytest
+
+from config import EXPENSE_HEADERS, STORAGE_SETTINGS
+from storage_backend import SQLiteBackend, SheetsBackend, SheetsExporter
+
+def expense_row(expense_id, amount="100", group_id="g1"):
+    row = [""] * len(EXPENSE_HEADERS)
+    row[EXPENSE_HEADERS.index("expense_id")] = expense_id
+    row[EXPENSE_HEADERS.index("amount")] = amount
+    row[EXPENSE_HEADERS.index("group_id")] = group_id
+    return row
+
+@pytest.fixture
+def sheets(tmp_path):
+    # גיליון מדומה - אותו ממשק טבלאי, מגובה ב-SQLite נפרד
+    sheets = SQLiteBackend(str(tmp_path / "sheets.db"))
+    yield sheets
+    sheets.close()
+
+def test_append_returns_sheet_style_row_numbers(backend):
+    assert backend.read_table("expenses") == [EXPENSE_HEADERS]
+    assert backend.append_rows("expenses", [expense_row("a"), expense_row("b")]) == 2
+    assert backend.append_rows("expenses", [expense_row("c")]) == 4
+
+    rows = backend.read_table("expenses")
+    assert [row[0] for row in rows[1:]] == ["a", "b", "c"]
+
+def test_update_find_and_version(backend):
+    backend.append_rows("expenses", [expense_row("a"), expense_row("b", group_id="g2")])
+    version = backend.get_table_version("expenses")
+
+    assert backend.update_rows("expenses", {3: expense_row("b", amount="250", group_id="g2")}) == [3]
+    assert backend.get_table_version("expenses") != version
+    assert backend.get_table_version("couples") == "0"
+
+    [(row_number, row)] = backend.find_rows("expenses", "group_id", "g2")
+    assert row_number == 3
+    assert row[EXPENSE_HEADERS.index("amount")] == "250"
+
+def test_short_rows_are_padded(backend):
+    backend.append_rows("expenses", [["short"]])
+    row = backend.read_table("expenses")[1]
+    assert len(row) == len(EXPENSE_HEADERS)
+    assert row[0] == "short"
+
+def test_replace_table_and_is_empty(backend):
+    assert backend.is_empty()
+    backend.append_rows("expenses", [expense_row("a"), expense_row("b")])
+    assert not backend.is_empty()
+
+    backend.replace_table("expenses", [expense_row("c")])
+    assert [row[0] for row in backend.read_table("expenses")[1:]] == ["c"]
+    assert backend.append_rows("expenses", [expense_row("d")]) == 3
+
+def test_export_mirrors_only_changed_tables(backend, sheets):
+    exporter = SheetsExporter(backend, sheets)
+    backend.append_rows("expenses", [expense_row("a")])
+
+    assert exporter.export() >= 1
+    assert sheets.read_table("expenses")[1][0] == "a"
+
+    # שום דבר לא השתנה - אין ייצוא נוסף
+    assert exporter.export() == 0
+
+    backend.append_rows("expenses", [expense_row("b")])
+    assert exporter.export() == 1
+    assert [row[0] for row in sheets.read_table("expenses")[1:]] == ["a", "b"]
+
+def test_seed_copies_existing_sheets(backend, sheets):
+    sheets.append_rows("expenses", [expense_row("old1"), expense_row("old2")])
+    exporter = SheetsExporter(backend, sheets)
+
+    assert exporter.seed() == 2
+    assert [row[0] for row in backend.read_table("expenses")[1:]] == ["old1", "old2"]
+
+    # הגיליון כבר זהה - הייצוא הבא לא כותב כלום
+    assert exporter.export() == 0
+
+def test_export_refuses_to_wipe_non_empty_sheet(backend, sheets, monkeypatch):
+    sheets.append_rows("expenses", [expense_row("keep")])
+    exporter = SheetsExporter(backend, sheets)
+
+    exporter.export()
+    assert [row[0] for row in sheets.read_table("expenses")[1:]] == ["keep"]
+
+    monkeypatch.setitem(STORAGE_SETTINGS, "sheets_export_allow_empty", True)
+    exporter.export()
+    assert sheets.read_table("expenses") == [EXPENSE_HEADERS]
+
+class FakeDrive:
+    """files().get(...).execute() מחזיר modifiedTime נשלט מהבדיקה"""
+
+    def __init__(self):
+        self.modified = "t1"
+
+    def files(self):
+        return self
+
+    def get(self, **kwargs):
+        return self
+
+    def execute(self, http=None):
+        return {"modifiedTime": self.modified}
+
+def test_sheets_version_reads_the_sheet_only_after_the_file_changed(backend):
+    # SheetsBackend בלי חיבור - הקריאות מופנות לטבלאות מקומיות
+    sheets = SheetsBackend.__new__(SheetsBackend)
+    sheets.drive = FakeDrive()
+    sheets._get_http = lambda: None
+    sheets._table_versions = {}
+    reads = []
+    sheets.read_table = lambda table: reads.append(table) or backend.read_table(table)
+
+    version = sheets.get_table_version("couples")
+    assert sheets.get_table_version("couples") == version
+    assert reads == ["couples"]
+
+    # כתיבה לגיליון אחר מזיזה את modifiedTime אבל לא את גרסת couples
+    backend.append_rows("expenses", [expense_row("a")])
+    sheets.drive.modified = "t2"
+    assert sheets.get_table_version("couples") == version
+    assert len(reads) == 2
+
+    backend.append_rows("couples", [["050", "", "g1", "", "", "", "active"]])
+    sheets.drive.modified = "t3"
+    assert sheets.get_table_version("couples") != version
+
+def test_delete_rows_shifts_the_rows_below(backend):
+    backend.append_rows("expenses", [expense_row(eid) for eid in "abcde"])
+
+    assert backend.delete_rows("expenses", [4, 2, 99]) == 2
+    assert [row[0] for row in backend.read_table("expenses")[1:]] == ["b", "d", "e"]
+    assert backend.read_rows("expenses", [2, 4, 5])[4][0] == "e"
+    assert backend.read_rows("expenses", [5]) == {5: []}
+    assert backend.append_rows("expenses", [expense_row("f")]) == 5
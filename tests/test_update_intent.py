@@ -0,0 +1,56 @@
+import pytest
+
+from update_intent import classify_update_intent, UPDATE, NOT_UPDATE, AMBIGUOUS
+
+@pytest.mark.parametrize("message, update_type, new_value", [
+    ("2500 לא 2000", "amount", "2500"),
+    ("לא 2000, 2,500", "amount", "2500"),
+    ("הסכום הוא 2500", "amount", "2500"),
+    ("תתקן ל-2500", "amount", "2500"),
+    ("הספק הוא רמי לוי", "vendor", "רמי לוי"),
+    ("ספק: רמי לוי", "vendor", "רמי לוי"),
+    ("זה בגדים לא צילום", "category", "לבוש"),
+    ("לבוש לא צילום", "category", "לבוש"),
+    ("בעצם עיצוב", "category", "עיצוב"),
+    ("זה לבוש", "category", "לבוש"),
+    ("קטגוריה בגדים", "category", "לבוש"),
+    ("תשנה ללבוש", "category", "לבוש"),
+    ("לבוש", "category", "לבוש"),
+    ("מחק", "delete", None),
+    ("מחק את זה", "delete", None),
+    ("טעות, תבטל", "delete", None),
+    ("תמחקי בבקשה", "delete", None),
+])
+def test_clear_updates_are_decided_locally(message, update_type, new_value):
+    verdict, update = classify_update_intent(message)
+    assert verdict == UPDATE
+    assert update["update_type"] == update_type
+    assert update["new_value"] == new_value
+
+@pytest.mark.parametrize("message", [
+    "תודה",
+    "מעולה 👍",
+    "זה מעולה",
+    "שילמתי 2000 לצלם",
+    "5000 מקדמה לאולם",
+    "",
+])
+def test_chat_and_new_expenses_are_not_updates(message):
+    assert classify_update_intent(message) == (NOT_UPDATE, None)
+
+@pytest.mark.parametrize("message", [
+    # שם ספק בלי אוגד/נקודתיים
+    "ספק מעולה",
+    "הספק היה ממש נחמד",
+    # ביטוי שלא כל מילותיו הן קטגוריה
+    "זה יין טוב",
+    "זה בר מצווה",
+    "זה מתחם מדהים",
+    # מילת מפתח של ספק בלי ניגוד ("לא X") אינה שם קטגוריה
+    "זה שעון",
+    # מחיקה שאינה מתייחסת לקבלה האחרונה
+    "בטל את ההזמנה של הצלם",
+    "זה רמי לוי לא מקס",
+])
+def test_unclear_messages_go_to_the_llm(message):
+    assert classify_update_intent(message) == (AMBIGUOUS, None)
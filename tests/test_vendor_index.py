@@ -0,0 +1,57 @@
+import pytest
+
+from config import VENDORS_HEADERS
+from vendor_index import VendorIndex, normalize_vendor_name
+
+def vendor_row(name, category, confidence="85", last_seen="2026-01-01"):
+    return [name, category, confidence, last_seen, "g1", "2026-01-01"]
+
+def make_index(*rows):
+    return VendorIndex(lambda: [VENDORS_HEADERS] + list(rows))
+
+@pytest.mark.parametrize("name, expected", [
+    ("צַלָּם", "צלם"),
+    ('אולמי הגן בע"מ', "אולמי הגן"),
+    ("אולמי הגן בע״מ", "אולמי הגן"),
+    ("Studio-Max Ltd.", "studio max"),
+    ("  פרחי   השרון!  ", "פרחי השרון"),
+    ("", ""),
+])
+def test_normalize_vendor_name(name, expected):
+    assert normalize_vendor_name(name) == expected
+
+def test_exact_lookup_ignores_spelling_noise():
+    index = make_index(vendor_row('אולמי הגן בע"מ', "אולם"))
+    assert index.get_category("אולמי הגן") == "אולם"
+    assert index.get_exact("אוּלמי הגן") is not None
+
+def test_fuzzy_lookup_and_contained_names():
+    index = make_index(vendor_row("סטודיו צילום יוסי כהן", "צילום"), vendor_row("פרחי השרון", "עיצוב"))
+
+    assert index.get_category("פרחי השרונן") == "עיצוב"
+    # שם שמוכל במלואו בשם הרשום
+    assert index.get_category("יוסי כהן") == "צילום"
+    assert index.lookup("רמי לוי") is None
+
+def test_duplicate_rows_keep_the_highest_ranked_vendor():
+    index = make_index(
+        vendor_row("הצלם", "צילום", confidence="95"),
+        vendor_row("הצלם", "אחר", confidence="60"),
+        vendor_row("להקת הלילה", "מוזיקה", confidence="80", last_seen="2026-01-01"),
+        vendor_row("להקת הלילה", "אחר", confidence="80", last_seen="2026-03-01"),
+    )
+
+    assert index.get_category("הצלם") == "צילום"
+    # ביטחון זהה - העדכני יותר גובר
+    assert index.get_category("להקת הלילה") == "אחר"
+    assert len(index) == 2
+    assert index.duplicate_rows() == 2
+
+def test_add_replaces_vendor_in_place():
+    index = make_index(vendor_row("הצלם", "צילום"))
+    index.get_category("הצלם")
+
+    index.add(dict(zip(VENDORS_HEADERS, vendor_row("הצלם", "וידאו", confidence="50"))))
+
+    assert index.get_category("הצלם") == "וידאו"
+    assert index.get_row_number("הצלם") == 2
@@ -0,0 +1,73 @@
+import pytest
+
+from config import WRITE_BEHIND_SETTINGS
+from database_manager import DatabaseManager
+
+def expense(expense_id, amount):
+    return {'expense_id': expense_id, 'amount': amount, 'vendor': 'אולם', 'date': '2026-01-01',
+            'category': 'אולם', 'group_id': 'g1', 'payment_type': 'full'}
+
+@pytest.fixture
+def open_db(backend, tmp_path, monkeypatch):
+    monkeypatch.setitem(WRITE_BEHIND_SETTINGS, "enabled", True)
+    monkeypatch.setitem(WRITE_BEHIND_SETTINGS, "journal_path", str(tmp_path / "journal.db"))
+    return lambda: DatabaseManager(backend)
+
+def crash(db):
+    """סגירה בלי flush - כמו קריסה של התהליך"""
+    db._executor.shutdown(wait=True)
+    db.journal.close()
+
+def expense_ids(backend):
+    return [row[0] for row in backend.read_table("expenses")[1:]]
+
+def test_save_is_journaled_until_flush(open_db, backend):
+    db = open_db()
+    assert db.save_expense(expense("a", 100))
+
+    assert expense_ids(backend) == []
+    assert db.get_expense("a")['amount'] == '100'
+    assert db.journal.count() == 1
+
+    assert db.flush_pending_writes() == 1
+    assert expense_ids(backend) == ["a"]
+    assert db.journal.count() == 0
+    db.close()
+
+def test_update_before_flush_is_merged_into_the_new_row(open_db, backend):
+    db = open_db()
+    db.save_expense(expense("a", 100))
+    assert db.update_expense("a", {'amount': 150})
+
+    assert db.flush_pending_writes() == 2
+    assert backend.read_table("expenses")[1][1] == "150"
+    db.close()
+
+def test_pending_writes_are_replayed_after_crash(open_db, backend):
+    db = open_db()
+    db.save_expense(expense("a", 100))
+    db.save_expense(expense("b", 200))
+    crash(db)
+
+    db = open_db()
+    # היומן מוחל על המאגר לפני שהגיליון עודכן
+    assert db.get_expense("b")['amount'] == '200'
+    assert db.journal.count() == 2
+
+    assert db.flush_pending_writes() == 2
+    assert expense_ids(backend) == ["a", "b"]
+    db.close()
+
+def test_append_written_before_crash_is_not_duplicated(open_db, backend, monkeypatch):
+    db = open_db()
+    db.save_expense(expense("a", 100))
+    # השורה נכתבה אבל הקריסה הייתה לפני המחיקה מהיומן
+    monkeypatch.setattr(db.journal, "remove", lambda entry_ids: None)
+    db.flush_pending_writes()
+    crash(db)
+
+    db = open_db()
+    assert db.flush_pending_writes() == 1
+    assert expense_ids(backend) == ["a"]
+    assert db.journal.count() == 0
+    db.close()
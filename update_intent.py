@@ -0,0 +1,178 @@
+import re
+import logging
+from typing import Dict, Optional, Tuple
+from config import CATEGORY_LIST
+from vendor_classifier import VENDOR_KEYWORDS
+
+logger = logging.getLogger(__name__)
+
+# תוצאות הסיווג המקומי
+UPDATE = "update"            # בקשת עדכון ברורה - אין צורך ב-AI
+NOT_UPDATE = "not_update"    # הודעה רגילה / הוצאה חדשה - אין צורך ב-AI
+AMBIGUOUS = "ambiguous"      # רק כאן נשלחת קריאה ל-AI
+
+RULE_CONFIDENCE = 90
+
+_NUMBER = r'(\d[\d,]*(?:\.\d+)?)'
+_CURRENCY = r'(?:\s*(?:ש"ח|ש״ח|שח|₪|שקלים|שקל))?'
+_NOT = r'(?:ו?לא|במקום)'
+
+# תתקן/תקני/שנה/תשני...
+_FIX_VERB = r'(?:ת?תקן|ת?תקני|ת?תקנו|תקן|תקני|תקנו|ת?שנה|ת?שני|ת?שנו)'
+
+_DIGIT = re.compile(r'\d')
+_EDGE_PUNCTUATION = re.compile(r'^[\s.,!?:;\-–"\']+|[\s.,!?:;\-–"\']+$')
+
+# מחיקה: מחק/מחקי/תמחק/למחוק/בטל/תבטלי/לבטל...
+_DELETE_VERB = r'(?:ת?מחק[יו]?|למחוק|ת?בטל[יו]?|לבטל|delete|cancel)'
+_DELETE = re.compile(rf'(?:^|\s){_DELETE_VERB}(?=\s|$)', re.IGNORECASE)
+
+# מחיקה ודאית - רק בצורה קצרה שמתייחסת לקבלה האחרונה ("מחק", "טעות, תבטל", "מחק את זה")
+_DELETE_COMMAND = re.compile(
+    rf'^(?:טעות\s*,?\s*)?{_DELETE_VERB}'
+    r'(?:\s+(?:את\s+)?(?:זה|זו|הזה|הזאת|אותו|אותה|ההוצאה|הקבלה)(?:\s+(?:האחרון|האחרונה))?)?'
+    r'(?:\s*,?\s*בבקשה)?$',
+    re.IGNORECASE
+)
+
+# מילים שמסמנות תיקון - בלעדיהן (ובלי מספרים) ההודעה היא צ'אט רגיל
+_CORRECTION_CUE = re.compile(
+    rf'(?:^|\s)(?:במקום|טעות|{_FIX_VERB}|בעצם|צריך להיות|ה?סכום|ה?מחיר|ה?ספק|ה?קטגוריה|זה|זו)(?=\s|$)'
+    r'|(?:^|\s)ו?לא\s+\d'  # "לא" מסמן תיקון רק לפני מספר ("ולא 2000")
+)
+
+# תגובות צ'אט נפוצות - "זה מעולה", "ממש טוב", "סבבה"
+_SMALL_TALK = {
+    'זה', 'זו', 'ממש', 'כל', 'כך', 'נורא', 'מאוד', 'סופר', 'באמת', 'לגמרי',
+    'מעולה', 'טוב', 'בסדר', 'נכון', 'מדהים', 'מדהימה', 'סבבה', 'יפה', 'אחלה', 'מושלם',
+    'מושלמת', 'תודה', 'רבה', 'וואו', 'יופי', 'נהדר', 'חמוד', 'צודק', 'צודקת'
+}
+
+# פעלים של הוצאה חדשה - "שילמתי 2000 לצלם" אינו תיקון של הקבלה הקודמת
+_NEW_EXPENSE = re.compile(r'(?:^|\s)(?:שילמתי|שילמנו|קניתי|קנינו|הזמנתי|הזמנו|עלה|עלתה|עלו)(?=\s|$)')
+
+_AMOUNT_PATTERNS = [
+    # "2500 לא 2000" / "2500 ש"ח במקום 2000" - הערך החדש ראשון
+    (re.compile(rf'^{_NUMBER}{_CURRENCY}\s*,?\s*{_NOT}\s+{_NUMBER}{_CURRENCY}$'), 1),
+    # "לא 2000, 2500" / "לא 2000 אלא 2500" - הערך החדש שני
+    (re.compile(rf'^{_NOT}\s+{_NUMBER}{_CURRENCY}\s*(?:,|אלא|-)\s*{_NUMBER}{_CURRENCY}$'), 2),
+    # "הסכום הוא 2500" / "המחיר צריך להיות 2500"
+    (re.compile(rf'^(?:ה?סכום|ה?מחיר)\s*(?:הוא|היה|זה|צריך להיות|:|-)?\s*{_NUMBER}{_CURRENCY}$'), 1),
+    # "תתקן ל-2500" / "שנה את הסכום ל 2500"
+    (re.compile(rf'^{_FIX_VERB}\s+(?:את\s+)?(?:ה?סכום\s+)?(?:ל-?\s*)?{_NUMBER}{_CURRENCY}$'), 1),
+]
+
+# רק עם אוגד או נקודתיים ("הספק הוא X", "ספק: X") - "ספק מעולה" הוא צ'אט
+_VENDOR_PATTERN = re.compile(r'^(?:ה?ספק|שם הספק)(?:\s+(?:הוא|זה)\s+|\s*:\s*)(.+)$')
+
+# (תבנית, האם מילות מפתח מספיקות גם בלי "לא X") - "זה שעון" בלי ניגוד הוא צ'אט,
+# ולכן אחרי "זה"/"בעצם" נדרש שם קטגוריה מפורש
+_CATEGORY_PATTERNS = [
+    # "קטגוריה לבוש" / "הקטגוריה היא מוזיקה"
+    (re.compile(r'^ה?קטגוריה\s*(?:היא|זה|:|-)?\s*(?P<new>.+?)(?:\s+ו?לא\s+(?P<old>.+))?$'), True),
+    # "תשנה ללבוש" / "תתקן לבגדים"
+    (re.compile(rf'^{_FIX_VERB}\s+ל-?\s*(?P<new>.+?)(?:\s+ו?לא\s+(?P<old>.+))?$'), True),
+    # "זה בגדים לא צילום" / "בעצם עיצוב"
+    (re.compile(r'^(?:זה|זו|בעצם)\s*(?P<new>.+?)(?:\s+ו?לא\s+(?P<old>.+))?$'), False),
+    # "לבוש לא צילום"
+    (re.compile(r'^(?P<new>.+?)\s+ו?לא\s+(?P<old>.+)$'), True),
+]
+
+# מילת מפתח (באותיות קטנות) -> קטגוריה, כולל שמות הקטגוריות עצמן
+_CATEGORY_WORDS: Dict[str, str] = {
+    keyword.lower(): category for category, keywords in VENDOR_KEYWORDS.items() for keyword in keywords
+}
+_CATEGORY_WORDS.update({category: category for category in CATEGORY_LIST})
+
+_MAX_PHRASE_WORDS = 3
+
+def _resolve_category(phrase: str, names_only: bool = False) -> Optional[str]:
+    """ממפה ביטוי קצר ("בגדים", "לצלם", "אקססוריז") לקטגוריה אחת, או None.
+
+    כל מילה בביטוי חייבת להתמפות ("זה יין טוב" אינו בקשת עדכון).
+    names_only - רק שמות הקטגוריות עצמן, בלי מילות מפתח של ספקים.
+    """
+    words = phrase.lower().split()
+    if not words or len(words) > _MAX_PHRASE_WORDS:
+        return None
+
+    found = set()
+    for word in words:
+        # אות שימוש בתחילת המילה (ה/ל/ב/ו) - "לצלם", "הבגדים"
+        for candidate in (word, word[1:] if len(word) > 2 and word[0] in 'הלבו' else None):
+            if not candidate:
+                continue
+            category = candidate if candidate in CATEGORY_LIST else None
+            if category is None and not names_only:
+                category = _CATEGORY_WORDS.get(candidate)
+            if category:
+                found.add(category)
+                break
+        else:
+            return None
+
+    return found.pop() if len(found) == 1 else None
+
+def _update(update_type: str, new_value) -> Tuple[str, Dict]:
+    return UPDATE, {
+        "is_update": True,
+        "update_type": update_type,
+        "new_value": new_value,
+        "confidence": RULE_CONFIDENCE
+    }
+
+def classify_update_intent(message: str) -> Tuple[str, Optional[Dict]]:
+    """מסווג הודעה מקומית: (UPDATE, בקשה) / (NOT_UPDATE, None) / (AMBIGUOUS, None)"""
+    text = _EDGE_PUNCTUATION.sub('', message or '')
+    if not text:
+        return NOT_UPDATE, None
+
+    has_digits = bool(_DIGIT.search(text))
+    has_cue = bool(_CORRECTION_CUE.search(text))
+    words = text.split()
+
+    # מחיקה - רק בצורה קצרה ומעוגנת ("מחק את זה", "טעות, תבטל"); "בטל את ההזמנה של הצלם" - ל-AI
+    if _DELETE_COMMAND.match(text):
+        return _update("delete", None)
+    if _DELETE.search(text):
+        return AMBIGUOUS, None
+
+    for pattern, group in _AMOUNT_PATTERNS:
+        match = pattern.match(text)
+        if match:
+            return _update("amount", match.group(group).replace(',', ''))
+
+    if not has_digits:
+        for pattern, keywords_allowed in _CATEGORY_PATTERNS:
+            match = pattern.match(text)
+            if not match:
+                continue
+            old = match.group('old')
+            new_category = _resolve_category(match.group('new'), names_only=not (keywords_allowed or old))
+            if new_category and (old is None or _resolve_category(old) != new_category):
+                return _update("category", new_category)
+
+        # קטגוריה בלבד ("לבוש")
+        if len(words) == 1 and text in CATEGORY_LIST:
+            return _update("category", text)
+
+    match = _VENDOR_PATTERN.match(text)
+    if match and len(match.group(1).split()) <= 5:
+        return _update("vendor", match.group(1).strip())
+
+    if _NEW_EXPENSE.search(text) and not has_cue:
+        # הוצאה חדשה - עוברת לפרסור הידני
+        return NOT_UPDATE, None
+
+    if not has_digits and not has_cue:
+        # "תודה", "לא יודע", "מעולה 👍" וכו'
+        return NOT_UPDATE, None
+
+    if not has_digits and all(_EDGE_PUNCTUATION.sub('', word) in _SMALL_TALK for word in words):
+        return NOT_UPDATE, None
+
+    if has_digits and not has_cue and len(words) > 1:
+        # "5000 מקדמה לאולם" - פורמט של הוצאה ידנית חדשה
+        return NOT_UPDATE, None
+
+    return AMBIGUOUS, None
@@ -14,16 +14,19 @@ class UserDashboard:
     def __init__(self, db: DatabaseManager):
         self.db = db
     
-    async def get_dashboard_html(self, group_id: str) -> str:
+    async def get_dashboard_html(self, group_id: str, couple_info: Optional[Dict] = None) -> str:
         """מחזיר HTML מלא לדשבורד המשתמש"""
         try:
-            # טעינת נתונים
-            dashboard_data = await self.get_dashboard_data(group_id)
-            couple_info = self.db.get_couple_by_group_id(group_id)
+            # פרטי הזוג מועברים מהקורא אם כבר נטענו
+            if couple_info is None:
+                couple_info = await self.db.get_couple_by_group_id_async(group_id)
             
             if not couple_info:
                 return self._error_html("קבוצה לא נמצאה")
             
+            # טעינת נתונים
+            dashboard_data = await self.get_dashboard_data(group_id, couple_info)
+            
             # בדיקה אם יש נתונים
             if not dashboard_data.get('expenses'):
                 return self._empty_dashboard_html(group_id, couple_info)
@@ -34,12 +37,13 @@ class UserDashboard:
             logger.error(f"Dashboard HTML generation failed: {e}")
             return self._error_html(f"שגיאה בטעינת הדשבורד: {str(e)}")
     
-    async def get_dashboard_data(self, group_id: str) -> Dict:
+    async def get_dashboard_data(self, group_id: str, couple_info: Optional[Dict] = None) -> Dict:
         """מחזיר נתוני דשבורד כJSON"""
         try:
             # קבלת הוצאות
-            expenses = self.db.get_expenses_by_group(group_id, include_deleted=False)
-            couple_info = self.db.get_couple_by_group_id(group_id)
+            expenses = await self.db.get_expenses_by_group_async(group_id, include_deleted=False)
+            if couple_info is None:
+                couple_info = await self.db.get_couple_by_group_id_async(group_id)
             
             if not couple_info:
                 raise ValueError("Group not found")
@@ -0,0 +1,121 @@
+import re
+import logging
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+from config import CATEGORY_LIST
+
+logger = logging.getLogger(__name__)
+
+# מילות מפתח בשם הספק לפי קטגוריה
+VENDOR_KEYWORDS = {
+    'אולם': ['אולם', 'גן אירועים', 'מתחם', 'אולמי', 'גני'],
+    'מזון': ['קייטרינג', 'מסעדה', 'שף', 'מטבח', 'אוכל', 'בר', 'משקאות', 'יין', 'עוגה', 'קונדיטור'],
+    'צילום': ['צלם', 'צילום', 'וידאו', 'סטודיו', 'סטילס', 'דרון', 'אלבום'],
+    'לבוש': ['שמלה', 'חליפה', 'בגדים', 'נעליים', 'חנות אופנה', 'בוטיק', 'חייט'],
+    'עיצוב': ['פרחים', 'עיצוב', 'דקורציה', 'קישוט', 'זר', 'סידור'],
+    'הדפסות': ['הזמנות', 'דפוס', 'הדפסה', 'גרפיקה', 'עיצוב גרפי'],
+    'אקססוריז': ['תכשיטים', 'טבעת', 'שעון', 'אקססוריז', 'מאקס', 'max', 'תיק'],
+    'מוזיקה': ['דיג׳יי', 'DJ', 'להקה', 'זמר', 'נגן', 'מוזיקה', 'הגברה'],
+    'הסעות': ['הסעה', 'אוטובוס', 'מונית', 'רכב', 'טיולים', 'נסיעות']
+}
+
+# רשתות וספקים מוכרים שהשם שלהם לא מעיד על הקטגוריה
+KNOWN_VENDORS = {
+    'מאקס': 'אקססוריז',
+    'max': 'אקססוריז',
+    'זארה': 'לבוש',
+    'רמי לוי': 'מזון',
+    'שופרסל': 'מזון',
+    'איקאה': 'עיצוב'
+}
+
+KEYWORD_CONFIDENCE = 95
+KNOWN_VENDOR_CONFIDENCE = 90
+MIN_LEARNED_NAME_LENGTH = 3  # שמות קצרים מדי יתפסו בתוך מילים אחרות
+
+class VendorClassifier:
+    """מסווג ספקים מקומי: regex אחד (alternation) לכל מילות המפתח והספקים המוכרים.
+
+    הביטוי נבנה פעם אחת, מהמונח הארוך לקצר, וכל ההתאמות בשם מדורגות לפי
+    ספציפיות - מונח ארוך גובר על קצר ("עיצוב גרפי" על "עיצוב"), ובשוויון
+    מילת מפתח גוברת על ספק מוכר, כמו בסדר הבדיקה הקודם.
+    """
+
+    def __init__(self, keywords: Dict[str, list] = None, known_vendors: Dict[str, str] = None):
+        # מונח (באותיות קטנות) -> (קטגוריה, ביטחון, עדיפות בשוויון)
+        self._keyword_terms: Dict[str, Tuple[str, int, int]] = {}
+        self._known_terms: Dict[str, Tuple[str, int, int]] = {}
+        self._lock = threading.Lock()
+
+        for category, terms in (keywords or VENDOR_KEYWORDS).items():
+            for term in terms:
+                self._keyword_terms[term.lower()] = (category, KEYWORD_CONFIDENCE, 1)
+
+        for name, category in (known_vendors or KNOWN_VENDORS).items():
+            self._known_terms[name.lower()] = (category, KNOWN_VENDOR_CONFIDENCE, 0)
+
+        self._compile()
+
+    def _compile(self):
+        """בונה את הביטוי מחדש - מוחלף כיחידה אחת, כך שקוראים לא צריכים נעילה"""
+        terms = {**self._known_terms, **self._keyword_terms}
+        ordered = sorted(terms, key=len, reverse=True)
+        pattern = re.compile('|'.join(re.escape(term) for term in ordered), re.IGNORECASE)
+        self._compiled = (pattern, terms)
+
+    def classify(self, vendor_name: str) -> Optional[Dict]:
+        """מחזיר קטגוריה לפי המונח הספציפי ביותר בשם, או None"""
+        if not vendor_name:
+            return None
+
+        pattern, terms = self._compiled
+        best = None
+        best_rank = None
+
+        for match in pattern.finditer(vendor_name):
+            term = match.group(0).lower()
+            category, confidence, tie_break = terms[term]
+            rank = (len(term), tie_break)
+            if best_rank is None or rank > best_rank:
+                best_rank = rank
+                best = (category, confidence)
+
+        if not best:
+            return None
+
+        return {
+            'vendor_name': vendor_name,
+            'category': best[0],
+            'confidence': best[1]
+        }
+
+    def add_known_vendors(self, vendors: Iterable[Dict]) -> int:
+        """מוסיף ספקים מוכרים (שורות מטבלת הספקים) ומחזיר כמה נוספו"""
+        with self._lock:
+            added = 0
+            for vendor in vendors:
+                term = (vendor.get('vendor_name') or '').strip().lower()
+                category = vendor.get('category')
+                if len(term) < MIN_LEARNED_NAME_LENGTH or category not in CATEGORY_LIST:
+                    continue
+                if term in self._keyword_terms:
+                    continue
+
+                try:
+                    confidence = min(int(float(vendor.get('confidence') or 0)), KNOWN_VENDOR_CONFIDENCE)
+                except ValueError:
+                    continue
+
+                entry = (category, confidence, 0)
+                if self._known_terms.get(term) != entry:
+                    self._known_terms[term] = entry
+                    added += 1
+
+            if added:
+                self._compile()
+                logger.info(f"Vendor classifier extended with {added} known vendor(s)")
+
+            return added
+
+# נבנה פעם אחת בטעינת המודול ומשותף לכל המופעים
+vendor_classifier = VendorClassifier()
@@ -0,0 +1,240 @@
+import re
+import time
+import logging
+import threading
+import unicodedata
+from typing import Callable, Dict, List, Optional, Set
+from config import VENDORS_HEADERS, VENDOR_INDEX_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+# ניקוד וטעמים (U+0591-U+05C7) - "צַלָּם" ו"צלם" הם אותו ספק
+_NIQQUD = re.compile('[\u0591-\u05BD\u05BF-\u05C7]')
+# סיומות של שם חברה - לפני הסרת הפיסוק, כדי לתפוס גם בע"מ / בע״מ
+_LEGAL_SUFFIXES = re.compile(r'(?<!\w)(?:בע["״”\']?מ|ltd|inc|llc)(?!\w)\.?', re.IGNORECASE)
+_PUNCTUATION = re.compile(r'[^\w\s]|_')
+_SPACES = re.compile(r'\s+')
+
+def normalize_vendor_name(name: str) -> str:
+    """מנרמל שם ספק להשוואה: בלי ניקוד, בלי בע"מ/Ltd, בלי פיסוק, אותיות קטנות"""
+    if not name:
+        return ''
+
+    value = unicodedata.normalize('NFKC', str(name))
+    value = _NIQQUD.sub('', value)
+    value = _LEGAL_SUFFIXES.sub(' ', value)
+    value = _PUNCTUATION.sub(' ', value)
+    return _SPACES.sub(' ', value).strip().lower()
+
+def vendor_rank(vendor: Dict):
+    """מפתח דירוג: ביטחון ואז עדכניות (תאריכי ISO ממוינים כמחרוזת)"""
+    try:
+        confidence = int(float(vendor.get('confidence') or 0))
+    except ValueError:
+        confidence = 0
+    return confidence, vendor.get('last_seen', '')
+
+def redundant_vendor_rows(rows: List[List[str]]) -> List[int]:
+    """מחזיר את האינדקסים (מ-0) של שורות מיותרות: ריקות, או כפולות שאינן המדורגות ביותר לספק"""
+    best: Dict[str, int] = {}
+    ranks: Dict[str, tuple] = {}
+    redundant = []
+
+    for i, row in enumerate(rows):
+        values = list(row) + [''] * (len(VENDORS_HEADERS) - len(row))
+        vendor = dict(zip(VENDORS_HEADERS, values))
+        normalized = normalize_vendor_name(vendor['vendor_name'])
+        if not normalized or not vendor['category']:
+            redundant.append(i)
+            continue
+
+        rank = vendor_rank(vendor)
+        if normalized not in best:
+            best[normalized], ranks[normalized] = i, rank
+        elif rank > ranks[normalized]:
+            redundant.append(best[normalized])
+            best[normalized], ranks[normalized] = i, rank
+        else:
+            redundant.append(i)
+
+    return sorted(redundant)
+
+def _trigrams(normalized: str) -> Set[str]:
+    """שלשות תווים של השם (עם ריפוד) - לחיפוש מקורב"""
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class VendorIndex:
+    """אינדקס ספקים בזיכרון: שם מנורמל -> קטגוריה.
+
+    חיפוש מדויק ב-hash, ואם אין - חיפוש מקורב לפי שלשות תווים. מועמדים
+    מדורגים לפי דמיון, אחר כך ביטחון ואחר כך עדכניות. הטבלה נטענת פעם
+    אחת ומתעדכנת בכל שמירה, כמו ExpenseStore.
+    """
+
+    def __init__(self, loader: Callable[[], List[List[str]]],
+                 on_reload: Optional[Callable[['VendorIndex'], None]] = None):
+        # loader מחזיר את כל שורות טבלת הספקים כולל כותרת, וזורק חריגה בכישלון
+        self._loader = loader
+        # on_reload מאפשר להחיל מחדש ספקים שעוד לא הגיעו לאחסון
+        self._on_reload = on_reload
+        self._lock = threading.RLock()
+        self._by_name: Dict[str, Dict] = {}
+        self._by_trigram: Dict[str, Set[str]] = {}
+        self._row_numbers: Dict[str, int] = {}
+        self._row_count = 0
+        self._loaded_at: Optional[float] = None
+
+    # === טעינה ===
+
+    def _ensure_loaded(self):
+        """טוען את הטבלה אם עדיין לא נטענה או שפג תוקפה"""
+        interval = VENDOR_INDEX_SETTINGS["reload_interval_seconds"]
+        if (self._loaded_at is None or
+                (interval and time.monotonic() - self._loaded_at > interval)):
+            self.reload()
+
+    def reload(self):
+        """טוען מחדש את כל הספקים ובונה את האינדקסים"""
+        with self._lock:
+            rows = self._loader()
+
+            self._by_name = {}
+            self._by_trigram = {}
+            self._row_numbers = {}
+            self._row_count = len(rows) - 1 if rows else 0
+
+            # שורה 1 היא כותרת - שורות הנתונים מתחילות בשורה 2
+            for i, row in enumerate(rows[1:]):
+                values = list(row) + [''] * (len(VENDORS_HEADERS) - len(row))
+                self._insert(dict(zip(VENDORS_HEADERS, values)), i + 2)
+
+            self._loaded_at = time.monotonic()
+
+            if self._on_reload:
+                self._on_reload(self)
+
+            logger.info(f"Vendor index loaded: {len(self._by_name)} vendors from {max(len(rows) - 1, 0)} rows")
+
+    def invalidate(self):
+        """מסמן את האינדקס לטעינה מחדש בגישה הבאה"""
+        with self._lock:
+            self._loaded_at = None
+
+    def _insert(self, vendor: Dict, row_number: Optional[int] = None, replace: bool = False):
+        normalized = normalize_vendor_name(vendor.get('vendor_name', ''))
+        if not normalized or not vendor.get('category'):
+            return
+
+        existing = self._by_name.get(normalized)
+        if existing and not replace and vendor_rank(existing) > vendor_rank(vendor):
+            # שורה כפולה עם ביטחון נמוך יותר - נשארים עם הקיימת
+            return
+
+        self._by_name[normalized] = vendor
+        if row_number is not None:
+            self._row_numbers[normalized] = row_number
+        if not existing:
+            for trigram in _trigrams(normalized):
+                self._by_trigram.setdefault(trigram, set()).add(normalized)
+
+    # === קריאה ===
+
+    def lookup(self, vendor_name: str) -> Optional[Dict]:
+        """מחזיר את הספק המתאים ביותר (עותק), או None"""
+        normalized = normalize_vendor_name(vendor_name)
+        if not normalized:
+            return None
+
+        with self._lock:
+            self._ensure_loaded()
+
+            vendor = self._by_name.get(normalized)
+            if vendor:
+                return dict(vendor)
+
+            # ספירת שלשות משותפות לכל מועמד
+            query = _trigrams(normalized)
+            shared: Dict[str, int] = {}
+            for trigram in query:
+                for candidate in self._by_trigram.get(trigram, ()):
+                    shared[candidate] = shared.get(candidate, 0) + 1
+
+            tokens = set(normalized.split())
+            min_similarity = VENDOR_INDEX_SETTINGS["min_similarity"]
+            best_key = None
+            best = None
+            for candidate, count in shared.items():
+                similarity = 2 * count / (len(query) + len(_trigrams(candidate)))
+                if similarity < min_similarity:
+                    # שם שמוכל במלואו בשני ("יוסי כהן" / "סטודיו צילום יוסי כהן")
+                    candidate_tokens = set(candidate.split())
+                    if not (tokens <= candidate_tokens or candidate_tokens <= tokens):
+                        continue
+                    similarity = min_similarity
+
+                # דמיון מעוגל - הפרשים זניחים מוכרעים לפי ביטחון ועדכניות
+                key = (round(similarity, 1), vendor_rank(self._by_name[candidate]))
+                if best_key is None or key > best_key:
+                    best_key, best = key, candidate
+
+            return dict(self._by_name[best]) if best else None
+
+    def get_exact(self, vendor_name: str) -> Optional[Dict]:
+        """מחזיר ספק עם אותו שם מנורמל בלבד (בלי התאמה מקורבת)"""
+        with self._lock:
+            self._ensure_loaded()
+            vendor = self._by_name.get(normalize_vendor_name(vendor_name))
+            return dict(vendor) if vendor else None
+
+    def get_row_number(self, vendor_name: str) -> Optional[int]:
+        """מחזיר את מספר השורה של הספק באחסון (None אם טרם נכתב)"""
+        with self._lock:
+            self._ensure_loaded()
+            return self._row_numbers.get(normalize_vendor_name(vendor_name))
+
+    def duplicate_rows(self) -> Optional[int]:
+        """כמה שורות בטבלה מיותרות (כפולות או ריקות); None אם טרם נטען"""
+        with self._lock:
+            if self._loaded_at is None:
+                return None
+            return max(self._row_count - len(self._row_numbers), 0)
+
+    def all(self) -> List[Dict]:
+        """מחזיר עותקים של כל הספקים (רשומה אחת לכל שם מנורמל)"""
+        with self._lock:
+            self._ensure_loaded()
+            return [dict(vendor) for vendor in self._by_name.values()]
+
+    def get_category(self, vendor_name: str) -> Optional[str]:
+        """מחזיר את הקטגוריה של הספק המתאים ביותר"""
+        vendor = self.lookup(vendor_name)
+        return vendor.get('category') if vendor else None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._by_name)
+
+    # === כתיבה (אחרי שהאחסון עודכן) ===
+
+    def add(self, vendor: Dict, row_number: Optional[int] = None):
+        """מוסיף או מחליף ספק באינדקס (row_number - אם נכתבה שורה חדשה)"""
+        with self._lock:
+            if self._loaded_at is None:
+                # טרם נטען - הטעינה הבאה תכלול את השורה החדשה
+                return
+            if row_number is not None:
+                self._row_count += 1
+            self._insert(dict(vendor), row_number, replace=True)
+
+    def set_row_number(self, vendor_name: str, row_number: Optional[int]):
+        """רושם את מספר השורה של ספק שנדחף מהיומן לאחסון"""
+        with self._lock:
+            if row_number is None:
+                # לא ידוע איפה נכתבה השורה - עדיף לטעון מחדש מאשר לנחש
+                self._loaded_at = None
+                return
+            normalized = normalize_vendor_name(vendor_name)
+            if normalized not in self._row_numbers:
+                self._row_count += 1
+            self._row_numbers[normalized] = row_number
@@ -1,12 +1,20 @@
 import re
-import json
+import asyncio
 import logging
-import httpx
 from datetime import datetime, timedelta
 from typing import Dict, Optional, Tuple, List
 from database_manager import DatabaseManager
 from ai_analyzer import AIAnalyzer
 from bot_messages import BotMessages
+from green_api_client import GreenAPIClient, DownloadedFile, FileTooLargeError
+from receipt_cache import ReceiptAnalysisCache
+from message_dedup import MessageDeduplicator
+from group_lanes import GroupLanes
+from job_queue import RetryableJobError
+from receipt_batcher import ReceiptBatcher
+from payload_logging import log_payload
+from phone_utils import PhoneIndex
+from image_preprocessor import ImageRejectedError, validate_image, preprocess_receipt_image
 from config import *
 
 logger = logging.getLogger(__name__)
@@ -14,14 +22,40 @@ logger = logging.getLogger(__name__)
 class WebhookHandler:
     """מנהל את כל הודעות WhatsApp הנכנסות ויוצאות"""
     
-    def __init__(self):
-        self.db = DatabaseManager()
-        self.ai = AIAnalyzer()
-        self.messages = BotMessages()
+    def __init__(self, db: DatabaseManager, ai: AIAnalyzer, green_api: GreenAPIClient,
+                 messages: Optional[BotMessages] = None,
+                 receipt_cache: Optional[ReceiptAnalysisCache] = None):
+        # הלקוחות הכבדים נוצרים פעם אחת ב-main ומוזרקים לכל הרכיבים
+        self.db = db
+        self.ai = ai
+        self.green_api = green_api
+        self.messages = messages or BotMessages()
         
-        # cache לקבוצות פעילות
+        # מטמון ניתוחי קבלות - אותה תמונה לא נשלחת פעמיים ל-AI
+        self.receipt_cache = receipt_cache or ReceiptAnalysisCache()
+        
+        # מזהי הודעות שכבר טופלו - משלוח חוזר של Green API לא מעובד שוב
+        self.deduplicator = MessageDeduplicator()
+        
+        # עיבוד סדרתי לכל קבוצה - מונע מרוץ במקדמות וב-last_expenses_by_group
+        self.lanes = GroupLanes()
+        
+        # תמונות ברצף מאותה קבוצה מעובדות כאלבום אחד עם אישור אחד
+        self.receipt_batcher = None
+        if RECEIPT_BATCH_SETTINGS["enabled"]:
+            self.receipt_batcher = ReceiptBatcher(self._on_receipt_batch_ready)
+        
+        # cache לקבוצות פעילות - מתעדכן מכל כתיבה לזוג; טעינה מלאה רק כשגרסת הטבלה השתנתה
         self.active_groups_cache = {}
         self.last_cache_update = None
+        self.last_version_check = None
+        self.groups_cache_version = None
+        self.db.add_couple_listener(self._on_couple_changed)
+        
+        # טלפונים מורשים (E.164): ALLOWED_PHONES + phone1/phone2 של כל זוג פעיל - מצב של התהליך, לא של config
+        self.phone_index = PhoneIndex(ALLOWED_PHONES)
+        if not self.phone_index.has_static:
+            logger.warning("No ALLOWED_PHONES configured - allowing all users (not recommended for production)")
         
         # מעקב אחר הודעות אחרונות לעדכונים
         self.last_expenses_by_group = {}
@@ -33,31 +67,66 @@ class WebhookHandler:
             if not phone:
                 return False
             
-            # אם אין רשימת טלפונים מורשים - מאשר הכל (למטרות בדיקה)
-            if not ALLOWED_PHONES:
-                logger.warning("No ALLOWED_PHONES configured - allowing all users (not recommended for production)")
+            # אם אין רשימת טלפונים מורשים - מאשר הכל (למטרות בדיקה, האזהרה נרשמת בעלייה)
+            if not self.phone_index.has_static:
                 return True
             
-            # נרמול מספר טלפון
-            clean_phone = phone.replace("@c.us", "").replace("-", "").replace(" ", "")
-            
-            # בדיקה מול רשימת הטלפונים המורשים
-            for allowed in ALLOWED_PHONES:
-                clean_allowed = allowed.replace("+", "").replace("-", "").replace(" ", "")
-                if clean_allowed in clean_phone or clean_phone in clean_allowed:
-                    return True
-            
-            return False
+            # התאמה מדויקת אחרי נרמול ל-E.164
+            return self.phone_index.contains(phone)
             
         except Exception as e:
             logger.error(f"Phone authorization check failed: {e}")
             return False
     
-    async def process_webhook(self, payload: Dict) -> Dict[str, any]:
-        """מעבד webhook נכנס מWhatsApp"""
+    async def notify_job_failed(self, payload: Dict):
+        """הודעה לקבוצה כשהודעה נכשלה בכל הניסיונות (נקרא מתור העבודות)"""
+        chat_id = (payload.get("senderData") or {}).get("chatId", "")
+        if chat_id:
+            await self._send_message(chat_id, self.messages.error_general())
+    
+    def is_duplicate_delivery(self, payload: Dict) -> bool:
+        """בודק (בלי לסמן) אם ההודעה כבר טופלה - לסינון מוקדם לפני התור"""
+        return self.deduplicator.is_duplicate(payload.get("idMessage"))
+    
+    async def process_webhook(self, payload: Dict, defer_batches: bool = False) -> Dict[str, any]:
+        """מעבד webhook נכנס מWhatsApp.
+        
+        תמונה שנאספה לאלבום מסתיימת רק כשהאלבום נשמר: בלי defer_batches מחכים
+        לה כאן, ועם defer_batches (תור העבודות) התוצאה כוללת "pending" - future
+        שמתממש לתוצאת התמונה או זורק RetryableJobError.
+        """
+        # משלוח חוזר של הודעה שכבר טופלה (או שבעיבוד כרגע) - לפני כל עיבוד
+        message_id = payload.get("idMessage")
+        if not self.deduplicator.begin(message_id):
+            return {"status": "duplicate", "message_id": message_id}
+        
+        try:
+            result = await self._process_payload(payload)
+            if "pending" in result and not defer_batches:
+                result = await asyncio.shield(result["pending"])
+        except BaseException:
+            # המזהה מסומן רק אחרי הצלחה - ניסיון חוזר יעובד שוב
+            self.deduplicator.release(message_id)
+            raise
+        
+        if "pending" in result:
+            # קבלה באלבום - מסומנת כטופלה רק אחרי שהאלבום נשמר
+            result["pending"].add_done_callback(lambda done: self._finish_message(message_id, done))
+        else:
+            self.deduplicator.complete(message_id)
+        return result
+    
+    def _finish_message(self, message_id: Optional[str], done: asyncio.Future):
+        if not done.cancelled() and done.exception() is None:
+            self.deduplicator.complete(message_id)
+        else:
+            self.deduplicator.release(message_id)
+    
+    async def _process_payload(self, payload: Dict) -> Dict[str, any]:
+        """מעבד webhook שאינו כפול"""
         try:
             # חילוץ נתונים בסיסיים
-            print("🔍 FULL WEBHOOK PAYLOAD:", json.dumps(payload, indent=2, ensure_ascii=False))
+            log_payload(logger, payload)
             message_data = payload.get("messageData", {})
             sender_data = payload.get("senderData", {})
             
@@ -68,35 +137,55 @@ class WebhookHandler:
                 logger.warning("No chat_id in webhook")
                 return {"status": "ignored", "reason": "no_chat_id"}
             
+            # טלפוני הזוגות הם חלק מההרשאה - מוודאים שה-cache טעון
+            await self._ensure_groups_cache()
+            
             # בדיקת הרשאה - אם לא מורשה, התעלם בדממה
             if not self._is_authorized_phone(sender_data):
                 logger.info(f"Unauthorized phone attempted to use bot: {sender_data.get('sender', 'unknown')}")
                 return {"status": "unauthorized", "reason": "phone_not_allowed"}
             
-            # בדיקת קבוצה פעילה
-            group_info = await self._get_group_info(chat_id)
-            if not group_info:
-                # לא שולח הודעה - פשוט מתעלם
-                logger.info(f"Message from unregistered group: {chat_id}")
-                return {"status": "group_not_found", "chat_id": chat_id}
-            
-            logger.info(f"Processing {message_type} from group {group_info['whatsapp_group_id']}")
-            
-            # עיבוד לפי סוג הודעה
-            if message_type == "textMessage":
-                return await self._handle_text_message(chat_id, message_data, group_info)
-            
-            elif message_type == "imageMessage":
-                return await self._handle_image_message(chat_id, message_data, group_info)
-            
-            else:
-                logger.info(f"Unsupported message type: {message_type}")
-                return {"status": "ignored", "message_type": message_type}
+            # הודעות של אותה קבוצה רצות לפי הסדר, קבוצות שונות במקביל
+            async with self.lanes.lane(chat_id):
+                return await self._process_group_message(chat_id, message_type, message_data)
             
+        except RetryableJobError:
+            # כישלון זמני - העבודה חוזרת לתור (או 500 ל-Green API בלי תור)
+            raise
         except Exception as e:
             logger.error(f"Webhook processing failed: {e}")
             return {"status": "error", "error": str(e)}
     
+    async def _process_group_message(self, chat_id: str, message_type: str, message_data: Dict) -> Dict:
+        """מעבד הודעה של קבוצה (רץ בתוך הנתיב של הקבוצה)"""
+        # בדיקת קבוצה פעילה
+        group_info = await self._get_group_info(chat_id)
+        if not group_info:
+            # לא שולח הודעה - פשוט מתעלם
+            logger.info(f"Message from unregistered group: {chat_id}")
+            return {"status": "group_not_found", "chat_id": chat_id}
+        
+        logger.info(f"Processing {message_type} from group {group_info['whatsapp_group_id']}")
+        
+        # עיבוד לפי סוג הודעה
+        if message_type == "textMessage":
+            # תמונות שממתינות לאלבום קודמות לטקסט ("2500 לא 2000" מתייחס אליהן)
+            if self.receipt_batcher and self.receipt_batcher.pending(chat_id):
+                await self._process_receipt_batch(chat_id, group_info)
+            return await self._handle_text_message(chat_id, message_data, group_info)
+        
+        elif message_type == "imageMessage":
+            if self.receipt_batcher:
+                # נאסף לאלבום - ינותח ויאושר כשהחלון של הקבוצה ייסגר
+                done = asyncio.get_running_loop().create_future()
+                count = self.receipt_batcher.add(chat_id, {"message_data": message_data, "done": done})
+                return {"status": "receipt_batched", "batch_size": count, "pending": done}
+            return await self._handle_image_message(chat_id, message_data, group_info)
+        
+        else:
+            logger.info(f"Unsupported message type: {message_type}")
+            return {"status": "ignored", "message_type": message_type}
+    
     async def _handle_text_message(self, chat_id: str, message_data: Dict, group_info: Dict) -> Dict:
         """מטפל בהודעות טקסט משופר"""
         try:
@@ -144,6 +233,8 @@ class WebhookHandler:
             # הודעה רגילה - לא שולח עזרה אוטומטית
             return {"status": "regular_message"}
             
+        except RetryableJobError:
+            raise
         except Exception as e:
             logger.error(f"Text message handling failed: {e}")
             await self._send_message(chat_id, self.messages.error_general())
@@ -152,61 +243,272 @@ class WebhookHandler:
     async def _handle_image_message(self, chat_id: str, message_data: Dict, group_info: Dict) -> Dict:
         """מטפל בתמונות קבלות"""
         try:
-            # הורדת תמונה
-            image_data = await self._download_image(message_data)
-            if not image_data:
-                await self._send_message(chat_id, "שגיאה בהורדת התמונה. נסו שוב!")
-                return {"status": "download_failed"}
+            group_id = group_info["whatsapp_group_id"]
             
-            # ניתוח עם AI
-            receipt_data = self.ai.analyze_receipt_image(image_data)
+            analysis = await self._analyze_receipt(message_data, group_id)
+            status = analysis["status"]
+            
+            if status == "download_failed":
+                raise RetryableJobError("Image download failed")
             
-            # בדיקה אם התמונה לא ברורה (חסרים נתונים חשובים)
-            if self._is_image_unclear(receipt_data):
+            if status == "image_rejected":
+                await self._send_message(chat_id, self.messages.image_rejected(analysis["reason"]))
+                return {"status": status, "reason": analysis["reason"]}
+            
+            if status == "duplicate_receipt":
+                await self._send_message(chat_id, self.messages.duplicate_receipt_detected(analysis["expense"]))
+                return {"status": status, "expense_id": analysis["expense"]["expense_id"]}
+            
+            if status == "image_unclear":
                 await self._send_message(chat_id, self.messages.image_unclear_request())
-                return {"status": "image_unclear"}
+                return {"status": status}
             
-            # שיפור ספק עם למידה
-            receipt_data = await self._enhance_vendor_data(receipt_data, group_info["whatsapp_group_id"])
+            receipt_data = analysis["receipt_data"]
             
             # בדיקת מקדמות
-            receipt_data = await self._handle_advance_payments(receipt_data, group_info["whatsapp_group_id"])
+            receipt_data = await self._handle_advance_payments(receipt_data, group_id)
             
             # שמירה בדאטה בייס
             success = await self._save_expense(receipt_data, group_info)
             
             if success:
+                self.receipt_cache.mark_saved(analysis["fingerprint"], group_id, receipt_data['expense_id'])
+                
                 # שליחת הודעת אישור
                 message = self.messages.receipt_saved_success(receipt_data)
                 
                 # הוספת הודעה על מקדמות אם רלוונטי
-                if receipt_data.get('payment_type') in ['advance', 'final']:
-                    related_expenses = self.db.find_related_expenses(
-                        receipt_data['vendor'], 
-                        group_info["whatsapp_group_id"]
-                    )
-                    if len(related_expenses) > 1:
-                        advance_msg = self.messages.advance_payment_detected(
-                            receipt_data['vendor'], 
-                            len(related_expenses)
-                        )
-                        message += f"\n\n{advance_msg}"
+                advance_msg = await self._advance_payment_note(receipt_data, group_id)
+                if advance_msg:
+                    message += f"\n\n{advance_msg}"
                 
                 await self._send_message(chat_id, message)
                 
                 # עדכון cache של הוצאה אחרונה
-                self.last_expenses_by_group[group_info["whatsapp_group_id"]] = receipt_data
+                self.last_expenses_by_group[group_id] = receipt_data
                 
                 return {"status": "receipt_saved", "expense_data": receipt_data}
             else:
-                await self._send_message(chat_id, "שגיאה בשמירה. נסו שוב!")
-                return {"status": "save_failed"}
+                raise RetryableJobError("Failed to save receipt")
             
+        except RetryableJobError:
+            raise
         except Exception as e:
             logger.error(f"Image message handling failed: {e}")
             await self._send_message(chat_id, self.messages.error_general())
             return {"status": "error", "error": str(e)}
     
+    async def _analyze_receipt(self, message_data: Dict, group_id: str) -> Dict:
+        """מוריד ומנתח תמונת קבלה - בלי לשמור ובלי לשלוח הודעות.
+        
+        מחזיר status: analyzed (עם receipt_data ו-fingerprint), download_failed,
+        image_rejected (עם reason), duplicate_receipt (עם expense) או image_unclear.
+        """
+        # הורדה בזרימה + בדיקת גודל וסוג לפי SAFETY_SETTINGS (לפי התוכן ולא לפי הסיומת)
+        try:
+            download = await self._download_image(message_data)
+            if not download:
+                return {"status": "download_failed"}
+            
+            image_data = download.content
+            validate_image(image_data)
+            
+        except ImageRejectedError as e:
+            logger.warning(f"Image rejected for group {group_id}: {e}")
+            return {"status": "image_rejected", "reason": e.reason}
+        
+        # טביעת אצבע לתמונה (hash תפיסתי דורש פענוח - מחוץ ל-event loop)
+        loop = asyncio.get_running_loop()
+        fingerprint = await loop.run_in_executor(
+            None, self.receipt_cache.fingerprint, image_data, download.sha256
+        )
+        cached = self.receipt_cache.get(fingerprint)
+        
+        if cached:
+            # אותה קבלה כבר נשמרה בקבוצה - לא יוצרים שורה כפולה
+            existing_id = cached['expense_ids'].get(group_id)
+            existing = await self.db.get_expense_async(existing_id) if existing_id else None
+            
+            if existing and existing.get('status') == 'active':
+                logger.info(f"Duplicate receipt in group {group_id}: {existing_id}")
+                return {"status": "duplicate_receipt", "expense": existing}
+            
+            # עותק - הניתוח השמור משותף לכל מי שקיבל אותו
+            receipt_data = dict(cached['analysis'])
+            logger.info(f"Receipt analysis served from cache: {receipt_data.get('vendor')}")
+        else:
+            # הקטנה, חיתוך והמרה לאפור - בקשה קטנה וזולה יותר למודל
+            processed, mime_type = await loop.run_in_executor(None, preprocess_receipt_image, image_data)
+            
+            # ניתוח עם AI
+            receipt_data = await self.ai.analyze_receipt_image_async(processed, mime_type)
+            
+            # ניתוח שנכשל לא נשמר במטמון - ניסיון חוזר יקבל ניתוח חדש
+            if receipt_data.get('confidence', 0) > 0:
+                self.receipt_cache.put(fingerprint, receipt_data)
+        
+        # בדיקה אם התמונה לא ברורה (חסרים נתונים חשובים)
+        if self._is_image_unclear(receipt_data):
+            return {"status": "image_unclear"}
+        
+        # שיפור ספק עם למידה
+        receipt_data = await self._enhance_vendor_data(receipt_data, group_id)
+        
+        return {"status": "analyzed", "receipt_data": receipt_data, "fingerprint": fingerprint}
+    
+    async def _advance_payment_note(self, receipt_data: Dict, group_id: str) -> Optional[str]:
+        """הודעה על מקדמות לספק, אם יש לו יותר מתשלום אחד"""
+        if receipt_data.get('payment_type') not in ['advance', 'final']:
+            return None
+        
+        related_expenses = await self.db.find_related_expenses_async(receipt_data['vendor'], group_id)
+        if len(related_expenses) > 1:
+            return self.messages.advance_payment_detected(receipt_data['vendor'], len(related_expenses))
+        return None
+    
+    # === אלבום קבלות ===
+    
+    async def _on_receipt_batch_ready(self, chat_id: str):
+        """חלון האלבום נסגר - מעבדים אותו בתור של הקבוצה"""
+        async with self.lanes.lane(chat_id):
+            result = await self._process_receipt_batch(chat_id)
+            if result:
+                logger.info(f"Receipt batch for {chat_id} done: {result.get('status')}")
+    
+    async def _process_receipt_batch(self, chat_id: str, group_info: Optional[Dict] = None) -> Optional[Dict]:
+        """מעבד את התמונות שממתינות לקבוצה (רץ בתוך הנתיב של הקבוצה).
+        
+        כל תמונה מקבלת תוצאה ב-done שלה; תמונה שזורקת RetryableJobError
+        חוזרת לתור העבודות (או 500 ל-Green API בלי תור) ותיאסף שוב.
+        """
+        batch = self.receipt_batcher.take(chat_id)
+        if not batch:
+            return None
+        
+        try:
+            group_info = group_info or await self._get_group_info(chat_id)
+            if not group_info:
+                logger.info(f"Dropping receipt batch from unregistered group: {chat_id}")
+                result = {"status": "group_not_found", "chat_id": chat_id}
+            elif len(batch) == 1:
+                # תמונה בודדת - אישור רגיל כמו בלי אלבום
+                result = await self._handle_image_message(chat_id, batch[0]["message_data"], group_info)
+            else:
+                result = await self._handle_image_batch(chat_id, batch, group_info)
+        except Exception as e:
+            logger.error(f"Receipt batch for {chat_id} failed, retrying its images: {e}")
+            self._settle_batch(batch, e if isinstance(e, RetryableJobError) else RetryableJobError(str(e)))
+            return {"status": "retry", "count": len(batch)}
+        
+        self._settle_batch(batch, result)
+        return result
+    
+    @staticmethod
+    def _settle_batch(items: List[Dict], outcome):
+        """מסיים את התמונות שעוד לא קיבלו תוצאה - תוצאה או חריגה"""
+        for item in items:
+            done = item["done"]
+            if done.done():
+                continue
+            if isinstance(outcome, BaseException):
+                done.set_exception(outcome)
+            else:
+                done.set_result(outcome)
+    
+    async def flush_receipt_batches(self):
+        """מעבד מיד אלבומים פתוחים - בכיבוי, כדי שתמונות שכבר התקבלו לא יאבדו"""
+        if self.receipt_batcher:
+            await self.receipt_batcher.close()
+    
+    async def _handle_image_batch(self, chat_id: str, batch: List[Dict], group_info: Dict) -> Dict:
+        """מטפל באלבום קבלות: ניתוח במקביל, כתיבה אחת לאחסון והודעת אישור אחת"""
+        try:
+            group_id = group_info["whatsapp_group_id"]
+            logger.info(f"Processing receipt batch of {len(batch)} image(s) for group {group_id}")
+            
+            # ניתוח במקביל, עם הגבלה על מספר קריאות ה-vision בו-זמנית
+            slots = asyncio.Semaphore(RECEIPT_BATCH_SETTINGS["max_concurrent_analyses"])
+            
+            async def analyze(item: Dict) -> Dict:
+                async with slots:
+                    try:
+                        return await self._analyze_receipt(item["message_data"], group_id)
+                    except Exception as e:
+                        logger.error(f"Receipt analysis in batch failed: {e}")
+                        return {"status": "failed"}
+            
+            analyses = await asyncio.gather(*(analyze(item) for item in batch))
+            
+            skipped = {"duplicate_receipt": 0, "image_unclear": 0, "image_rejected": 0, "failed": 0}
+            receipts = []
+            fingerprints = []
+            saved_items = []
+            
+            # לפי סדר השליחה - חשוב למקדמות (התשלום האחרון הוא הסופי)
+            for item, analysis in zip(batch, analyses):
+                status = analysis["status"]
+                if status == "download_failed":
+                    # כמו תמונה בודדת - ההורדה תנוסה שוב מהתור
+                    self._settle_batch([item], RetryableJobError("Image download failed"))
+                    continue
+                
+                if status == "analyzed" and analysis["fingerprint"] in fingerprints:
+                    # אותה תמונה נשלחה פעמיים באותו אלבום
+                    status = "duplicate_receipt"
+                
+                if status != "analyzed":
+                    skipped[status if status in skipped else "failed"] += 1
+                    self._settle_batch([item], {"status": status})
+                    continue
+                
+                receipt_data = await self._handle_advance_payments(analysis["receipt_data"], group_id, receipts)
+                receipt_data['group_id'] = group_id
+                receipts.append(receipt_data)
+                fingerprints.append(analysis["fingerprint"])
+                saved_items.append(item)
+            
+            if receipts:
+                # כל השורות בכתיבה אחת לאחסון
+                if not await self.db.save_expenses_bulk_async(receipts):
+                    await self._send_message(chat_id, self.messages.receipts_save_failed())
+                    self._settle_batch(saved_items, RetryableJobError("Failed to save receipt batch"))
+                    return {"status": "save_failed", "count": len(receipts)}
+                
+                for fingerprint, receipt_data in zip(fingerprints, receipts):
+                    self.receipt_cache.mark_saved(fingerprint, group_id, receipt_data['expense_id'])
+                
+                logger.info(f"Saved {len(receipts)} expense(s) from batch for group {group_id}")
+                
+                # עדכון cache של הוצאה אחרונה - "2500 לא 2000" מתייחס לקבלה האחרונה
+                self.last_expenses_by_group[group_id] = receipts[-1]
+            
+            if not receipts and not any(skipped.values()):
+                # כל התמונות חוזרות לתור - האישור יישלח כשיעובדו שוב
+                return {"status": "retry", "count": len(batch)}
+            
+            message = self.messages.receipts_batch_saved(receipts, skipped)
+            
+            # הודעה על מקדמות - פעם אחת לכל ספק
+            notes = []
+            for receipt_data in receipts:
+                note = await self._advance_payment_note(receipt_data, group_id)
+                if note and note not in notes:
+                    notes.append(note)
+            if notes:
+                message += "\n\n" + "\n".join(notes)
+            
+            await self._send_message(chat_id, message)
+            
+            for item, receipt_data in zip(saved_items, receipts):
+                self._settle_batch([item], {"status": "receipt_saved", "expense_data": receipt_data})
+            
+            return {"status": "receipt_batch_saved", "saved": len(receipts), "skipped": skipped}
+            
+        except Exception as e:
+            logger.error(f"Receipt batch handling failed: {e}")
+            await self._send_message(chat_id, self.messages.error_general())
+            return {"status": "error", "error": str(e)}
+    
     async def _handle_system_commands(self, chat_id: str, text: str, group_info: Dict) -> bool:
         """מטפל בפקודות מערכת ותהליך רישום"""
         text_lower = text.lower().strip()
@@ -222,7 +524,7 @@ class WebhookHandler:
                 wedding_date = f"{year}-{month.zfill(2)}-{day.zfill(2)}"
                 
                 # עדכון בדאטה בייס
-                self.db.update_couple_field(group_info['whatsapp_group_id'], 'wedding_date', wedding_date)
+                await self.db.update_couple_field_async(group_info['whatsapp_group_id'], 'wedding_date', wedding_date)
                 
                 # שאלה על תקציב
                 await self._send_message(
@@ -238,7 +540,7 @@ class WebhookHandler:
             # שלב 2: קבלת תקציב
             if text_lower in ['אין', 'אין עדיין', 'לא יודע', 'לא יודעים']:
                 # עדכון שאין תקציב
-                self.db.update_couple_field(group_info['whatsapp_group_id'], 'budget', 'אין עדיין')
+                await self.db.update_couple_field_async(group_info['whatsapp_group_id'], 'budget', 'אין עדיין')
                 
                 await self._send_message(
                     chat_id,
@@ -255,7 +557,7 @@ class WebhookHandler:
                 budget = float(budget_match.group(1).replace(',', ''))
                 
                 # עדכון בדאטה בייס
-                self.db.update_couple_field(group_info['whatsapp_group_id'], 'budget', str(budget))
+                await self.db.update_couple_field_async(group_info['whatsapp_group_id'], 'budget', str(budget))
                 
                 await self._send_message(
                     chat_id,
@@ -275,76 +577,75 @@ class WebhookHandler:
         
         return False
     
-
-async def _handle_update_request(self, chat_id: str, text: str, recent_expense: Dict, group_info: Dict) -> bool:
-    """מטפל בבקשות עדכון עם שמירה לדאטה בייס"""
-    try:
-        # בדיקת חלון זמן (10 דקות)
-        if not self._is_within_edit_window(recent_expense):
-            return False
-        
-        # ניתוח הודעה עם AI
-        update_request = self.ai.analyze_message_for_updates(text, recent_expense)
-        
-        if not update_request or not update_request.get('is_update'):
-            return False
-        
-        update_type = update_request.get('update_type')
-        new_value = update_request.get('new_value')
-        
-        # ביצוע העדכון
-        if update_type == "delete":
-            # מחיקה אמיתית
-            success = self.db.delete_expense(recent_expense['expense_id'])
-            if success:
-                await self._send_message(chat_id, self.messages.receipt_deleted_success(recent_expense))
-                # הסר מ-cache
-                if group_info["whatsapp_group_id"] in self.last_expenses_by_group:
-                    del self.last_expenses_by_group[group_info["whatsapp_group_id"]]
-                return True
-        
-        else:
-            # הכן עדכונים
-            updates = {}
+    async def _handle_update_request(self, chat_id: str, text: str, recent_expense: Dict, group_info: Dict) -> bool:
+        """מטפל בבקשות עדכון עם שמירה לדאטה בייס"""
+        try:
+            # בדיקת חלון זמן (10 דקות)
+            if not self._is_within_edit_window(recent_expense):
+                return False
             
-            if update_type == "vendor":
-                updates['vendor'] = new_value
-                # נסה לשפר קטגוריה
-                enhanced = self.ai.enhance_vendor_with_category(new_value)
-                if enhanced['confidence'] > 70:
-                    updates['category'] = enhanced['category']
-                    
-            elif update_type == "amount":
-                try:
-                    updates['amount'] = float(new_value)
-                except ValueError:
-                    return False
-                    
-            elif update_type == "category":
-                if new_value in CATEGORY_LIST:
-                    updates['category'] = new_value
-                else:
-                    return False
+            # ניתוח הודעה עם AI
+            update_request = await self.ai.analyze_message_for_updates_async(text, recent_expense)
+            
+            if not update_request or not update_request.get('is_update'):
+                return False
             
-            # עדכון בדאטה בייס
-            success = self.db.update_expense(recent_expense['expense_id'], updates)
+            update_type = update_request.get('update_type')
+            new_value = update_request.get('new_value')
+            
+            # ביצוע העדכון
+            if update_type == "delete":
+                # מחיקה אמיתית
+                success = await self.db.delete_expense_async(recent_expense['expense_id'])
+                if success:
+                    await self._send_message(chat_id, self.messages.receipt_deleted_success(recent_expense))
+                    # הסר מ-cache
+                    if group_info["whatsapp_group_id"] in self.last_expenses_by_group:
+                        del self.last_expenses_by_group[group_info["whatsapp_group_id"]]
+                    return True
             
-            if success:
-                # עדכן את recent_expense
-                recent_expense.update(updates)
+            else:
+                # הכן עדכונים
+                updates = {}
                 
-                message = self.messages.receipt_updated_success(recent_expense, update_type)
-                await self._send_message(chat_id, message)
+                if update_type == "vendor":
+                    updates['vendor'] = new_value
+                    # נסה לשפר קטגוריה
+                    enhanced = await self.ai.enhance_vendor_with_category_async(new_value)
+                    if enhanced['confidence'] > 70:
+                        updates['category'] = enhanced['category']
+                        
+                elif update_type == "amount":
+                    try:
+                        updates['amount'] = float(new_value)
+                    except ValueError:
+                        return False
+                        
+                elif update_type == "category":
+                    if new_value in CATEGORY_LIST:
+                        updates['category'] = new_value
+                    else:
+                        return False
                 
-                # עדכון cache
-                self.last_expenses_by_group[group_info["whatsapp_group_id"]] = recent_expense
-                return True
+                # עדכון בדאטה בייס
+                success = await self.db.update_expense_async(recent_expense['expense_id'], updates)
+                
+                if success:
+                    # עדכן את recent_expense
+                    recent_expense.update(updates)
+                    
+                    message = self.messages.receipt_updated_success(recent_expense, update_type)
+                    await self._send_message(chat_id, message)
+                    
+                    # עדכון cache
+                    self.last_expenses_by_group[group_info["whatsapp_group_id"]] = recent_expense
+                    return True
+            
+        except Exception as e:
+            logger.error(f"Update request handling failed: {e}")
+        
+        return False
         
-    except Exception as e:
-        logger.error(f"Update request handling failed: {e}")
-    
-    return False
-    
     def _is_image_unclear(self, receipt_data: Dict) -> bool:
         """בודק אם התמונה לא ברורה (חסרים 2+ שדות חשובים)"""
         important_fields = ['vendor', 'amount']
@@ -364,21 +665,22 @@ async def _handle_update_request(self, chat_id: str, text: str, recent_expense:
             return receipt_data
         
         # חיפוש קטגוריה קיימת
-        existing_category = self.db.get_vendor_category(vendor)
+        existing_category = await self.db.get_vendor_category_async(vendor)
         
         if existing_category and existing_category in CATEGORY_LIST:
             receipt_data['category'] = existing_category
             receipt_data['confidence'] = min(95, receipt_data.get('confidence', 80) + 15)
+            await self.db.touch_vendor_async(vendor)
         else:
             # ספק חדש - שיפור עם AI
-            enhanced = self.ai.enhance_vendor_with_category(vendor, receipt_data.get('category'))
+            enhanced = await self.ai.enhance_vendor_with_category_async(vendor, receipt_data.get('category'))
             
             if enhanced.get('confidence', 0) > 70:
                 receipt_data['category'] = enhanced['category']
                 receipt_data['confidence'] = enhanced['confidence']
                 
                 # שמירה למידה עתידית
-                self.db.save_vendor_category(
+                await self.db.save_vendor_category_async(
                     vendor, 
                     enhanced['category'], 
                     enhanced['confidence'], 
@@ -387,27 +689,6 @@ async def _handle_update_request(self, chat_id: str, text: str, recent_expense:
         
         return receipt_data
     
-    async def _handle_advance_payments(self, receipt_data: Dict, group_id: str) -> Dict:
-        """מטפל בזיהוי מקדמות אוטומטי"""
-        vendor = receipt_data.get('vendor')
-        if not vendor:
-            return receipt_data
-        
-        # מחפש תשלומים קודמים לאותו ספק
-        related_expenses = self.db.find_related_expenses(vendor, group_id)
-        
-        if not related_expenses:
-            # תשלום ראשון
-            receipt_data['payment_type'] = 'full'
-        else:
-            # תשלום נוסף - הופך הכל למקדמות
-            receipt_data['payment_type'] = 'final'
-            
-            # עדכון התשלומים הקודמים
-            self.db.update_payment_types(related_expenses + [receipt_data])
-        
-        return receipt_data
-    
     async def _save_expense(self, receipt_data: Dict, group_info: Dict) -> bool:
         """שומר הוצאה בדאטה בייס"""
         try:
@@ -415,7 +696,7 @@ async def _handle_update_request(self, chat_id: str, text: str, recent_expense:
             receipt_data['group_id'] = group_info['whatsapp_group_id']
             
             # שמירה
-            success = self.db.save_expense(receipt_data)
+            success = await self.db.save_expense_async(receipt_data)
             
             if success:
                 logger.info(f"Saved expense for group {group_info['whatsapp_group_id']}")
@@ -432,7 +713,7 @@ async def _handle_update_request(self, chat_id: str, text: str, recent_expense:
             manual_data['group_id'] = group_info['whatsapp_group_id']
             manual_data['source'] = 'manual_entry'
             
-            success = self.db.save_expense(manual_data)
+            success = await self.db.save_expense_async(manual_data)
             
             if success:
                 message = self.messages.manual_entry_saved(
@@ -446,9 +727,10 @@ async def _handle_update_request(self, chat_id: str, text: str, recent_expense:
                 
                 return {"status": "manual_saved", "expense_data": manual_data}
             else:
-                await self._send_message(chat_id, "שגיאה בשמירה. נסו שוב!")
-                return {"status": "save_failed"}
+                raise RetryableJobError("Failed to save manual expense")
                 
+        except RetryableJobError:
+            raise
         except Exception as e:
             logger.error(f"Manual expense save failed: {e}")
             await self._send_message(chat_id, self.messages.error_general())
@@ -478,21 +760,57 @@ async def _handle_update_request(self, chat_id: str, text: str, recent_expense:
     async def _get_group_info(self, chat_id: str) -> Optional[Dict]:
         """מחזיר מידע על קבוצה פעילה"""
         try:
-            # עדכון cache אם נדרש
-            if (not self.last_cache_update or 
-                datetime.now() - self.last_cache_update > timedelta(minutes=5)):
-                await self._refresh_groups_cache()
-            
+            await self._ensure_groups_cache()
             return self.active_groups_cache.get(chat_id)
             
         except Exception as e:
             logger.error(f"Failed to get group info: {e}")
             return None
     
-    async def _refresh_groups_cache(self):
+    async def _ensure_groups_cache(self):
+        """מעדכן את cache הקבוצות אם נדרש"""
+        if not self.last_cache_update:
+            await self._refresh_groups_cache()
+            return
+        
+        now = datetime.now()
+        if now - self.last_version_check < timedelta(seconds=GROUP_CACHE_SETTINGS["version_check_seconds"]):
+            return
+        self.last_version_check = now
+        
+        # שינויים שלנו כבר ב-cache; בדיקת הגרסה (של טבלת couples בלבד - כתיבת הוצאות
+        # לא משנה אותה) תופסת עריכות ידניות בגיליון
+        version = await self.db.get_couples_version_async()
+        if version is None:
+            stale = now - self.last_cache_update > timedelta(seconds=GROUP_CACHE_SETTINGS["max_age_seconds"])
+        else:
+            stale = version != self.groups_cache_version
+        
+        if stale:
+            await self._refresh_groups_cache(version)
+    
+    def _on_couple_changed(self, couple: Dict):
+        """מעדכן את ה-cache אחרי כתיבה לזוג, בלי לקרוא שוב את כל הטבלה"""
+        group_id = couple.get('whatsapp_group_id')
+        if not group_id:
+            return
+        
+        if couple.get('status', 'active') == 'active':
+            self.active_groups_cache[group_id] = couple
+            self.phone_index.add_dynamic(
+                phone for phone in (couple.get('phone1'), couple.get('phone2')) if phone
+            )
+        else:
+            self.active_groups_cache.pop(group_id, None)
+    
+    async def _refresh_groups_cache(self, version: Optional[str] = None):
         """מרענן cache של קבוצות פעילות"""
         try:
-            couples = self.db.get_all_active_couples()
+            # הגרסה נלקחת לפני הקריאה - שינוי שנכנס באמצע יגרום לטעינה נוספת ולא יאבד
+            if version is None:
+                version = await self.db.get_couples_version_async()
+            
+            couples = await self.db.get_all_active_couples_async()
             self.active_groups_cache = {}
             
             for couple in couples:
@@ -500,7 +818,13 @@ async def _handle_update_request(self, chat_id: str, text: str, recent_expense:
                 if group_id:
                     self.active_groups_cache[group_id] = couple
             
-            self.last_cache_update = datetime.now()
+            # הזוגות מורשים אוטומטית - האינדקס נבנה מחדש עם הטבלה
+            self.phone_index.set_dynamic(
+                phone for couple in couples for phone in (couple.get('phone1'), couple.get('phone2')) if phone
+            )
+            
+            self.groups_cache_version = version
+            self.last_cache_update = self.last_version_check = datetime.now()
             logger.debug(f"Refreshed groups cache: {len(self.active_groups_cache)} groups")
             
         except Exception as e:
@@ -527,8 +851,8 @@ async def _handle_update_request(self, chat_id: str, text: str, recent_expense:
             logger.error(f"Failed to check edit window: {e}")
             return False
     
-    async def _download_image(self, message_data: Dict) -> Optional[bytes]:
-        """מוריד תמונה מWhatsApp"""
+    async def _download_image(self, message_data: Dict) -> Optional[DownloadedFile]:
+        """מוריד תמונה מWhatsApp - זורק ImageRejectedError לקובץ גדול מדי"""
         try:
             download_url = None
             
@@ -542,15 +866,14 @@ async def _handle_update_request(self, chat_id: str, text: str, recent_expense:
                 logger.error("No download URL found in message")
                 return None
             
-            # הורדת הקובץ
-            async with httpx.AsyncClient(timeout=WHATSAPP_SETTINGS["api_timeout"]) as client:
-                response = await client.get(download_url)
-                response.raise_for_status()
-                
-                image_data = response.content
-                logger.info(f"Downloaded image: {len(image_data)} bytes")
-                return image_data
-                
+            # הורדת הקובץ - נעצרת ברגע שעוברים את המגבלה
+            max_bytes = SAFETY_SETTINGS["max_file_size_mb"] * 1024 * 1024
+            download = await self.green_api.download_file(download_url, max_bytes=max_bytes)
+            logger.info(f"Downloaded image: {len(download.content)} bytes")
+            return download
+            
+        except FileTooLargeError as e:
+            raise ImageRejectedError("too_large", str(e))
         except Exception as e:
             logger.error(f"Failed to download image: {e}")
             return None
@@ -562,66 +885,77 @@ async def _handle_update_request(self, chat_id: str, text: str, recent_expense:
             if not message or message.strip() == "":
                 return True
             
-            url = f"https://api.green-api.com/waInstance{GREENAPI_INSTANCE_ID}/sendMessage/{GREENAPI_TOKEN}"
+            await self.green_api.send_message(chat_id, message)
             
-            payload = {
-                "chatId": chat_id,
-                "message": message
-            }
+            logger.info(f"Message sent to {chat_id}")
+            return True
             
-            async with httpx.AsyncClient(timeout=WHATSAPP_SETTINGS["api_timeout"]) as client:
-                response = await client.post(url, json=payload)
-                response.raise_for_status()
-                
-                logger.info(f"Message sent to {chat_id}")
-                return True
-                
         except Exception as e:
             logger.error(f"Failed to send message to {chat_id}: {e}")
             return False
-async def _handle_advance_payments(self, receipt_data: Dict, group_id: str) -> Dict:
-    """מטפל בזיהוי מקדמות רק לספקים רלוונטיים"""
-    vendor = receipt_data.get('vendor', '').lower()
-    category = receipt_data.get('category', '')
-    
-    if not vendor:
-        return receipt_data
-    
-    # בדיקה אם זה ספק שמקבל מקדמות
-    is_advance_vendor = False
-    
-    # בדיקה לפי קטגוריה
-    if category in ['אולם', 'צילום', 'מוזיקה', 'מזון']:
-        is_advance_vendor = True
-    else:
-        # בדיקה לפי שם הספק
-        for cat, keywords in ADVANCE_PAYMENT_VENDORS.items():
-            if any(keyword in vendor for keyword in keywords):
-                is_advance_vendor = True
-                break
-    
-    # אם זה לא ספק של מקדמות - תמיד תשלום מלא
-    if not is_advance_vendor:
-        receipt_data['payment_type'] = 'full'
-        return receipt_data
     
-    # אם כן - בדוק תשלומים קודמים
-    related_expenses = self.db.find_related_expenses(vendor, group_id)
-    
-    if not related_expenses:
-        # תשלום ראשון לספק מקדמות - מקדמה
-        receipt_data['payment_type'] = 'advance'
-    else:
-        # תשלום נוסף - הופך לסופי
-        receipt_data['payment_type'] = 'final'
+    async def _handle_advance_payments(self, receipt_data: Dict, group_id: str,
+                                       batch: Optional[List[Dict]] = None) -> Dict:
+        """מטפל בזיהוי מקדמות רק לספקים רלוונטיים (batch - קבלות קודמות באלבום שטרם נשמרו)"""
+        vendor = receipt_data.get('vendor', '').lower()
+        category = receipt_data.get('category', '')
+        
+        if not vendor:
+            return receipt_data
+        
+        # בדיקה אם זה ספק שמקבל מקדמות
+        is_advance_vendor = False
+        
+        # בדיקה לפי קטגוריה
+        if category in ['אולם', 'צילום', 'מוזיקה', 'מזון']:
+            is_advance_vendor = True
+        else:
+            # בדיקה לפי שם הספק
+            for cat, keywords in ADVANCE_PAYMENT_VENDORS.items():
+                if any(keyword in vendor for keyword in keywords):
+                    is_advance_vendor = True
+                    break
+        
+        # אם זה לא ספק של מקדמות - תמיד תשלום מלא
+        if not is_advance_vendor:
+            receipt_data['payment_type'] = 'full'
+            return receipt_data
+        
+        # אם כן - בדוק תשלומים קודמים
+        related_expenses = await self.db.find_related_expenses_async(vendor, group_id)
+        
+        # קבלות קודמות באותו אלבום - אותו כלל התאמה כמו find_related_expenses
+        batch_related = [
+            expense for expense in batch or []
+            if expense.get('vendor') and (
+                vendor.strip() in expense['vendor'].lower().strip() or
+                expense['vendor'].lower().strip() in vendor.strip()
+            )
+        ]
+        
+        if not related_expenses and not batch_related:
+            # תשלום ראשון לספק מקדמות - מקדמה
+            receipt_data['payment_type'] = 'advance'
+        else:
+            # תשלום נוסף - הופך לסופי
+            receipt_data['payment_type'] = 'final'
+            
+            # עדכון התשלומים הקודמים למקדמות - בקריאה אחת לגיליון
+            previous = related_expenses + batch_related
+            updates = {}
+            for i, expense in enumerate(previous):
+                payment_type = f"advance_{i+1}" if len(previous) > 1 else "advance"
+                if i < len(related_expenses):
+                    updates[expense['expense_id']] = {'payment_type': payment_type}
+                else:
+                    # עוד לא נשמרה - מתעדכנת לפני הכתיבה
+                    expense['payment_type'] = payment_type
+            
+            if updates:
+                await self.db.update_expenses_bulk_async(updates)
         
-        # עדכון התשלומים הקודמים למקדמות
-        for i, expense in enumerate(related_expenses):
-            payment_type = f"advance_{i+1}" if len(related_expenses) > 1 else "advance"
-            self.db.update_expense(expense['expense_id'], {'payment_type': payment_type})
+        return receipt_data
     
-    return receipt_data
-
     # === סיכומים שבועיים ===
     
     async def send_weekly_summaries(self) -> Dict[str, int]:
@@ -629,7 +963,7 @@ async def _handle_advance_payments(self, receipt_data: Dict, group_id: str) -> D
         results = {"sent": 0, "failed": 0}
         
         try:
-            couples = self.db.get_all_active_couples()
+            couples = await self.db.get_all_active_couples_async()
             
             for couple in couples:
                 group_id = couple.get('whatsapp_group_id')
@@ -662,7 +996,7 @@ async def _handle_advance_payments(self, receipt_data: Dict, group_id: str) -> D
         """מחשב נתוני סיכום שבועי"""
         try:
             # כל ההוצאות של הקבוצה
-            expenses = self.db.get_expenses_by_group(group_id)
+            expenses = await self.db.get_expenses_by_group_async(group_id)
             
             # סינון השבוע האחרון
             week_ago = datetime.now() - timedelta(days=7)
@@ -0,0 +1,83 @@
+import json
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# סוגי כתיבות ביומן
+EXPENSE_APPEND = "expense_append"
+EXPENSE_UPDATE = "expense_update"
+VENDOR_APPEND = "vendor_append"  # יומנים ישנים - מטופל כמו VENDOR_UPSERT
+VENDOR_UPSERT = "vendor_upsert"
+
+class WriteBehindJournal:
+    """יומן כתיבות מקומי (SQLite WAL) לכתיבה מושהית לגיליון.
+
+    כל שינוי נרשם כאן לפני שהבוט עונה למשתמש, ו-flusher ברקע דוחף את
+    השינויים לגיליון. אחרי קריסה השורות שלא נדחפו נשארות ביומן ונשלחות שוב.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pending_writes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                target_key TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            )
+        """)
+
+        pending = self.count()
+        if pending:
+            logger.warning(f"Write journal has {pending} pending write(s) from a previous run")
+
+    def record(self, kind: str, target_key: str, payload: Dict) -> int:
+        """רושם כתיבה ביומן ומחזיר את המזהה שלה"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO pending_writes (kind, target_key, payload, created_at) VALUES (?, ?, ?, ?)",
+                (kind, target_key, json.dumps(payload, ensure_ascii=False),
+                 datetime.now(timezone.utc).isoformat())
+            )
+            return cursor.lastrowid
+
+    def pending(self, limit: int = 500) -> List[Tuple[int, str, str, Dict]]:
+        """מחזיר כתיבות ממתינות לפי סדר הרישום"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, kind, target_key, payload FROM pending_writes ORDER BY id LIMIT ?",
+                (limit,)
+            ).fetchall()
+
+        return [(row_id, kind, key, json.loads(payload)) for row_id, kind, key, payload in rows]
+
+    def remove(self, entry_ids: List[int]):
+        """מוחק כתיבות שנדחפו בהצלחה לגיליון"""
+        if not entry_ids:
+            return
+
+        with self._lock:
+            # SQLite מגביל את מספר הפרמטרים בשאילתה - מוחקים במנות
+            for i in range(0, len(entry_ids), 500):
+                chunk = entry_ids[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                self._conn.execute(f"DELETE FROM pending_writes WHERE id IN ({placeholders})", chunk)
+
+    def count(self) -> int:
+        """מחזיר את מספר הכתיבות הממתינות"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pending_writes").fetchone()[0]
+
+    def close(self):
+        """סוגר את החיבור ליומן"""
+        with self._lock:
+            self._conn.close()